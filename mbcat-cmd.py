@@ -14,9 +14,22 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Runs the MusicBrainz-Catalog shell')
     parser.add_argument('--database', help='Specify the path to the catalog database')
     parser.add_argument('--cache', help='Specify the path to the file cache')
+    parser.add_argument('--stats', metavar='FILE',
+        help='Time the database commands and write the statistics to FILE '
+        'as JSON on exit')
+    parser.add_argument('--slow-queries', metavar='SECONDS', type=float,
+        help='Log the database queries slower than SECONDS (see '
+        '"catalog slow")')
     args = parser.parse_args()
 
     prefs = mbcat.userprefs.PrefManager()
     c = mbcat.catalog.Catalog(dbPath=args.database, cachePath=args.cache, prefs=prefs)
+    if args.stats:
+        c.enableStats()
+    if args.slow_queries is not None:
+        c.enableSlowQueryLog(args.slow_queries)
     s = mbcat.shell.MBCatCmd(catalog=c)
     s.cmdloop()
+    c.close()
+    if args.stats:
+        c.dumpStats(args.stats)
@@ -605,7 +605,14 @@ def ReleaseSearchDialog(parent,
         releaseId = mbcat.utils.getReleaseIdFromInput(input)
         return releaseId
     # else, assume that a search query was entered
-    matches = list(catalog._search(entry))
+    matches = catalog.search(entry)
+    if not matches:
+        # maybe a word was misspelled
+        corrected = catalog.correctQuery(entry)
+        if corrected != entry:
+            _log.info('No matches for "%s", searching for "%s"' % (
+                entry, corrected))
+            matches = catalog.search(corrected)
     if len(matches) > 1:
         # Have to ask the user which release they mean
         return ReleaseSelectDialog(parent, catalog, releaseIdList=matches)
@@ -751,8 +758,7 @@ def TrackSearchDialog(parent,
     if len(entry) == 36:
         matches = [mbcat.utils.getReleaseIdFromInput(input)]
     else: # assume that a search query was entered
-        matches = list(catalog._search(entry, table='trackwords',
-            keycolumn='trackword', outcolumn='recording'))
+        matches = catalog.searchTracks(entry)
     if len(matches) > 1:
         # Have to ask the user which release they mean
         return TrackSelectDialog(parent, catalog, trackIdList=matches)
@@ -1193,25 +1199,14 @@ class TrackListView(gtk.ScrolledWindow):
 
     def makeTreeStore(self, releaseId):
         trackTreeStore = gtk.TreeStore(str, str, str)
-        # TODO this should be a Catalog method
-        for mediumId,position,format in self.catalog.cm.executeAndFetch(
-                'select id,position,format from media '
-                'where release=? order by position',
-                (releaseId,)):
-            trackData = self.catalog.cm.executeAndFetch(
-                    'select recordings.id, recordings.length, '
-                    'medium_recordings.position, recordings.title '
-                    'from recordings '
-                    'inner join medium_recordings on '
-                    'medium_recordings.recording=recordings.id '
-                    'inner join media on medium_recordings.medium=media.id '
-                    'where media.id=? order by medium_recordings.position',
-                    (mediumId,))
+        for mediumId,position,format,trackData in \
+                self.catalog.getMediaTracks(releaseId):
             parent = trackTreeStore.append(None,
                 ('',
                 format+' '+str(position)+' ('+str(len(trackData))+')',
                 mbcat.catalog.recLengthAsString(
-                    self.catalog.getMediumLen(mediumId)
+                    sum(recLength for recId,recLength,recPosition,title
+                        in trackData if recLength)
                     )))
             for recId,recLength,recPosition,title in trackData:
                 trackTreeStore.append(parent,
@@ -2044,30 +2039,32 @@ class DetailPane(gtk.HBox):
 
         self.releaseIdLbl.set_label(releaseId)
 
-        lastRefresh = self.catalog.getMetaTime(releaseId)
+        summary = self.catalog.getReleaseSummary(releaseId)
+
+        lastRefresh = summary['metaTime']
         lastRefresh = mbcat.decodeDate(lastRefresh) if lastRefresh else '-'
         self.lastRefreshLbl.set_text(lastRefresh)
 
-        firstAdded = self.catalog.getFirstAdded(releaseId)
+        firstAdded = summary['firstAdded']
         firstAdded = mbcat.decodeDate(firstAdded) if firstAdded else '-'
         self.firstAddedLbl.set_text(firstAdded)
 
-        lastListened = self.catalog.getLastListened(releaseId)
+        lastListened = summary['lastListened']
         lastListened = mbcat.decodeDate(lastListened) if lastListened else '-'
         self.lastListenedLbl.set_text(lastListened)
 
-        digFormats = self.catalog.getDigitalFormats(releaseId)
+        digFormats = summary['digitalFormats']
         self.digFormatsLbl.set_text(', '.join(digFormats) \
                 if digFormats else 'None')
 
-        rating = self.catalog.getRating(releaseId)
+        rating = summary['rating']
         self.ratingLbl.set_active(int(rating) if rating and rating != 'None' else 0)
 
-        count = self.catalog.getCopyCount(releaseId)
+        count = summary['count']
         self.countSpinButton.set_value(int(count) if count and count != 'None' else 0)
 
-        checkedOut = self.catalog.getCheckOutStatus(releaseId)
-        self.checkOutLbl.set_text(checkedOut[0] if checkedOut else 'No')
+        borrower = summary['borrower']
+        self.checkOutLbl.set_text(borrower if borrower else 'No')
 
 class MBCatGtk:
     """
@@ -2133,6 +2130,9 @@ class MBCatGtk:
 
     def destroy(self, widget, data=None):
         print ("destroy signal occurred")
+        self.catalog.close()
+        if self.statsPath:
+            self.catalog.dumpStats(self.statsPath)
         gtk.main_quit()
 
     def url_hook_func(self, ignore1, url, ignore2):
@@ -2175,6 +2175,7 @@ class MBCatGtk:
     def copyAndOpenDatabase(self, filename):
         import shutil
         # Copy the database to the new location
+        self.catalog.cm.checkpoint()
         shutil.copy(self.catalog.dbPath, filename)
         # Open the new copy
         self.openDatabase(filename)
@@ -2610,6 +2611,15 @@ class MBCatGtk:
             self._setFilterQuick(terms)
             self.refreshView(widget)
 
+    def search_changed_callback(self, widget):
+        """Suggest completions of the last word typed in the search bar"""
+        words = widget.get_text().decode('utf8').split(' ')
+        model = self.searchcompletion.get_model()
+        model.clear()
+        if words[-1]:
+            for word in self.catalog.completeWord(words[-1]):
+                model.append([' '.join(words[:-1] + [word])])
+
     def menuFilterExpression(self, widget):
         expr = TextEntry(self.window,
             'Enter an SQL expression for "where"\n'\
@@ -2963,7 +2973,7 @@ class MBCatGtk:
             str, str, str, str, str)
 
         filtStr = ' and '.join(filter(None, [self.filtFmt, self.filt]))
-        for row in self.catalog.getAdvTable(filtStr):
+        for row in self.catalog.iterAdvTable(filtStr):
             self.releaseList.append(row)
         # Need to add 1 here to get to sort string because of UUID at beginning
         self.releaseList.set_sort_column_id(1, gtk.SORT_ASCENDING)
@@ -3118,9 +3128,14 @@ class MBCatGtk:
             'ReleaseTracklist',
             ]
 
-    def __init__(self, dbPath, cachePath):
+    def __init__(self, dbPath, cachePath, statsPath=None):
         self.prefs = mbcat.userprefs.PrefManager()
         self.catalog = mbcat.catalog.Catalog(dbPath, cachePath, self.prefs)
+        self.statsPath = statsPath
+        if self.statsPath:
+            self.catalog.enableStats()
+        # Edits come in bursts of clicks, so sync them to disk together
+        self.catalog.setGroupCommit(0.5)
         self.filt = ''
         self.filtFmt = ''
 
@@ -3323,6 +3338,13 @@ class MBCatGtk:
         # Add search bar to Toolbar
         self.searchentry = gtk.Entry()
         self.searchentry.connect('activate', self.search_callback)
+        self.searchentry.connect('changed', self.search_changed_callback)
+        self.searchcompletion = gtk.EntryCompletion()
+        self.searchcompletion.set_model(gtk.ListStore(str))
+        self.searchcompletion.set_text_column(0)
+        # the suggestions already match what has been typed
+        self.searchcompletion.set_match_func(lambda *args: True)
+        self.searchentry.set_completion(self.searchcompletion)
         self.searchentry.show()
         searchitem = gtk.ToolItem()
         searchitem.show()
@@ -3373,7 +3395,11 @@ if __name__ == "__main__":
         help='Specify the path to the catalog database')
     parser.add_argument('--cache',
         help='Specify the path to the file cache')
+    parser.add_argument('--stats', metavar='FILE',
+        help='Time the database commands and write the statistics to FILE '
+        'as JSON on exit')
     args = parser.parse_args()
 
-    gui = MBCatGtk(dbPath=args.database, cachePath=args.cache)
+    gui = MBCatGtk(dbPath=args.database, cachePath=args.cache,
+        statsPath=args.stats)
     gui.main()
@@ -1,8 +1,8 @@
 __all__ = ["catalog", "utils", "barcode"]
 
-import re
 import time
 import datetime
+from . import text
 
 dateFmtStr = '%m/%d/%Y'
 dateFmtUsr = 'MM/DD/YYYY'
@@ -27,7 +27,7 @@ def decodeDateTime(dts):
 
 def processWords(field, d):
     if field in d:
-        return re.findall(r"[\w'.]+", d[field].lower(), re.UNICODE)
+        return text.tokenize(d[field])
     elif field != 'disambiguation':
         _log.warning('Release '+relId+' is missing the '+field+' field')
     return set()
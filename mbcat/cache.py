@@ -0,0 +1,89 @@
+"""
+A least recently used cache, bounded by the total size of its entries.
+
+Each entry is stored with a version, such as the time its source was last
+modified, and is only returned for that version, so that an entry which has
+gone stale is never used even if it was not invalidated.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Keep up to 'maxSize' worth of values, as measured by the sizes given to
+    put(), dropping the least recently used first. The cache can be used
+    from several threads.
+    """
+    def __init__(self, maxSize):
+        self.lock = threading.Lock()
+        self.maxSize = maxSize
+        self.entries = OrderedDict() # key -> (version, value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, version=None):
+        """Return the value of a key at a version, or None if there is
+        none."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self.size -= entry[2]
+                self.misses += 1
+                return None
+            # move it to the most recently used end
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, size=1, version=None):
+        """Store the value of a key at a version."""
+        with self.lock:
+            self._discard(key)
+            if size > self.maxSize:
+                return
+            self.entries[key] = (version, value, size)
+            self.size += size
+            self._shrink()
+
+    def _shrink(self):
+        while self.size > self.maxSize:
+            key, (version, value, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def discard(self, key):
+        """Drop the value of a key, if it is cached."""
+        with self.lock:
+            self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def resize(self, maxSize):
+        """Change the size limit, dropping entries to fit."""
+        with self.lock:
+            self.maxSize = maxSize
+            self._shrink()
+
+    def asDict(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'size': self.size,
+                'maxSize': self.maxSize,
+                }
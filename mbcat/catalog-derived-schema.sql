@@ -1,50 +1,108 @@
 -- This file drops and creates the tables for information derived from
 -- the MusicBrainz webservice XML metadata.
+--
+-- The releases and recordings are referred to by their integer keys, not by
+-- their MBIDs, which would be repeated in every row and index entry.
 DROP TABLE IF EXISTS words;
 CREATE TABLE words (
-    word TEXT, release TEXT,
+    word TEXT, release INTEGER,
+    FOREIGN KEY(release) REFERENCES releases(key)
+    ON DELETE CASCADE ON UPDATE CASCADE);
+
+-- The words in alphabetical order, with the number of releases having each,
+-- for completing search terms. The triggers keep it up to date with words.
+DROP TABLE IF EXISTS word_counts;
+CREATE TABLE word_counts (
+    word TEXT PRIMARY KEY,
+    releases INTEGER) WITHOUT ROWID;
+
+CREATE TRIGGER word_counts_insert AFTER INSERT ON words BEGIN
+    INSERT OR IGNORE INTO word_counts (word, releases) VALUES (new.word, 0);
+    UPDATE word_counts SET releases=releases+1 WHERE word=new.word;
+END;
+
+CREATE TRIGGER word_counts_delete AFTER DELETE ON words BEGIN
+    UPDATE word_counts SET releases=releases-1 WHERE word=old.word;
+    DELETE FROM word_counts WHERE word=old.word AND releases<=0;
+END;
+
+-- The trigrams of the words in the words and trackwords tables, to find the
+-- indexed words most similar to a misspelled one. The trigrams of a word
+-- which is no longer indexed are left behind until the next rebuild.
+DROP TABLE IF EXISTS word_trigrams;
+CREATE TABLE word_trigrams (
+    trigram TEXT,
+    word TEXT,
+    PRIMARY KEY (trigram, word)) WITHOUT ROWID;
+
+-- The parsed XML metadata of each release, see Catalog.getRelease()
+DROP TABLE IF EXISTS release_dicts;
+CREATE TABLE release_dicts (
+    release TEXT PRIMARY KEY,
+    dict BLOB,
     FOREIGN KEY(release) REFERENCES releases(id)
     ON DELETE CASCADE ON UPDATE CASCADE);
 
 DROP TABLE IF EXISTS media;
 CREATE TABLE media (
-    id TEXT PRIMARY KEY,
+    id INTEGER PRIMARY KEY,
     position INTEGER,
     format TEXT,
-    release TEXT,
-    FOREIGN KEY(release) REFERENCES releases(id)
+    release INTEGER,
+    FOREIGN KEY(release) REFERENCES releases(key)
     ON DELETE CASCADE ON UPDATE CASCADE);
 
 DROP TABLE IF EXISTS medium_recordings;
 CREATE TABLE medium_recordings (
-    recording TEXT,
+    recording INTEGER,
     position INTEGER,
-    medium TEXT,
+    medium INTEGER,
     FOREIGN KEY(medium) REFERENCES media(id)
     ON DELETE CASCADE ON UPDATE CASCADE,
-    FOREIGN KEY (recording) REFERENCES recordings(id)
+    FOREIGN KEY (recording) REFERENCES recordings(key)
     ON DELETE CASCADE ON UPDATE CASCADE);
 
 DROP TABLE IF EXISTS trackwords;
 CREATE TABLE trackwords (
-    trackword TEXT, recording TEXT,
-    FOREIGN KEY(recording) REFERENCES recordings(id)
+    trackword TEXT, recording INTEGER,
+    FOREIGN KEY(recording) REFERENCES recordings(key)
     ON DELETE CASCADE ON UPDATE CASCADE);
 
 DROP TABLE IF EXISTS discids;
 CREATE TABLE discids (
     id TEXT,
     sectors INTEGER,
-    medium TEXT,
+    medium INTEGER,
     FOREIGN KEY(medium) REFERENCES media(id)
     ON DELETE CASCADE ON UPDATE CASCADE);
 
 -- Indexes for speed (it's all about performance...)
 DROP INDEX IF EXISTS word_index;
-CREATE INDEX word_index ON words (word);
+CREATE INDEX word_index ON words (word, release);
 
 DROP INDEX IF EXISTS trackword_index;
-CREATE INDEX trackword_index ON trackwords (trackword);
+CREATE INDEX trackword_index ON trackwords (trackword, recording);
+
+DROP INDEX IF EXISTS words_release;
+CREATE INDEX words_release ON words (release);
+
+DROP INDEX IF EXISTS trackwords_recording;
+CREATE INDEX trackwords_recording ON trackwords (recording);
+
+DROP INDEX IF EXISTS media_release;
+CREATE INDEX media_release ON media (release);
+
+DROP INDEX IF EXISTS medium_recordings_medium;
+CREATE INDEX medium_recordings_medium ON medium_recordings (medium);
+
+DROP INDEX IF EXISTS medium_recordings_recording;
+CREATE INDEX medium_recordings_recording ON medium_recordings (recording);
+
+DROP INDEX IF EXISTS discids_id;
+CREATE INDEX discids_id ON discids (id);
+
+DROP INDEX IF EXISTS discids_medium;
+CREATE INDEX discids_medium ON discids (medium);
 
 DROP INDEX IF EXISTS digital_releases;
 CREATE INDEX digital_releases ON digital(release);
@@ -1,7 +1,9 @@
 -- This file contains the schema to represent user data
+-- The derived tables refer to each release and recording by its key rather
+-- than by its MBID, see catalog-derived-schema.sql
 CREATE TABLE releases(
-    id TEXT PRIMARY KEY,
-    meta BLOB,
+    key INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
     sortstring TEXT,
     artist TEXT,
     title TEXT,
@@ -16,7 +18,20 @@ CREATE TABLE releases(
     metatime FLOAT,
     count INT DEFAULT 1,
     comment TEXT,
-    rating INT DEFAULT 0);
+    rating INT DEFAULT 0,
+    -- the earliest of the added_dates, see Catalog._refreshFirstAdded()
+    firstadded FLOAT);
+
+-- The XML metadata of each release, compressed, see Catalog.compressMeta().
+-- It is kept out of the releases table so that scans of that table do not
+-- have to page through it. The hash tells a refresh which has fetched the
+-- same metadata again, see Catalog.metaHash().
+CREATE TABLE release_meta (
+    release TEXT PRIMARY KEY,
+    meta BLOB,
+    hash BLOB,
+    FOREIGN KEY(release) REFERENCES releases(id)
+    ON DELETE CASCADE ON UPDATE CASCADE);
 
 CREATE TABLE added_dates(
     date FLOAT,
@@ -75,15 +90,42 @@ CREATE TABLE digital (
     ON DELETE CASCADE ON UPDATE CASCADE);
 
 CREATE TABLE recordings (
-    id TEXT PRIMARY KEY,
+    key INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
     length INTEGER,
     number INTEGER,
     title TEXT,
     rating INT DEFAULT 0);
 
+-- What the detail pane shows about each release, kept up to date by the
+-- methods that write the underlying events and media
+CREATE TABLE release_summary (
+    release TEXT PRIMARY KEY,
+    last_listened FLOAT,
+    borrower TEXT,
+    checked_out FLOAT,
+    track_count INTEGER,
+    length INTEGER,
+    digital_formats TEXT,
+    FOREIGN KEY(release) REFERENCES releases(id)
+    ON DELETE CASCADE ON UPDATE CASCADE);
+
+-- Dictionaries for compressing the XML in release_meta, see
+-- Catalog.compressMeta()
+CREATE TABLE meta_dictionaries (
+    id INTEGER PRIMARY KEY,
+    dictionary BLOB);
+
 -- Indexes for speed (it's all about performance...)
 CREATE UNIQUE INDEX release_id ON releases(id);
 CREATE INDEX release_sortstring ON releases(sortstring);
 CREATE INDEX release_catno ON releases(catno);
 CREATE INDEX release_barcode ON releases(barcode);
 CREATE INDEX release_asin ON releases(asin);
+CREATE INDEX release_sortformat ON releases(sortformat);
+CREATE UNIQUE INDEX recording_id ON recordings(id);
+CREATE INDEX added_dates_release ON added_dates(release);
+CREATE INDEX listened_dates_release ON listened_dates(release);
+CREATE INDEX purchases_release ON purchases(release);
+CREATE INDEX checkout_events_release ON checkout_events(release);
+CREATE INDEX checkin_events_release ON checkin_events(release);
@@ -0,0 +1,29 @@
+-- This file drops and creates the full-text search tables, which need the
+-- SQLite FTS5 extension. See mbcat/search.py.
+--
+-- FTS5 tables are only indexed by rowid, so each release and recording is
+-- given a document ID in a regular table. The document ID is the rowid of
+-- its row in the full-text table.
+DROP TABLE IF EXISTS release_fts;
+CREATE VIRTUAL TABLE release_fts USING fts5(
+    title, artist, label, catno, tracks,
+    tokenize='unicode61 remove_diacritics 1');
+
+DROP TABLE IF EXISTS release_fts_docs;
+CREATE TABLE release_fts_docs (
+    docid INTEGER PRIMARY KEY,
+    release TEXT UNIQUE,
+    FOREIGN KEY(release) REFERENCES releases(id)
+    ON DELETE CASCADE ON UPDATE CASCADE);
+
+DROP TABLE IF EXISTS recording_fts;
+CREATE VIRTUAL TABLE recording_fts USING fts5(
+    title,
+    tokenize='unicode61 remove_diacritics 1');
+
+DROP TABLE IF EXISTS recording_fts_docs;
+CREATE TABLE recording_fts_docs (
+    docid INTEGER PRIMARY KEY,
+    recording TEXT UNIQUE,
+    FOREIGN KEY(recording) REFERENCES recordings(id)
+    ON DELETE CASCADE ON UPDATE CASCADE);
@@ -14,6 +14,11 @@ from . import utils
 from . import extradata
 from . import dialogs
 from . import processWords
+from . import stats
+from . import search
+from . import text
+from . import cache
+from . import compression
 import shutil
 from datetime import datetime
 from collections import defaultdict
@@ -22,6 +27,10 @@ import progressbar
 import logging
 _log = logging.getLogger("mbcat")
 import zlib
+import hashlib
+import re
+import marshal
+import struct
 import sqlite3
 import itertools
 import uuid
@@ -46,9 +55,117 @@ else:
     ETREE_EXCEPTIONS = (expat.ExpatError)
 
 import threading
+import multiprocessing
+import contextlib
 from collections import deque
+
+class QueryTimeout(Exception):
+    """Raised when the result of a query is not ready in time."""
+
+class QueryFuture(object):
+    """
+    The pending result of a command queued on a ConnectionManager. The
+    result, or the exception raised by the command, is handed to whoever
+    waits on result(), so nothing is left behind if it is never collected.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def _finish(self, result=None, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def set_result(self, result):
+        self._finish(result=result)
+
+    def set_exception(self, exception):
+        self._finish(exception=exception)
+
+    def done(self):
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        """Wait for the command to finish. Return True if it has."""
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def exception(self, timeout=None):
+        """
+        Return the exception raised by the command, or None if it succeeded.
+        Raise QueryTimeout if it does not finish within 'timeout' seconds.
+        """
+        if not self.wait(timeout):
+            raise QueryTimeout('query did not finish in %s s' % timeout)
+        return self._exception
+
+    def result(self, timeout=None):
+        """
+        Return the result of the command, or raise the exception that it
+        raised. Raise QueryTimeout if it does not finish within 'timeout'
+        seconds.
+        """
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(future) when the command finishes, or right away if it
+        already has. The callback runs in the manager thread, so it should
+        be quick.
+        """
+        with self._lock:
+            if not self._done.isSet():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
 class ConnectionManager(threading.Thread):
+    """
+    Owns the connection to the database in a thread of its own and executes
+    queued commands on it one at a time.
+
+    The manager thread is the only writer. If 'readers' is non-zero, the
+    database is put in WAL mode and that many read-only managers are started
+    alongside it, so that queries can run in parallel with each other and
+    with a long write. A thread that has queued writes which are not
+    committed yet keeps reading through the writer so that it sees its own
+    changes.
+
+    If 'groupCommit' is a positive number of seconds, commit() does not wait
+    for the commit. Instead, all of the commits requested within that window
+    are coalesced into one. Call close() to flush any pending commit.
+
+    If 'stats' is True, each command is timed (see enableStats()). If
+    'slowQueries' is a number of seconds, statements which take longer are
+    logged (see enableSlowQueryLog()).
+
+    Commands are queued in one of two lanes. Commands from threads with a
+    true 'background' attribute, like the ThreadedTasks that rebuild or
+    import the catalog, go in the background lane. Everything else, like
+    the queries behind the user interface, is interactive and runs first.
+    Each lane keeps its own order. So that bulk work is never starved, a
+    waiting background command runs after at most 'backgroundShare'
+    interactive commands in a row.
+    """
+    backgroundShare = 4
+
     def __init__(self, *args, **kwargs):
+        self.numReaders = kwargs.pop('readers', 0)
+        self.groupCommitDelay = kwargs.pop('groupCommit', 0)
+        self.readOnly = kwargs.pop('readOnly', False)
+        collectStats = kwargs.pop('stats', False)
+        slowQueryThreshold = kwargs.pop('slowQueries', None)
         self.child_args = args
         self.child_kwargs = kwargs
         threading.Thread.__init__(self)
@@ -58,28 +175,60 @@ class ConnectionManager(threading.Thread):
         self.cmdReady = threading.Event()
         self.shutdown = threading.Event()
         self.cmdQueue = deque()
-        self.results = dict()
+        self.backgroundQueue = deque()
+        self.interactiveStreak = 0
+        self.running = False
+
+        # threads with uncommitted writes, mapped to their latest write
+        self.dirtyThreads = dict()
+        # and to their latest write that has been executed
+        self.writtenThreads = dict()
+        self.writeSeq = itertools.count()
+        self.writeLock = threading.Lock()
+        # threads inside a transaction scope, mapped to the nesting depth
+        self.deferringThreads = dict()
+        self.groupCommitTimer = None
+        # iterFetch() generators with a cursor open on this connection
+        self.streams = set()
+
+        self.stats = None
+        self.slowLog = None
+        self.readers = []
+        self.enableStats(collectStats)
 
         self.start()
 
+        if self.numReaders:
+            self.isReady.wait()
+            if self.journalMode == 'wal':
+                for i in range(self.numReaders):
+                    reader = ConnectionManager(*args, readOnly=True,
+                            stats=collectStats, **kwargs)
+                    self.readers.append(reader)
+            else:
+                _log.warning('Database journal mode is \'%s\', not using '
+                        'reader connections' % self.journalMode)
+
+        if slowQueryThreshold is not None:
+            self.enableSlowQueryLog(slowQueryThreshold)
+
     def _create_children(self):
         # Open and retain a connection to the database
         # The single, coveted connection object
         self.conn = sqlite3.connect(*self.child_args, **self.child_kwargs)
         # this connection is closed when this object is deleted
         self.conn.execute('pragma foreign_keys=ON')
-
-        # This connection and cursor should be enough for most work. You might
-        # need a second cursor if you, for example, have a double-nested 'for'
-        # loop where you are cross-referencing things:
-        #
-        # myconn = self._connection()
-        # mycur = myconn.cursor()
-        # self.curs.execute('first query')
-        # mycur.execute('second query')
-        # for first in self.curs:
-        #     for second in mycur:
-        #         "do something with 'first' and 'second'"
+        if self.readOnly:
+            self.conn.execute('pragma query_only=ON')
+        elif self.numReaders:
+            # Write-ahead logging lets readers work on the last committed
+            # state of the database while the writer is busy.
+            self.journalMode = self.conn.execute(
+                    'pragma journal_mode=wal').fetchone()[0]
+
+        # This cursor is only used for statements that return no rows. Queries
+        # get a cursor of their own (see _executeAndFetch()) so that results
+        # can never be picked up by another command.
         self.curs = self.conn.cursor()
 
         self.isReady.set()
@@ -97,37 +246,91 @@ class ConnectionManager(threading.Thread):
                 break
             # If more cmdReady was set more than once before we got here, we
             # would miss commands, so we process the queue until it is empty.
-            while len(self.cmdQueue):
-                # popleft removes and returns an element from the left side
-                fun, event, args, kwargs = self.cmdQueue.popleft()
+            while len(self.cmdQueue) or len(self.backgroundQueue):
+                fun, future, queued, write, args, kwargs = self._nextCmd()
+                self.running = True
+                timed = queued is not None or self.slowLog is not None
+                if timed:
+                    started = time.time()
+                result = exception = None
                 try:
-                    _log.debug(str(fun)+str(args)+str(kwargs))
+                    if _log.isEnabledFor(logging.DEBUG):
+                        _log.debug(str(fun)+str(args)+str(kwargs))
                     result = fun(*args, **kwargs)
-                except sqlite3.OperationalError as e:
-                    _log.error(str(e))
-                    result = e
-                except sqlite3.IntegrityError as e:
-                    _log.error(str(e))
-                    result = e
-                if event:
-                    self.results[event] = result
-                    event.set()
-
-    def _queueCmd(self, fun, event, *args, **kwargs):
+                except Exception as e:
+                    exception = e
+                    if not future:
+                        # nobody is waiting to hear about it
+                        _log.error(str(e))
+                if write:
+                    ident, seq = write
+                    self.writtenThreads[ident] = seq
+                if timed:
+                    finished = time.time()
+                    if queued is not None and self.stats is not None:
+                        self.stats.finished(stats.statementOf(fun, args),
+                                queued, started, finished)
+                    slowLog = self.slowLog
+                    if slowLog is not None and exception is None and \
+                            finished - started > slowLog.threshold:
+                        self._logSlowQuery(slowLog, fun, args,
+                                finished - started)
+                self.running = False
+                if future:
+                    if exception is not None:
+                        future.set_exception(exception)
+                    else:
+                        future.set_result(result)
+
+        self.conn.close()
+        # fail anything queued after stop() rather than leave it hanging
+        for queue in [self.cmdQueue, self.backgroundQueue]:
+            while len(queue):
+                future = queue.popleft()[1]
+                if future:
+                    future.set_exception(sqlite3.ProgrammingError(
+                            'The connection manager was stopped'))
+
+    def _nextCmd(self):
+        """
+        Remove and return the next command to run: an interactive one if
+        there is any, unless a background command has waited for
+        backgroundShare interactive commands already.
+        """
+        if len(self.backgroundQueue) and (not len(self.cmdQueue) or
+                self.interactiveStreak >= self.backgroundShare):
+            self.interactiveStreak = 0
+            # popleft removes and returns an element from the left side
+            return self.backgroundQueue.popleft()
+        self.interactiveStreak += 1
+        return self.cmdQueue.popleft()
+
+    def _queueCmd(self, fun, future, *args, **kwargs):
+        self._queueInLane(fun, future, None, args, kwargs)
+
+    def _queueInLane(self, fun, future, write, args, kwargs):
+        if getattr(threading.current_thread(), 'background', False):
+            queue = self.backgroundQueue
+        else:
+            queue = self.cmdQueue
+        if self.stats is not None:
+            self.stats.enqueued(self.load())
+            queued = time.time()
+        else:
+            queued = None
         # append adds x to the right side of the deque
-        self.cmdQueue.append((fun, event, args, kwargs))
+        queue.append((fun, future, queued, write, args, kwargs))
         self.cmdReady.set() # wake the thread loop out of wait
 
     def queueQuery(self, fun, *args, **kwargs):
         """
         Queue a function with arguments to be executed by the manager thread.
-        This will return an event which can be used to fetch the result of the
-        function. If the result is not fetched, the result dictionary will
-        leak---use queueCmd instead.
+        This will return a QueryFuture which holds the result of the function,
+        or the exception that it raised.
         """
-        event = threading.Event()
-        self._queueCmd(fun, event, *args, **kwargs)
-        return event
+        future = QueryFuture()
+        self._queueCmd(fun, future, *args, **kwargs)
+        return future
 
     def queueCmd(self, fun, *args, **kwargs):
         """
@@ -136,33 +339,186 @@ class ConnectionManager(threading.Thread):
         """
         self._queueCmd(fun, None, *args, **kwargs)
 
-    def getResult(self, event):
+    def _createFunction(self, name, numParams, fun):
+        self.conn.create_function(name, numParams, fun)
+
+    def createFunction(self, name, numParams, fun):
         """
-        Get the result associated with an event. Return None if the event was
-        not found.
+        Make a Python function available to the SQL run by this manager and
+        its readers. See sqlite3.Connection.create_function().
         """
-        return self.results.pop(event, None)
+        for manager in [self] + self.readers:
+            manager.isReady.wait() # wait for the connection to be ready
+            manager.queueAndGet(manager._createFunction, name, numParams, fun)
+
+    def getResult(self, future, timeout=None):
+        """
+        Wait for a future returned by queueQuery() and return its result. If
+        the command raised an exception, it is raised here.
+        """
+        return future.result(timeout)
 
     def queueAndGet(self, fun, *args, **kwargs):
         """
         A convenience function which queues the command, waits until it is
         done, and then returns the result.
         """
-        event = self.queueQuery(fun, *args, **kwargs)
-        event.wait()
-        return self.getResult(event)
+        return self.queueQuery(fun, *args, **kwargs).result()
 
     def stop(self):
+        for reader in self.readers:
+            reader.stop()
         self.shutdown.set()
         self.cmdReady.set()
 
+    def close(self):
+        """Commit anything that is pending, then stop this manager and its
+        readers and wait for them to finish. Closing again does nothing."""
+        self.isReady.wait() # wait for the connection to be ready
+        if not self.shutdown.is_set():
+            if not self.readOnly:
+                self._flush()
+            self.stop()
+        for manager in [self] + self.readers:
+            if manager is not threading.current_thread():
+                manager.join()
+
+    def enableStats(self, enabled=True):
+        """
+        Start or stop timing the commands run by this manager and its readers.
+        Starting again clears the statistics collected so far.
+        """
+        for manager in [self] + self.readers:
+            if enabled:
+                manager.stats = stats.ConnectionStats(
+                        'reader' if manager.readOnly else 'writer')
+            else:
+                manager.stats = None
+
+    def enableSlowQueryLog(self, threshold=0.1):
+        """
+        Log the statements run by this manager and its readers which take
+        longer than 'threshold' seconds, or stop logging if it is None.
+        """
+        if threshold is None:
+            slowLog = None
+        else:
+            slowLog = stats.SlowQueryLog(threshold)
+        for manager in [self] + self.readers:
+            manager.slowLog = slowLog
+
+    def _explain(self, statement, params):
+        """
+        Return the query plan of a statement. The sqlite3 module commits the
+        open transaction before a statement like EXPLAIN, so the writer
+        explains on a read-only connection opened for the purpose, which
+        does not see what the writer has not committed. A connection kept
+        open for this would plan with the schema it first read.
+        """
+        if self.readOnly:
+            conn = self.conn
+        else:
+            conn = sqlite3.connect(*self.child_args, **self.child_kwargs)
+            conn.execute('pragma query_only=ON')
+        try:
+            return [row[-1] for row in conn.execute(
+                    'explain query plan '+statement, params)]
+        finally:
+            if conn is not self.conn:
+                conn.close()
+
+    def _logSlowQuery(self, slowLog, fun, args, seconds):
+        """Add a statement that ran slowly to the log, with its plan."""
+        statement, params = stats.splitStatement(args)
+        if statement is None or fun == self.curs.executescript:
+            return
+        if fun == self.curs.executemany:
+            # explain the statement with the first row of parameters
+            params = params[0] if isinstance(params, (list, tuple)) \
+                    and params else None
+        if params is None:
+            plan = []
+        else:
+            try:
+                plan = self._explain(statement, params)
+            except sqlite3.Error as e:
+                plan = ['(could not explain: %s)' % e]
+        slowLog.add(statement, params, seconds, plan)
+
+    def getSlowQueries(self):
+        """
+        Return the summary of the slow-query log (see
+        SlowQueryLog.summary()), or None if it is not enabled.
+        """
+        if self.slowLog is None:
+            return None
+        return self.slowLog.summary()
+
+    def getStats(self):
+        """
+        Return the statistics of this manager and its readers as a
+        dictionary, or None if they are not being collected.
+        """
+        if self.stats is None:
+            return None
+        return {
+            'writer': self.stats.asDict(),
+            'readers': [reader.stats.asDict() for reader in self.readers
+                if reader.stats is not None],
+            }
+
+    def load(self):
+        """Return the number of commands waiting for or running on this
+        manager."""
+        return len(self.cmdQueue) + len(self.backgroundQueue) + \
+                (1 if self.running else 0)
+
+    def _queueWrite(self, fun, *args, **kwargs):
+        """
+        Queue a command that modifies the database and remember that the
+        calling thread has uncommitted changes.
+        """
+        self.isReady.wait() # wait for the connection to be ready
+        ident = threading.current_thread().ident
+        with self.writeLock:
+            seq = next(self.writeSeq)
+            self.dirtyThreads[ident] = seq
+            self._queueInLane(fun, None, (ident, seq), args, kwargs)
+
+    def _reader(self):
+        """
+        Return the manager that should serve a query from the calling thread:
+        the least busy reader, or this manager if there are no readers or if
+        the thread has to see its own uncommitted writes.
+
+        A reader with a cursor open for iterFetch() is passed over, because
+        it reads the database as it was when the cursor was opened and would
+        not see what has been committed since. If every reader has one, this
+        manager serves the query.
+        """
+        if threading.current_thread().ident in self.dirtyThreads:
+            return self
+        readers = [reader for reader in self.readers if not reader.streams]
+        if not readers:
+            return self
+        return min(readers, key=lambda reader: reader.load())
+
     def execute(self, *argv, **kwargs):
         """
         A convenience function that queues a command to be executed on the
         cursor and expects no results. Result is discarded.
         """
         self.isReady.wait() # wait for the connection to be ready
-        self.queueCmd(self.curs.execute, *argv, **kwargs)
+        self._queueWrite(self.curs.execute, *argv, **kwargs)
+
+    def executemany(self, *argv, **kwargs):
+        """
+        A convenience function that queues a statement to be executed once for
+        each row in a sequence of parameters. The whole batch is one queued
+        command. Result is discarded.
+        """
+        self.isReady.wait() # wait for the connection to be ready
+        self._queueWrite(self.curs.executemany, *argv, **kwargs)
 
     def executescript(self, *argv, **kwargs):
         """
@@ -170,48 +526,299 @@ class ConnectionManager(threading.Thread):
         cursor and expects no results. Result is discarded.
         """
         self.isReady.wait() # wait for the connection to be ready
-        self.queueCmd(self.curs.executescript, *argv, **kwargs)
+        self._queueWrite(self.curs.executescript, *argv, **kwargs)
+
+    def _runScript(self, script):
+        try:
+            self.curs.executescript(script)
+        except:
+            # A script which failed part way may leave its transaction open.
+            # The sqlite3 module does not know of a transaction begun by a
+            # script, so it is rolled back here rather than with rollback().
+            try:
+                self.curs.execute('ROLLBACK')
+            except sqlite3.OperationalError:
+                pass # there was no transaction open
+            raise
+
+    def runScript(self, script):
+        """
+        Execute a script which begins and commits its own transaction, and
+        wait for it to finish. If it fails, it is rolled back and the error
+        is raised here.
+        """
+        self.isReady.wait() # wait for the connection to be ready
+        return self.queueAndGet(self._runScript, script)
+
+    @staticmethod
+    def fetchAll(curs):
+        return curs.fetchall()
+
+    @staticmethod
+    def fetchOne(curs):
+        return curs.fetchone()
+
+    @staticmethod
+    def fetchChain(curs):
+        """Chain the rows together (e.g., [('a',), ('b',)] -> ['a', 'b'])."""
+        return list(itertools.chain.from_iterable(curs.fetchall()))
+
+    def _executeAndFetch(self, fetch, *argv):
+        """
+        Execute a statement on its own cursor and return fetch(cursor). This
+        runs in the manager thread as a single command, so no other command
+        can run between the statement and the fetch.
+        """
+        curs = self.conn.cursor()
+        try:
+            curs.execute(*argv)
+            return fetch(curs)
+        finally:
+            curs.close()
+
+    def queueFetch(self, fetch, *argv):
+        """
+        Queue a statement to be executed and fetched with one of fetchAll,
+        fetchOne or fetchChain. This returns a future like queueQuery(), so
+        several queries can be in flight at once and their results collected
+        later:
+
+        futures = [cm.queueFetch(cm.fetchOne, 'select title from releases '
+            'where id=?', (releaseId,)) for releaseId in releaseIds]
+        titles = [future.result()[0] for future in futures]
+        """
+        reader = self._reader()
+        reader.isReady.wait() # wait for the connection to be ready
+        return reader.queueQuery(reader._executeAndFetch, fetch, *argv)
 
     def executeAndFetch(self, *argv):
         """
         A convenience function that queues a command to be executed, waits for
         it to finish and returns the result.
         """
-        self.isReady.wait() # wait for the connection to be ready
-        self.queueAndGet(self.curs.execute, *argv)
-        # PROBLEM: another command might get the result before this does
-        return self.queueAndGet(self.curs.fetchall)
+        reader = self._reader()
+        reader.isReady.wait() # wait for the connection to be ready
+        return reader.queueAndGet(reader._executeAndFetch, self.fetchAll, *argv)
 
     def executeAndFetchOne(self, *argv):
         """
         A convenience function that queues a command to be executed, waits for
         and fetches a one-row result.
         """
-        self.isReady.wait() # wait for the connection to be ready
-        self.queueAndGet(self.curs.execute, *argv)
-        # PROBLEM: another command might get the result before this does
-        return self.queueAndGet(self.curs.fetchone)
+        reader = self._reader()
+        reader.isReady.wait() # wait for the connection to be ready
+        return reader.queueAndGet(reader._executeAndFetch, self.fetchOne, *argv)
 
     def executeAndChain(self, *argv):
         """
         A convenience function that queues a command to be executed, fetches the
         results and chains them together (e.g., [('a',), ('b',)] -> ['a', 'b']).
         """
+        reader = self._reader()
+        reader.isReady.wait() # wait for the connection to be ready
+        return reader.queueAndGet(reader._executeAndFetch, self.fetchChain, *argv)
+
+    def _openCursor(self, *argv):
+        curs = self.conn.cursor()
+        curs.execute(*argv)
+        return curs
+
+    @staticmethod
+    def _fetchChunk(curs, size):
+        rows = curs.fetchmany(size)
+        if len(rows) < size:
+            curs.close()
+        return rows
+
+    def iterFetch(self, *argv, **kwargs):
+        """
+        Execute a query and generate its rows, fetched 'chunkSize' at a time,
+        so that the whole result never has to be held in memory. The next
+        chunk is fetched while the caller works on the current one.
+
+        Only the reader connections, which never commit, can keep a cursor
+        open between commands: a commit resets the open cursors. When the
+        query would run on the writer, the rows are fetched all at once.
+        While the cursor is open, other queries go to another connection
+        (see _reader()).
+        """
+        chunkSize = kwargs.pop('chunkSize', 500)
+        reader = self._reader()
+        if reader is self:
+            for row in self.executeAndFetch(*argv):
+                yield row
+            return
+        reader.isReady.wait() # wait for the connection to be ready
+        # keep other queries off this reader while the cursor is open
+        stream = object()
+        reader.streams.add(stream)
+        curs = None
+        try:
+            curs = reader.queueAndGet(reader._openCursor, *argv)
+            rows = reader.queueAndGet(reader._fetchChunk, curs, chunkSize)
+            while rows:
+                if len(rows) < chunkSize:
+                    # that was the last chunk
+                    curs = None
+                    pending = None
+                    reader.streams.discard(stream)
+                else:
+                    pending = reader.queueQuery(
+                            reader._fetchChunk, curs, chunkSize)
+                for row in rows:
+                    yield row
+                rows = pending.result() if pending else []
+        finally:
+            if curs is not None:
+                # the caller stopped early, or the fetch failed
+                reader.queueCmd(curs.close)
+            reader.streams.discard(stream)
+
+    def iterChain(self, *argv, **kwargs):
+        """Like iterFetch(), but generate the first column of each row."""
+        for row in self.iterFetch(*argv, **kwargs):
+            yield row[0]
+
+    def _settleWrites(self):
+        """
+        Forget about the threads whose writes have all been executed, after
+        a commit or rollback. The writes of a thread in the other lane may
+        still be queued, so that thread stays dirty until the next one.
+        """
+        with self.writeLock:
+            for ident, lastWrite in list(self.dirtyThreads.items()):
+                if self.writtenThreads.get(ident) == lastWrite:
+                    del self.dirtyThreads[ident]
+                    del self.writtenThreads[ident]
+
+    def _commit(self):
+        self.conn.commit()
+        # the writes executed so far are now visible to the readers
+        self._settleWrites()
+
+    def _rollback(self):
+        self.conn.rollback()
+        self._settleWrites()
+
+    def _beginExplicit(self):
+        self.isolationLevel = self.conn.isolation_level
+        self.conn.isolation_level = None
+        self.curs.execute('BEGIN')
+
+    def _endExplicit(self, rollback):
+        try:
+            self.curs.execute('ROLLBACK' if rollback else 'COMMIT')
+        except:
+            if not rollback:
+                self.curs.execute('ROLLBACK')
+            raise
+        finally:
+            self.conn.isolation_level = self.isolationLevel
+            self._settleWrites()
+
+    def beginExplicit(self):
+        """
+        Begin a transaction which lasts until endExplicit(). Unlike the
+        transactions that the sqlite3 module begins on its own, this one
+        takes in statements like ALTER TABLE and PRAGMA user_version, before
+        which the module would otherwise commit.
+        """
+        self.isReady.wait() # wait for the connection to be ready
+        if self.groupCommitTimer:
+            self._flush()
+        self._flush(self._beginExplicit)
+
+    def endExplicit(self, rollback=False):
+        """Commit the transaction begun by beginExplicit(), or roll it back
+        if 'rollback' is True, and wait for that to finish."""
+        self._flush(lambda: self._endExplicit(rollback))
+
+    def _flush(self, fun=None):
+        """
+        Queue a commit (or another function, like _rollback) and wait for it
+        to complete.
+        """
         self.isReady.wait() # wait for the connection to be ready
-        self.queueAndGet(self.curs.execute, *argv)
-        # PROBLEM: another command might get the result before this does
-        # Possible solution: create a cursor for each execute()?
-        return list(itertools.chain.from_iterable(
-            self.queueAndGet(self.curs.fetchall)))
+        fun = fun or self._commit
+        with self.writeLock:
+            if self.groupCommitTimer and fun == self._commit:
+                # this covers the pending group commit as well
+                self.groupCommitTimer.cancel()
+                self.groupCommitTimer = None
+            future = self.queueQuery(fun)
+        return future.result()
+
+    def _groupCommit(self):
+        with self.writeLock:
+            if not self.groupCommitTimer:
+                # already flushed
+                return
+            self.groupCommitTimer = None
+            self.queueCmd(self._commit)
 
     def commit(self):
         """
         A convenience function that queues a commit on the connection and waits
         for it to complete.
+
+        Inside a transaction scope opened by this thread (see deferCommits())
+        this does nothing. In group commit mode, this schedules a commit and
+        returns right away.
+        """
+        if threading.current_thread().ident in self.deferringThreads:
+            return
+        if self.groupCommitDelay > 0:
+            with self.writeLock:
+                if not self.groupCommitTimer:
+                    self.groupCommitTimer = threading.Timer(
+                            self.groupCommitDelay, self._groupCommit)
+                    self.groupCommitTimer.setDaemon(True)
+                    self.groupCommitTimer.start()
+            return
+        return self._flush()
+
+    def deferCommits(self):
         """
-        e = self.queueQuery(self.conn.commit)
-        e.wait()
-        return self.getResult(e)
+        Open a transaction scope for the calling thread. Until the matching
+        resumeCommits(), commit() calls from this thread are ignored. Scopes
+        may be nested. Commits from other threads still go through.
+
+        A pending group commit is flushed first, so that rolling back the
+        scope does not take the writes of other threads with it.
+        """
+        ident = threading.current_thread().ident
+        if ident not in self.deferringThreads and self.groupCommitTimer:
+            self._flush()
+        self.deferringThreads[ident] = self.deferringThreads.get(ident, 0) + 1
+
+    def resumeCommits(self, rollback=False):
+        """
+        Close a transaction scope. When the outermost scope of this thread is
+        closed, commit, or roll back if 'rollback' is True. A rollback
+        discards all of the uncommitted changes on the connection.
+        """
+        ident = threading.current_thread().ident
+        depth = self.deferringThreads[ident] - 1
+        if depth:
+            self.deferringThreads[ident] = depth
+            if rollback:
+                self._flush(self._rollback)
+            return
+        del self.deferringThreads[ident]
+        return self._flush(self._rollback if rollback else self._commit)
+
+    def checkpoint(self):
+        """
+        Copy everything in the write-ahead log back into the database file,
+        for example before the file is copied. Does nothing unless the
+        database is in WAL mode. A pending group commit is flushed first.
+        """
+        if self.groupCommitTimer:
+            self._flush()
+        if self.readers:
+            self.isReady.wait() # wait for the connection to be ready
+            return self.queueAndGet(self._executeAndFetch, self.fetchOne,
+                    'pragma wal_checkpoint(TRUNCATE)')
 
 class Catalog(object):
     """
@@ -227,9 +834,27 @@ class Catalog(object):
 
     zipReleaseRoot = 'release-id'
 
+    # Number of read-only connections that serve queries next to the writer.
+    # Set to zero to leave the database journal mode alone.
+    readerCount = 2
+
+    # Seconds over which commits are coalesced into one; zero commits each
+    # change right away. See setGroupCommit().
+    groupCommitDelay = 0
+
+    # Whether to time the database commands. See enableStats().
+    collectStats = False
+
+    # Statements taking longer than this many seconds are logged, along with
+    # their query plans. None turns the log off. See enableSlowQueryLog().
+    slowQueryThreshold = None
+
+    # Bytes of parsed releases to keep in memory for getRelease(), counted by
+    # the size of their serialized form. See setReleaseCacheSize().
+    releaseCacheSize = 8 * 2**20
+
     releaseColumns = [
         'id',
-        'meta',
         'sortstring',
         'artist',
         'title',
@@ -244,7 +869,8 @@ class Catalog(object):
         'metatime',
         'count',
         'comment',
-        'rating'
+        'rating',
+        'firstadded'
         ]
 
     derivedTables = [
@@ -261,6 +887,319 @@ class Catalog(object):
         'trackword_index'
         ]
 
+    # Recompute the release_summary row of each release selected. Append a
+    # where clause on 'r' to limit which releases are updated.
+    summaryRefresh = (
+        'insert or replace into release_summary (release, '
+        'last_listened, borrower, checked_out, track_count, length, '
+        'digital_formats) '
+        'select r.id, '
+        '(select max(date) from listened_dates where release=r.id), '
+        # the latest checkout, unless there has been a checkin since
+        '(select borrower from checkout_events as o where release=r.id '
+            'and not exists (select 1 from checkin_events as i '
+            'where i.release=r.id and i.date>o.date) '
+            'order by date desc limit 1), '
+        '(select date from checkout_events as o where release=r.id '
+            'and not exists (select 1 from checkin_events as i '
+            'where i.release=r.id and i.date>o.date) '
+            'order by date desc limit 1), '
+        '(select count(medium_recordings.recording) from media '
+            'inner join medium_recordings '
+            'on medium_recordings.medium=media.id '
+            'where media.release=r.key), '
+        '(select sum(recordings.length) from media '
+            'inner join medium_recordings '
+            'on medium_recordings.medium=media.id '
+            'inner join recordings '
+            'on medium_recordings.recording=recordings.key '
+            'where media.release=r.key), '
+        '(select group_concat(distinct format) from digital '
+            'where release=r.id) '
+        'from releases as r')
+
+    # Index the releases and recordings selected in the full-text search
+    # tables, see catalog-search-schema.sql. Append a where clause on 'r' or
+    # on 'recordings' to limit which are indexed. The document IDs have to
+    # exist and the old rows have to be deleted first.
+    releaseSearchRefresh = (
+        'insert into release_fts (rowid, title, artist, label, catno, tracks) '
+        'select d.docid, searchtext(r.title), searchtext(r.artist), '
+        'searchtext(r.label), searchtext(r.catno), '
+        '(select searchtext(group_concat(recordings.title, \' \')) '
+            'from media '
+            'inner join medium_recordings '
+            'on medium_recordings.medium=media.id '
+            'inner join recordings '
+            'on medium_recordings.recording=recordings.key '
+            'where media.release=r.key) '
+        'from releases as r '
+        'inner join release_fts_docs as d on d.release=r.id')
+    recordingSearchRefresh = (
+        'insert into recording_fts (rowid, title) '
+        'select d.docid, searchtext(recordings.title) from recordings '
+        'inner join recording_fts_docs as d on d.recording=recordings.id')
+
+    # Index the trigrams of the words selected by a query substituted for
+    # %s, which has to have one column. See mbcat.search.trigrams().
+    trigramRefresh = (
+        'insert or ignore into word_trigrams (trigram, word) '
+        'with recursive padded(word, text, i) as ('
+            'select word, \'  \'||word||\' \', 1 from (%s) '
+            'union all '
+            'select word, text, i+1 from padded where i+3<=length(text)) '
+        'select substr(text, i, 3), word from padded')
+    allWords = 'select word from words union select trackword from trackwords'
+    releaseWords = ('select word from words where release='
+        '(select key from releases where id=?) '
+        'union select trackword from trackwords where recording in '
+        '(select recording from medium_recordings where medium in '
+        '(select id from media where release='
+        '(select key from releases where id=?)))')
+
+    # The table of the releases or recordings each words table refers to
+    wordTables = {'words': 'releases', 'trackwords': 'recordings'}
+
+    # Weights of the release_fts columns in the ranking of search results
+    releaseSearchWeights = (10.0, 5.0, 2.0, 2.0, 1.0)
+
+    def _rebuildMigration(self):
+        """Re-digest all of the releases, for a migration which changes
+        what is derived from them. The releases are digested by the code of
+        this version, so that is done once the schema is up to date; see
+        _upgradeSchema()."""
+        self.rebuildPending = True
+
+    def _releaseDictsMigration(self):
+        """Create the release_dicts table. The parsed metadata of the
+        releases is stored in it by the rebuild; see _rebuildMigration()."""
+        self.cm.execute('create table if not exists release_dicts ('
+                'release TEXT PRIMARY KEY, dict BLOB, '
+                'FOREIGN KEY(release) REFERENCES releases(id) '
+                'ON DELETE CASCADE ON UPDATE CASCADE)')
+        self.rebuildPending = True
+
+    def _metaHashMigration(self):
+        """Add the hash column to release_meta and hash the XML of every
+        release."""
+        self.cm.execute('alter table release_meta add column hash BLOB')
+        for releaseId, meta in self.cm.iterFetch('select release, meta '
+                'from release_meta', chunkSize=100):
+            self.cm.execute('update release_meta set hash=? where release=?',
+                    (self.metaHash(self.decompressMeta(meta)), releaseId))
+
+    # The schema migrations. Migration i brings a catalog from version i (as
+    # in PRAGMA user_version) to version i+1, so the last version is the
+    # length of this list. A database created before versioning reads as
+    # version 0. New catalogs are created from the schema files at the latest
+    # version, so a migration has to be reflected in those as well. Only ever
+    # append to this list. A migration is an SQL script, or a function of the
+    # catalog for one that SQL cannot do.
+    migrations = [
+        # 1: index the columns that the per-release getters look up by
+        """
+        CREATE INDEX IF NOT EXISTS release_sortformat ON releases(sortformat);
+        CREATE INDEX IF NOT EXISTS added_dates_release
+            ON added_dates(release);
+        CREATE INDEX IF NOT EXISTS listened_dates_release
+            ON listened_dates(release);
+        CREATE INDEX IF NOT EXISTS purchases_release ON purchases(release);
+        CREATE INDEX IF NOT EXISTS checkout_events_release
+            ON checkout_events(release);
+        CREATE INDEX IF NOT EXISTS checkin_events_release
+            ON checkin_events(release);
+        CREATE INDEX IF NOT EXISTS words_release ON words (release);
+        CREATE INDEX IF NOT EXISTS trackwords_recording
+            ON trackwords (recording);
+        CREATE INDEX IF NOT EXISTS media_release ON media (release);
+        CREATE INDEX IF NOT EXISTS medium_recordings_medium
+            ON medium_recordings (medium);
+        CREATE INDEX IF NOT EXISTS medium_recordings_recording
+            ON medium_recordings (recording);
+        CREATE INDEX IF NOT EXISTS discids_id ON discids (id);
+        CREATE INDEX IF NOT EXISTS discids_medium ON discids (medium);
+        """,
+        # 2: summarize each release for the detail pane. The summaries are
+        # filled in by the rebuild of migration 12, as summaryRefresh needs
+        # the keys of migration 11.
+        """
+        CREATE TABLE IF NOT EXISTS release_summary (
+            release TEXT PRIMARY KEY,
+            first_added FLOAT,
+            last_listened FLOAT,
+            borrower TEXT,
+            checked_out FLOAT,
+            track_count INTEGER,
+            length INTEGER,
+            digital_formats TEXT,
+            FOREIGN KEY(release) REFERENCES releases(id)
+            ON DELETE CASCADE ON UPDATE CASCADE);
+        """,
+        # 3: store the first added date with each release
+        """
+        ALTER TABLE releases ADD COLUMN firstadded FLOAT;
+        UPDATE releases SET firstadded=
+            (SELECT min(date) FROM added_dates WHERE release=releases.id);
+        """,
+        # 4: index the words with the releases and recordings having them
+        """
+        DROP INDEX IF EXISTS word_index;
+        CREATE INDEX word_index ON words (word, release);
+        DROP INDEX IF EXISTS trackword_index;
+        CREATE INDEX trackword_index ON trackwords (trackword, recording);
+        """,
+        # 5: count the releases having each word, for completion
+        """
+        CREATE TABLE IF NOT EXISTS word_counts (
+            word TEXT PRIMARY KEY,
+            releases INTEGER) WITHOUT ROWID;
+        INSERT OR REPLACE INTO word_counts (word, releases)
+            SELECT word, count(*) FROM words GROUP BY word;
+        CREATE TRIGGER IF NOT EXISTS word_counts_insert
+        AFTER INSERT ON words BEGIN
+            INSERT OR IGNORE INTO word_counts (word, releases)
+                VALUES (new.word, 0);
+            UPDATE word_counts SET releases=releases+1 WHERE word=new.word;
+        END;
+        CREATE TRIGGER IF NOT EXISTS word_counts_delete
+        AFTER DELETE ON words BEGIN
+            UPDATE word_counts SET releases=releases-1 WHERE word=old.word;
+            DELETE FROM word_counts WHERE word=old.word AND releases<=0;
+        END;
+        """,
+        # 6: index the trigrams of the words, for fuzzy search
+        """
+        CREATE TABLE IF NOT EXISTS word_trigrams (
+            trigram TEXT,
+            word TEXT,
+            PRIMARY KEY (trigram, word)) WITHOUT ROWID;
+        """ + (trigramRefresh % allWords) + ';',
+        # 7: fold accents and punctuation in the words, see mbcat.text
+        _rebuildMigration,
+        # 8: store the parsed metadata of the releases, see getRelease()
+        _releaseDictsMigration,
+        # 9: dictionaries for compressing the release XML, see compressMeta()
+        """
+        CREATE TABLE IF NOT EXISTS meta_dictionaries (
+            id INTEGER PRIMARY KEY,
+            dictionary BLOB);
+        """,
+        # 10: move the release XML out of the releases table
+        """
+        CREATE TABLE release_meta (
+            release TEXT PRIMARY KEY,
+            meta BLOB,
+            FOREIGN KEY(release) REFERENCES releases(id)
+            ON DELETE CASCADE ON UPDATE CASCADE);
+        INSERT INTO release_meta (release, meta)
+            SELECT id, meta FROM releases;
+        CREATE TABLE releases_new(
+            id TEXT PRIMARY KEY,
+            sortstring TEXT,
+            artist TEXT,
+            title TEXT,
+            date TEXT,
+            country TEXT,
+            label TEXT,
+            catno TEXT,
+            barcode TEXT,
+            asin TEXT,
+            format TEXT,
+            sortformat TEXT,
+            metatime FLOAT,
+            count INT DEFAULT 1,
+            comment TEXT,
+            rating INT DEFAULT 0,
+            firstadded FLOAT);
+        INSERT INTO releases_new (id, sortstring, artist, title, date,
+                country, label, catno, barcode, asin, format, sortformat,
+                metatime, count, comment, rating, firstadded)
+            SELECT id, sortstring, artist, title, date, country, label,
+                catno, barcode, asin, format, sortformat, metatime, count,
+                comment, rating, firstadded FROM releases;
+        DROP TABLE releases;
+        ALTER TABLE releases_new RENAME TO releases;
+        CREATE UNIQUE INDEX release_id ON releases(id);
+        CREATE INDEX release_sortstring ON releases(sortstring);
+        CREATE INDEX release_catno ON releases(catno);
+        CREATE INDEX release_barcode ON releases(barcode);
+        CREATE INDEX release_asin ON releases(asin);
+        CREATE INDEX release_sortformat ON releases(sortformat);
+        """,
+        # 11: give the releases and recordings integer keys
+        """
+        CREATE TABLE releases_new(
+            key INTEGER PRIMARY KEY,
+            id TEXT NOT NULL,
+            sortstring TEXT,
+            artist TEXT,
+            title TEXT,
+            date TEXT,
+            country TEXT,
+            label TEXT,
+            catno TEXT,
+            barcode TEXT,
+            asin TEXT,
+            format TEXT,
+            sortformat TEXT,
+            metatime FLOAT,
+            count INT DEFAULT 1,
+            comment TEXT,
+            rating INT DEFAULT 0,
+            firstadded FLOAT);
+        INSERT INTO releases_new (id, sortstring, artist, title, date,
+                country, label, catno, barcode, asin, format, sortformat,
+                metatime, count, comment, rating, firstadded)
+            SELECT id, sortstring, artist, title, date, country, label,
+                catno, barcode, asin, format, sortformat, metatime, count,
+                comment, rating, firstadded FROM releases;
+        DROP TABLE releases;
+        ALTER TABLE releases_new RENAME TO releases;
+        CREATE UNIQUE INDEX release_id ON releases(id);
+        CREATE INDEX release_sortstring ON releases(sortstring);
+        CREATE INDEX release_catno ON releases(catno);
+        CREATE INDEX release_barcode ON releases(barcode);
+        CREATE INDEX release_asin ON releases(asin);
+        CREATE INDEX release_sortformat ON releases(sortformat);
+        CREATE TABLE recordings_new (
+            key INTEGER PRIMARY KEY,
+            id TEXT NOT NULL,
+            length INTEGER,
+            number INTEGER,
+            title TEXT,
+            rating INT DEFAULT 0);
+        INSERT INTO recordings_new (id, length, number, title, rating)
+            SELECT id, length, number, title, rating FROM recordings;
+        DROP TABLE recordings;
+        ALTER TABLE recordings_new RENAME TO recordings;
+        CREATE UNIQUE INDEX recording_id ON recordings(id);
+        """,
+        # 12: refer to the releases and recordings by key in the derived
+        # tables, see catalog-derived-schema.sql
+        _rebuildMigration,
+        # 13: hash the release XML, see hasMetaXml()
+        _metaHashMigration,
+        # 14: read the first added date from releases.firstadded only
+        """
+        CREATE TABLE release_summary_new (
+            release TEXT PRIMARY KEY,
+            last_listened FLOAT,
+            borrower TEXT,
+            checked_out FLOAT,
+            track_count INTEGER,
+            length INTEGER,
+            digital_formats TEXT,
+            FOREIGN KEY(release) REFERENCES releases(id)
+            ON DELETE CASCADE ON UPDATE CASCADE);
+        INSERT INTO release_summary_new (release, last_listened, borrower,
+                checked_out, track_count, length, digital_formats)
+            SELECT release, last_listened, borrower, checked_out,
+                track_count, length, digital_formats FROM release_summary;
+        DROP TABLE release_summary;
+        ALTER TABLE release_summary_new RENAME TO release_summary;
+        """,
+        ]
+
     badReleaseFilter = 'format like "%[unknown]%"'\
                 ' or barcode=""'\
                 ' or asin=""'\
@@ -292,10 +1231,116 @@ class Catalog(object):
         _log.info('Using \'%s\' for the catalog database' % self.dbPath)
         _log.info('Using \'%s\' for the file cache path' % self.cachePath)
 
-        self.cm = ConnectionManager(self.dbPath)
+        if hasattr(self, 'cm'):
+            self.cm.close()
+        self.releaseCache = cache.LRUCache(self.releaseCacheSize)
+        self.cm = ConnectionManager(self.dbPath, readers=self.readerCount,
+                groupCommit=self.groupCommitDelay, stats=self.collectStats,
+                slowQueries=self.slowQueryThreshold)
+        # the text in the full-text search tables is tokenized like words
+        self.cm.createFunction('searchtext', 1, text.searchText)
+        self.fullText = search.hasFts5()
+
+        self.metaCompressors = dict()
+        self.metaDictionary = None
 
         if not self._checkTables():
             self._createTables()
+        else:
+            self._upgradeSchema()
+        self._checkSearchTables()
+        self.metaDictionary = self.cm.executeAndFetchOne(
+                'select max(id) from meta_dictionaries')[0]
+
+    def close(self):
+        """Commit any pending changes and close the database."""
+        self.cm.close()
+
+    def setGroupCommit(self, delay):
+        """
+        Coalesce the commits made within 'delay' seconds into one, so that a
+        burst of small edits costs one sync to disk. Use zero to commit each
+        change right away. Call close() before exiting to flush the last
+        commit.
+        """
+        self.groupCommitDelay = delay
+        self.cm.groupCommitDelay = delay
+
+    def setReleaseCacheSize(self, size):
+        """
+        Set how many bytes of parsed releases getRelease() keeps in memory,
+        as measured by the size of their serialized form. Zero turns the
+        cache off.
+        """
+        self.releaseCacheSize = size
+        self.releaseCache.resize(size)
+
+    def releaseCacheStats(self):
+        """
+        Return a dictionary of the 'hits' and 'misses' of the getRelease()
+        cache, and the number of 'entries' and the 'size' of the releases in
+        it, out of 'maxSize'.
+        """
+        return self.releaseCache.asDict()
+
+    def enableStats(self, enabled=True):
+        """
+        Start or stop timing the commands sent to the database. Starting
+        again clears the statistics collected so far.
+        """
+        self.collectStats = enabled
+        self.cm.enableStats(enabled)
+
+    def stats(self):
+        """
+        Return a dictionary of statistics for the writer and each reader
+        connection, or None if enableStats() has not been called. For each
+        connection, 'wait' is the time commands spent in the queue, 'run' is
+        the time they spent executing, and 'depth' is the queue depth seen
+        by each new command. The same figures are also given per SQL
+        statement under 'statements'.
+        """
+        return self.cm.getStats()
+
+    def dumpStats(self, path):
+        """Write the statistics from stats() to a JSON file."""
+        stats.dump(self.stats(), path)
+
+    def enableSlowQueryLog(self, threshold=0.1):
+        """
+        Log every statement that takes longer than 'threshold' seconds,
+        with its parameters and the output of EXPLAIN QUERY PLAN. Use None
+        to turn the log off. Enabling it again clears the log.
+        """
+        self.slowQueryThreshold = threshold
+        self.cm.enableSlowQueryLog(threshold)
+
+    def slowQueries(self):
+        """
+        Summarize the slow-query log: a list with the count, total and
+        maximum time, parameters of the slowest run and query plan of each
+        statement, the worst offenders first. None if the log is off.
+        """
+        return self.cm.getSlowQueries()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Defer the commits made by this thread until the end of the block, so
+        that a batch of changes costs one commit. If the block raises an
+        exception, the changes are rolled back instead.
+
+        with catalog.transaction():
+            for releaseId in releaseIds:
+                catalog.addAddedDate(releaseId, date)
+        """
+        self.cm.deferCommits()
+        try:
+            yield self
+        except:
+            self.cm.resumeCommits(rollback=True)
+            raise
+        self.cm.resumeCommits()
 
     def copy(self):
         return Catalog(self.dbPath, self.cachePath)
@@ -312,15 +1357,57 @@ class Catalog(object):
     def _createTables(self):
         """Create the SQL tables for the catalog. Database is assumed empty."""
 
-        # TODO maybe store metadata dict from musicbrainz instead of the XML?
         with open(os.path.join(os.path.dirname(__file__),
                 'catalog-schema.sql')) as f:
             self.cm.executescript(f.read())
 
         self._createDerivedTables()
+        self.cm.execute('pragma user_version=%d' % len(self.migrations))
 
         self.cm.commit()
 
+    def getSchemaVersion(self):
+        return self.cm.executeAndFetchOne('pragma user_version')[0]
+
+    def _upgradeSchema(self):
+        """Run the migrations that this catalog has not had yet."""
+        version = self.getSchemaVersion()
+        if version > len(self.migrations):
+            _log.warning('The catalog schema (version %d) is newer than this '
+                    'version of mbcat knows (%d)' % (
+                    version, len(self.migrations)))
+        self.rebuildPending = False
+        for version in range(version, len(self.migrations)):
+            _log.info('Upgrading the catalog schema to version %d' %
+                    (version+1))
+            migration = self.migrations[version]
+            if callable(migration):
+                # in one transaction with the version, like a script
+                self.cm.beginExplicit()
+                try:
+                    migration(self)
+                    self.cm.execute('pragma user_version=%d' % (version+1))
+                except:
+                    self.cm.endExplicit(rollback=True)
+                    raise
+                self.cm.endExplicit()
+            else:
+                # The version is bumped in the same transaction as the
+                # changes. Foreign keys are switched off around it, which
+                # can not be done inside a transaction, so that rebuilding a
+                # table does not cascade to the tables referring to it.
+                self.cm.execute('pragma foreign_keys=OFF')
+                try:
+                    self.cm.runScript('BEGIN;\n' + migration +
+                            '\nPRAGMA user_version=%d;\nCOMMIT;' % (
+                            version+1))
+                finally:
+                    self.cm.execute('pragma foreign_keys=ON')
+        if self.rebuildPending:
+            # should this be interrupted, 'catalog rebuild' finishes the job
+            _log.info('Rebuilding the derived tables')
+            self.rebuildDerivedTables(self).run()
+
     def _createDerivedTables(self):
         """Drop and re-create the release-derived tables to the database.
         This method does not commit its changes."""
@@ -329,36 +1416,151 @@ class Catalog(object):
         with open(os.path.join(os.path.dirname(__file__),
                 'catalog-derived-schema.sql')) as f:
             self.cm.executescript(f.read())
+        if search.hasFts5():
+            self._createSearchTables()
+
+    def _createSearchTables(self):
+        """Drop and re-create the full-text search tables. This method does
+        not commit its changes."""
+        with open(os.path.join(os.path.dirname(__file__),
+                'catalog-search-schema.sql')) as f:
+            self.cm.executescript(f.read())
+
+    def _checkSearchTables(self):
+        """
+        Use full-text search if SQLite has the FTS5 extension. A catalog
+        created without it is indexed here, otherwise the words tables are
+        searched instead.
+        """
+        if not self.fullText:
+            _log.info('SQLite has no FTS5 extension, full-text search is '
+                    'not available')
+        elif 'release_fts' not in self.cm.executeAndChain(
+                'select name from sqlite_master where type="table"'):
+            _log.info('Indexing the catalog for full-text search')
+            self._createSearchTables()
+            self._indexSearch()
+            self.cm.commit()
 
     class rebuildDerivedTables(dialogs.ThreadedTask):
-        def __init__(self, catalog):
+        """
+        Drop and re-create the derived tables and digest every release into
+        them again. The XML is decompressed and parsed by 'processes' worker
+        processes, or by this one if it is 1, or by one for each core if it
+        is None. The rows they make are written a chunk of releases at a
+        time, with one executemany() per table, in one transaction.
+        """
+        chunkSize = 100
+
+        def __init__(self, catalog, processes=1):
             self.catalog = catalog
+            self.processes = processes or multiprocessing.cpu_count()
             dialogs.ThreadedTask.__init__(self, 0)
 
         def run(self):
             self.status = 'Dropping and re-creating derived tables...'
             self.numer = 0
             self.denom = 0
+            # Start fetching the XML before writing, so that it is streamed
+            # from a reader connection rather than fetched all at once; see
+            # ConnectionManager.iterFetch()
+            metaRows = self.catalog.cm.iterFetch(
+                    'select release, meta from release_meta',
+                    chunkSize=self.chunkSize)
+            first = next(metaRows, None)
             self.catalog._createDerivedTables()
+            self.catalog.releaseCache.clear()
             # Rebuild
-            g = self.updateDerivedTables()
+            self.updateDerivedTables(itertools.chain([first], metaRows)
+                    if first is not None else [])
 
-        def updateDerivedTables(self):
-            """Use the releases table to populate the derived tables"""
+        def updateDerivedTables(self, metaRows):
+            """Use the (release ID, compressed XML) rows of release_meta to
+            populate the derived tables"""
             self.status = 'Rebuilding derived tables...'
             self.numer = 0
             self.denom = len(self.catalog)
-            for releaseId in self.catalog.getReleaseIds():
+            metaRows = iter(metaRows)
+            chunks = iter(lambda: [(releaseId, bytes(meta))
+                    for releaseId, meta in itertools.islice(
+                    metaRows, self.chunkSize)], [])
+            if self.processes > 1:
+                digests = self.digestInPool(chunks)
+            else:
+                digests = (_digestReleases(chunk,
+                        self.catalog._getMetaCompressor) for chunk in chunks)
+            for chunk in digests:
                 if self.stopthread.isSet():
+                    digests.close()
                     return
-                metaXml = self.catalog.getReleaseXml(releaseId)
-                self.catalog.digestReleaseXml(releaseId, metaXml, rebuild=True)
-                self.numer += 1
+                self.writeDigests(chunk)
+                self.numer += len(chunk)
 
             self.numer = 0; self.denom = 0
+            self.status = 'Summarizing releases...'
+            self.catalog.cm.execute(self.catalog.summaryRefresh)
+            self.catalog.cm.execute(self.catalog.trigramRefresh %
+                    self.catalog.allWords)
+            if self.catalog.fullText:
+                self.status = 'Indexing releases for search...'
+                self.catalog._indexSearch()
             self.status = 'Committing changes...'
             self.catalog.cm.commit()
 
+        def digestInPool(self, chunks):
+            """Generate _digestReleases() of each chunk, worked out by a
+            pool of processes. A few chunks per process are handed out ahead,
+            so that the workers are kept busy while the results are written,
+            but do not run far ahead of the writer."""
+            dictionaries = dict((dictionaryId, bytes(dictionary))
+                    for dictionaryId, dictionary in
+                    self.catalog.cm.executeAndFetch(
+                    'select id, dictionary from meta_dictionaries'))
+            pool = multiprocessing.Pool(self.processes, _initRebuildWorker,
+                    (dictionaries,))
+            try:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_digestReleases, (chunk,)))
+                    if len(pending) >= 2*self.processes:
+                        yield pending.popleft().get()
+                while pending:
+                    yield pending.popleft().get()
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+
+        def writeDigests(self, digests):
+            """Write what digestReleaseXml() would for the releases of a
+            chunk from _digestReleases(), with one executemany() per
+            table."""
+            catalog = self.catalog
+            columnRows = []
+            dictRows = []
+            wordRows = []
+            trackRows = ([], [], [], [], [])
+            for releaseId, digest in digests:
+                if digest is None:
+                    # merged into another release, which renames it
+                    catalog.digestReleaseXml(releaseId,
+                            catalog.getReleaseXml(releaseId), rebuild=True)
+                    continue
+                metaColumns, releaseDict, words, tracks = digest
+                columnRows.append([metaColumns[column] for column
+                        in catalog.derivedReleaseColumns] + [releaseId])
+                if releaseDict is not None:
+                    dictRows.append((releaseId, buffer(releaseDict)))
+                wordRows.extend((word, releaseId) for word in words)
+                for rows, newRows in zip(trackRows, tracks):
+                    rows.extend(newRows)
+            catalog.cm.executemany(catalog.derivedColumnsUpdate, columnRows)
+            catalog.cm.executemany('insert or replace into release_dicts '
+                    '(release, dict) values (?,?)', dictRows)
+            catalog.cm.executemany('insert into words (word,release) '
+                    'select ?,key from releases where id=?', wordRows)
+            catalog._insertTrackRows(*trackRows)
+
     def vacuum(self):
         """Vacuum the SQLite3 database. Frees up unused space on disc."""
         _log.info('Vacuuming database')
@@ -376,12 +1578,21 @@ class Catalog(object):
         # this will cascade to all appropriate table references
         self.cm.execute('update releases set id=? where id=?',
             (newReleaseId, oldReleaseId))
+        self.releaseCache.discard(oldReleaseId)
+        self.releaseCache.discard(newReleaseId)
+        # added_dates does not follow the rename
+        self._refreshFirstAdded(newReleaseId)
         self.addRelease(newReleaseId)
 
     def getReleaseIds(self, filter=None):
         return self.cm.executeAndChain('select id from releases'
             +((' '+filter) if filter else ''))
 
+    def iterReleaseIds(self, filter=None):
+        """Like getReleaseIds(), but generate the IDs as they are fetched."""
+        return self.cm.iterChain('select id from releases'
+            +((' '+filter) if filter else ''))
+
     def getReleaseIdsByAdded(self, filter=None):
         return self.cm.executeAndChain(
             'select release from ('
@@ -417,28 +1628,199 @@ class Catalog(object):
 
         return metadata
 
+    # The parsed releases are kept in the release_dicts table as marshal data,
+    # which loads many times faster than the XML parses. The marshal format is
+    # specific to the major version of Python, which is stored with it.
+    releaseDictVersion = sys.version_info[0]
+
+    @classmethod
+    def packReleaseDict(cls, release):
+        """Serialize a release's dictionary for the release_dicts table."""
+        try:
+            return buffer(zlib.compress(
+                    marshal.dumps((cls.releaseDictVersion, release), 2)))
+        except ValueError:
+            # something in the dictionary that marshal does not support
+            return None
+
+    @classmethod
+    def unpackReleaseDict(cls, releaseDict):
+        """Return the release dictionary from the release_dicts table and the
+        size of its marshal data, or (None, 0) if there is none or it was
+        written by another version of Python."""
+        if releaseDict is None:
+            return None, 0
+        try:
+            data = zlib.decompress(releaseDict)
+            version, release = marshal.loads(data)
+        except (ValueError, EOFError, TypeError, zlib.error):
+            return None, 0
+        if version != cls.releaseDictVersion:
+            return None, 0
+        return release, len(data)
+
     def getReleaseXml(self, releaseId):
         """Return a release's musicbrainz XML metadata from the local cache"""
 
         if releaseId not in self:
             raise KeyError ('release %s not found' % releaseId)
 
-        return zlib.decompress(
+        return self.decompressMeta(
             self.cm.executeAndFetchOne(
-                'select meta from releases where id = ?', (releaseId,))[0])
+                'select meta from release_meta where release = ?',
+                (releaseId,))[0])
+
+    def iterReleaseXml(self):
+        """Generate the ID and XML metadata of every release, streamed from
+        the database."""
+        for releaseId, meta in self.cm.iterFetch(
+                'select release, meta from release_meta', chunkSize=100):
+            yield releaseId, self.decompressMeta(meta)
+
+    # The release XML is compressed with zlib, on its own or after a
+    # dictionary from the meta_dictionaries table; see mbcat.compression.
+    # With a dictionary, the compressed XML starts with a zero byte, which a
+    # zlib stream never does, and the ID of the dictionary.
+    metaHeader = struct.Struct(str('>BH'))
+
+    def _getMetaCompressor(self, dictionaryId):
+        compressor = self.metaCompressors.get(dictionaryId)
+        if compressor is None:
+            row = self.cm.executeAndFetchOne('select dictionary '
+                    'from meta_dictionaries where id=?', (dictionaryId,))
+            if row is None:
+                raise KeyError('meta dictionary %d not found' % dictionaryId)
+            compressor = compression.DictionaryCompressor(bytes(row[0]))
+            self.metaCompressors[dictionaryId] = compressor
+        return compressor
+
+    def compressMeta(self, metaXml):
+        """Compress release XML for the releases table, with the latest
+        dictionary if there is one. See trainMetaDictionary()."""
+        if self.metaDictionary is None:
+            return buffer(zlib.compress(metaXml))
+        compressor = self._getMetaCompressor(self.metaDictionary)
+        return buffer(self.metaHeader.pack(0, self.metaDictionary) +
+                compressor.compress(metaXml))
+
+    def decompressMeta(self, meta):
+        """Decompress release XML from the releases table."""
+        return self.unpackMeta(meta, self._getMetaCompressor)
+
+    @classmethod
+    def unpackMeta(cls, meta, getCompressor):
+        """Decompress release XML, with the DictionaryCompressor that
+        getCompressor() returns for the ID of a dictionary."""
+        if meta[:1] != b'\0':
+            return zlib.decompress(meta)
+        zero, dictionaryId = cls.metaHeader.unpack(meta[:cls.metaHeader.size])
+        return getCompressor(dictionaryId).decompress(
+                meta[cls.metaHeader.size:])
+
+    # The whitespace between the elements of the XML, which is not metadata
+    metaSpace = re.compile(br'>\s+<')
+
+    @classmethod
+    def metaHash(cls, metaXml):
+        """Return a hash of release XML for release_meta, which is the same
+        for XML with the same metadata. See hasMetaXml()."""
+        return buffer(hashlib.sha1(
+                cls.metaSpace.sub(b'><', metaXml.strip())).digest())
+
+    def hasMetaXml(self, releaseId, metaXml):
+        """Return whether a release was last digested from XML with the
+        same metadata, so that digesting it again would change nothing."""
+        row = self.cm.executeAndFetchOne(
+                'select hash from release_meta where release=?', (releaseId,))
+        return row is not None and row[0] is not None and \
+                bytes(row[0]) == bytes(self.metaHash(metaXml))
+
+    def trainMetaDictionary(self, sampleSize=500):
+        """
+        Make a dictionary from a random sample of the release XML and use it
+        to compress the XML from now on. The XML already stored stays as it
+        is until recompressMeta is run. Returns the ID of the dictionary.
+        This method does not commit its changes.
+        """
+        samples = [self.decompressMeta(meta) for meta in
+                self.cm.executeAndChain('select meta from release_meta '
+                'order by random() limit ?', (sampleSize,))]
+        if not samples:
+            return None
+        dictionaryId = self.cm.executeAndFetchOne(
+                'select coalesce(max(id), 0)+1 from meta_dictionaries')[0]
+        self.cm.execute('insert into meta_dictionaries (id, dictionary) '
+                'values (?,?)', (dictionaryId,
+                buffer(compression.makeDictionary(samples))))
+        self.metaDictionary = dictionaryId
+        _log.info('Made meta dictionary %d from %d releases' % (
+                dictionaryId, len(samples)))
+        return dictionaryId
+
+    class recompressMeta(dialogs.ThreadedTask):
+        """
+        Compress the XML of all of the releases with a new dictionary, made
+        from a sample of them, and drop the dictionaries it no longer needs.
+        """
+        def __init__(self, catalog, train=True):
+            dialogs.ThreadedTask.__init__(self, 0)
+            self.catalog = catalog
+            self.train = train
+
+        def run(self):
+            catalog = self.catalog
+            if self.train:
+                self.status = 'Making a dictionary...'
+                catalog.trainMetaDictionary()
+                catalog.cm.commit()
+
+            self.status = 'Compressing releases...'
+            self.numer = 0
+            self.denom = len(catalog)
+            with catalog.transaction():
+                for releaseId, meta in catalog.cm.iterFetch(
+                        'select release, meta from release_meta',
+                        chunkSize=100):
+                    if self.stopthread.isSet():
+                        return
+                    catalog.cm.execute(
+                            'update release_meta set meta=? where release=?',
+                            (catalog.compressMeta(
+                            catalog.decompressMeta(meta)), releaseId))
+                    self.numer += 1
+                catalog.cm.execute('delete from meta_dictionaries '
+                        'where id is not ?', (catalog.metaDictionary,))
 
     def getRelease(self, releaseId):
         """Return a release's musicbrainz-ngs dictionary.
         For convenience, only the value of the 'release' key is returned.
-        This function should be used sparingly."""
-
-        releaseXml = self.getReleaseXml(releaseId)
-        # maybe it would be better to store the release as a serialized dict in
-        # the table. Then, we would not need this parsing step
+        The dictionary is loaded from its binary form in the release_dicts
+        table if it has one that this Python can read, otherwise the XML is
+        parsed.
 
-        metadata = self.getReleaseDictFromXml(releaseXml)
+        Recently used releases are cached along with their metatime, so the
+        dictionary is shared and must not be modified. See
+        setReleaseCacheSize().
+        """
 
-        return metadata['release']
+        row = self.cm.executeAndFetchOne(
+            'select metatime from releases where id = ?', (releaseId,))
+        if row is None:
+            raise KeyError ('release %s not found' % releaseId)
+        metaTime = row[0]
+        release = self.releaseCache.get(releaseId, metaTime)
+        if release is not None:
+            return release
+
+        row = self.cm.executeAndFetchOne(
+            'select dict from release_dicts where release = ?', (releaseId,))
+        release, size = self.unpackReleaseDict(row[0] if row else None)
+        if release is None:
+            releaseXml = self.getReleaseXml(releaseId)
+            release = self.getReleaseDictFromXml(releaseXml)['release']
+            size = len(releaseXml)
+        self.releaseCache.put(releaseId, release, size, metaTime)
+        return release
 
     def getReleaseIdsByFormat(self, fmt):
         return self.cm.executeAndChain(
@@ -489,62 +1871,62 @@ class Catalog(object):
             #self.cm.execute('insert or ignore into releases values (')
         # Pull in any missing or old releases
         _log.info('Importing %d releases' % len(source))
-        # Pull in digital root locals
-        for root_id, root_path in source.getDigitalPathRoots():
-            if (root_id,root_path) not in self.getDigitalPathRoots():
-                self.addDigitalPathRoot(root_id, root_path)
-                _log.debug('Imported digital root path %s' % (root_path))
-
-        for relId in source.getReleaseIds():
-            if not relId in self or \
-                    self.getMetaTime(relId) < source.getMetaTime(relId):
-                self.digestReleaseXml(relId, source.getReleaseXml(relId))
-                _log.info('Imported release %s' % relId)
-            else:
-                _log.debug('Release %s exists' % relId)
-
-            # Pull in any missing 'added dates'
-            for date in source.getAddedDates(relId):
-                # add the date to this catalog if it does not exist
-                if date not in self.getAddedDates(relId):
-                    self.addAddedDate(relId, date)
-                    _log.info('Imported added date %s for %s' % (str(date), relId))
-
-            # Pull in listen dates
-            for date in source.getListenDates(relId):
-                if date not in self.getListenDates(relId):
-                    self.addListenDate(relId, date)
-                    _log.info('Imported listen date %s for %s' % (str(date), relId))
-
-            # Pull in purchases
-            for tm,pr,vn in source.getPurchases(relId):
-                if (tm,pr,vn) not in self.getPurchases(relId):
-                    self.addPurchase(relId, tm, pr, vn)
-                    _log.info('Imported purchase on %s for %s' % (str(tm), relId))
-
-            # Pull in check out events
-            for date, borrower in source.getCheckOutEvents(relId):
-                if (date,borrower) not in self.getCheckOutEvents(relId):
-                    self.addCheckOutEvent(relId, borrower, date)
-                    _log.debug('Imported check out event on %s for %s' % \
-                            (str(date), relId))
-
-            # Pull in check in events
-            for (date,) in source.getCheckInEvents(relId):
-                if (date,) not in self.getCheckInEvents(relId):
-                    self.addCheckInEvent(relId, date)
-                    _log.debug('Imported check in event on %s for %s' % \
-                            (str(date), relId))
-
-            # Pull in digital paths
-            for format, root_id, path in source.getDigitalPaths(relId):
-                if (format,root_id,path) not in self.getDigitalPaths(relId):
-                    self.addDigitalPath(relId, format, root_id, path)
-                    _log.debug('Imported digital path %s for %s' % \
-                            (path, relId))
-
-        _log.debug('Committing changes')
-        self.cm.commit()
+        with self.transaction():
+            # Pull in digital root locals
+            for root_id, root_path in source.getDigitalPathRoots():
+                if (root_id,root_path) not in self.getDigitalPathRoots():
+                    self.addDigitalPathRoot(root_id, root_path)
+                    _log.debug('Imported digital root path %s' % (root_path))
+
+            for relId in source.getReleaseIds():
+                if not relId in self or \
+                        self.getMetaTime(relId) < source.getMetaTime(relId):
+                    self.digestReleaseXml(relId, source.getReleaseXml(relId))
+                    _log.info('Imported release %s' % relId)
+                else:
+                    _log.debug('Release %s exists' % relId)
+
+                # Pull in any missing 'added dates'
+                for date in source.getAddedDates(relId):
+                    # add the date to this catalog if it does not exist
+                    if date not in self.getAddedDates(relId):
+                        self.addAddedDate(relId, date)
+                        _log.info('Imported added date %s for %s' % (str(date), relId))
+
+                # Pull in listen dates
+                for date in source.getListenDates(relId):
+                    if date not in self.getListenDates(relId):
+                        self.addListenDate(relId, date)
+                        _log.info('Imported listen date %s for %s' % (str(date), relId))
+
+                # Pull in purchases
+                for tm,pr,vn in source.getPurchases(relId):
+                    if (tm,pr,vn) not in self.getPurchases(relId):
+                        self.addPurchase(relId, tm, pr, vn)
+                        _log.info('Imported purchase on %s for %s' % (str(tm), relId))
+
+                # Pull in check out events
+                for date, borrower in source.getCheckOutEvents(relId):
+                    if (date,borrower) not in self.getCheckOutEvents(relId):
+                        self.addCheckOutEvent(relId, borrower, date)
+                        _log.debug('Imported check out event on %s for %s' % \
+                                (str(date), relId))
+
+                # Pull in check in events
+                for (date,) in source.getCheckInEvents(relId):
+                    if (date,) not in self.getCheckInEvents(relId):
+                        self.addCheckInEvent(relId, date)
+                        _log.debug('Imported check in event on %s for %s' % \
+                                (str(date), relId))
+
+                # Pull in digital paths
+                for format, root_id, path in source.getDigitalPaths(relId):
+                    if (format,root_id,path) not in self.getDigitalPaths(relId):
+                        self.addDigitalPath(relId, format, root_id, path)
+                        _log.debug('Imported digital path %s for %s' % \
+                                (path, relId))
+
+            _log.debug('Committing changes')
         _log.info('Done importing')
 
     defaultZipPath='catalog.zip'
@@ -563,10 +1945,9 @@ class Catalog(object):
             self.denom=len(self.catalog)
             with zipfile.ZipFile(self.zipName, 'w',
                     zipfile.ZIP_DEFLATED) as zf:
-                for releaseId in self.catalog.getReleaseIds():
+                for releaseId, metaXml in self.catalog.iterReleaseXml():
                     zipReleasePath = self.catalog.zipReleaseRoot+'/'+releaseId
-                    zf.writestr(zipReleasePath+'/'+'metadata.xml',
-                            self.catalog.getReleaseXml(releaseId))
+                    zf.writestr(zipReleasePath+'/'+'metadata.xml', metaXml)
 
                     # add coverart if is cached
                     # use 'store' method because JPEG is already compressed
@@ -656,76 +2037,206 @@ class Catalog(object):
 
         return words
 
-    def digestTrackWords(self, rel):
+    @staticmethod
+    def getTrackRows(rel):
         """
-        Digest all of the words in the track titles of a release.
-        This function does not commit.
+        Return the rows that digestTrackWords() writes for a release, as
+        lists of the parameters of its inserts into media, discids,
+        recordings, medium_recordings and trackwords. A medium is given by
+        the release ID and its position, which is unique within a release.
         """
+        mediaRows = []
+        discIdRows = []
+        recordingRows = []
+        mediumRecordingRows = []
+        trackWordRows = []
+        recordingIds = set()
 
-        # uuid4() returns a random UUID. Need to make sure this row is deleted
-        # before this row needs to be added again.
         for medium in rel['medium-list']:
-            medium_id = str(uuid.uuid4())
-            self.cm.execute('insert into media'
-                '(id,position,format,release) values (?,?,?,?)',
-                (medium_id,
-                medium['position'],
+            position = int(medium['position'])
+            mediaRows.append((position,
                 medium['format'] if 'format' in medium else '',
                 rel['id']))
             for disc in medium['disc-list']:
-                self.cm.execute('insert into discids (id, sectors, medium) '
-                    'values (?,?,?)',
-                    (disc['id'], disc['sectors'], medium_id))
+                discIdRows.append((disc['id'], int(disc['sectors']),
+                    rel['id'], position))
             for track in medium['track-list']:
                 if 'recording' in track:
+                    recording = track['recording']
                     # Add recording
-                    self.cm.execute('insert or replace into recordings '
-                        '(id, title, length) values (?,?,?)',
-                            (track['recording']['id'],
-                            track['recording']['title'],
-                            track['recording']['length'] \
-                            if 'length' in track['recording'] else None)
-                        )
+                    recordingRows.append((recording['id'],
+                        recording['title'],
+                        int(recording['length']) \
+                        if 'length' in recording else None))
                     # and reference the release
-                    self.cm.execute('insert into medium_recordings '
-                        '(recording, position, medium) values (?,?,?)',
-                            (track['recording']['id'],
-                            track['position'],
-                            medium_id)
-                        )
-                    if 'title' in track['recording']:
-                        for word in processWords('title',
-                            track['recording']):
-                            # Reference each word to this recording
-                            self.cm.execute('insert into trackwords '
-                                '(trackword, recording) values (?,?)',
-                                (word, track['recording']['id']))
+                    mediumRecordingRows.append((recording['id'],
+                        int(track['position']),
+                        rel['id'],
+                        position))
+                    if 'title' in recording and \
+                            recording['id'] not in recordingIds:
+                        # Reference each word to this recording, once
+                        trackWordRows.extend((word, recording['id'])
+                            for word in set(processWords('title', recording)))
+                    recordingIds.add(recording['id'])
+        return (mediaRows, discIdRows, recordingRows, mediumRecordingRows,
+                trackWordRows)
+
+    # Select the media.id of a medium by release ID and position
+    mediumKey = ('(select media.id from media inner join releases '
+        'on media.release=releases.key '
+        'where releases.id=? and media.position=?)')
+
+    def _insertTrackRows(self, mediaRows, discIdRows, recordingRows,
+            mediumRecordingRows, trackWordRows):
+        """Insert rows like those from getTrackRows(). The keys of the
+        release, its media and its recordings are looked up by the inserts
+        themselves. This function does not commit."""
+        self.cm.executemany('insert into media (position,format,release) '
+            'select ?,?,key from releases where id=?', mediaRows)
+        self.cm.executemany('insert into discids (id, sectors, medium) '
+            'values (?,?,'+self.mediumKey+')', discIdRows)
+        # Not 'insert or replace': replacing deletes the old row, which
+        # cascades to the tables referencing recordings and loses the rating.
+        self.cm.executemany('update recordings set title=?, length=? '
+            'where id=?', [(title, length, recordingId)
+                for recordingId, title, length in recordingRows])
+        self.cm.executemany('insert or ignore into recordings '
+            '(id, title, length) values (?,?,?)', recordingRows)
+        self.cm.executemany('insert into medium_recordings '
+            '(recording, position, medium) '
+            'values ((select key from recordings where id=?),?,'+
+            self.mediumKey+')', mediumRecordingRows)
+        self.cm.executemany('insert into trackwords (trackword, recording) '
+            'select ?,key from recordings where id=?', trackWordRows)
+
+    def digestTrackWords(self, rel):
+        """
+        Digest all of the words in the track titles of a release.
+        The rows for each table are collected first and then inserted with one
+        executemany() per table.
+        This function does not commit.
+        """
+        self._insertTrackRows(*self.getTrackRows(rel))
+
+    def reDigestTrackWords(self, rel):
+        """
+        Like digestTrackWords(), for a release which has been digested
+        before: compare the rows it has with the rows it should have and
+        write only the difference, so that the media keep their IDs and an
+        unchanged release costs no writes. Return whether anything changed.
+        This function does not commit.
+        """
+        relId = rel['id']
+        mediaRows, discIdRows, recordingRows, mediumRecordingRows, \
+                trackWordRows = self.getTrackRows(rel)
+
+        media = ('from media inner join releases '
+            'on media.release=releases.key where releases.id=?')
+        tracks = ('from medium_recordings '
+            'inner join recordings '
+            'on medium_recordings.recording=recordings.key '
+            'inner join media on medium_recordings.medium=media.id '
+            'inner join releases on media.release=releases.key '
+            'where releases.id=?')
+        oldFormats = dict(self.cm.executeAndFetch(
+            'select media.position, media.format '+media, (relId,)))
+        oldDiscIds = set(self.cm.executeAndFetch(
+            'select discids.id, discids.sectors, releases.id, media.position '
+            'from discids inner join media on discids.medium=media.id '
+            'inner join releases on media.release=releases.key '
+            'where releases.id=?', (relId,)))
+        oldMediumRecordings = set(self.cm.executeAndFetch(
+            'select recordings.id, medium_recordings.position, releases.id, '
+            'media.position '+tracks, (relId,)))
+        oldRecordings = dict((recordingId, (title, length))
+            for recordingId, title, length in self.cm.executeAndFetch(
+            'select recordings.id, recordings.title, recordings.length '+
+            tracks, (relId,)))
+        oldTrackWords = set(self.cm.executeAndFetch(
+            'select trackwords.trackword, recordings.id from trackwords '
+            'inner join recordings on trackwords.recording=recordings.key '
+            'where trackwords.recording in '
+            '(select medium_recordings.recording '+tracks+')', (relId,)))
+
+        formats = dict((position, format)
+            for position, format, releaseId in mediaRows)
+        newMedia = [row for row in mediaRows if row[0] not in oldFormats]
+        changedMedia = [(format, position, relId)
+            for position, format in formats.items()
+            if position in oldFormats and oldFormats[position] != format]
+        deadMedia = [(position, relId) for position in oldFormats
+            if position not in formats]
+        newDiscIds = [row for row in discIdRows if row not in oldDiscIds]
+        deadDiscIds = oldDiscIds.difference(discIdRows)
+        newRecordings = [row for row in recordingRows
+            if oldRecordings.get(row[0]) != row[1:]]
+        newMediumRecordings = [row for row in mediumRecordingRows
+            if row not in oldMediumRecordings]
+        deadMediumRecordings = oldMediumRecordings.difference(
+            mediumRecordingRows)
+        newTrackWords = [row for row in trackWordRows
+            if row not in oldTrackWords]
+        deadTrackWords = oldTrackWords.difference(trackWordRows)
+
+        # delete what refers to the media before the media
+        self.cm.executemany('delete from discids '
+            'where id=? and sectors=? and medium='+self.mediumKey,
+            list(deadDiscIds))
+        self.cm.executemany('delete from medium_recordings '
+            'where recording=(select key from recordings where id=?) '
+            'and position=? and medium='+self.mediumKey,
+            list(deadMediumRecordings))
+        # another release with the recording has a copy of its own
+        self.cm.executemany('delete from trackwords where rowid='
+            '(select min(rowid) from trackwords where trackword=? '
+            'and recording=(select key from recordings where id=?))',
+            list(deadTrackWords))
+        self.cm.executemany('delete from media where position=? '
+            'and release=(select key from releases where id=?)', deadMedia)
+        self.cm.executemany('update media set format=? where position=? '
+            'and release=(select key from releases where id=?)',
+            changedMedia)
+        if self.fullText:
+            # _refreshSearch() only sees the recordings the release still has,
+            # and those on no other release are no longer in the catalog
+            self.cm.executemany('delete from recording_fts where rowid in '
+                '(select docid from recording_fts_docs where recording=?) '
+                'and not exists (select 1 from medium_recordings '
+                'where recording=(select key from recordings where id=?))',
+                [(recordingId, recordingId) for recordingId
+                    in set(oldRecordings).difference(
+                        row[0] for row in recordingRows)])
+        self._insertTrackRows(newMedia, newDiscIds, newRecordings,
+            newMediumRecordings, newTrackWords)
+
+        return any([newMedia, changedMedia, deadMedia, newDiscIds,
+            deadDiscIds, newRecordings, newMediumRecordings,
+            deadMediumRecordings, newTrackWords, deadTrackWords])
 
     def unDigestTrackWords(self, relId):
         """
         Undo what digestTrackWords() does.
         This function does not commit.
         """
-        # Query for recordings for this release ID
-        media = self.cm.executeAndFetch(
-            'select id from media where release=?', (relId,))
-        for (mediumId,) in media:
-            self.cm.execute('delete from discids where medium=?',
-                (mediumId,))
-
-            # Iterate through the results
-            for recordingId in self.cm.executeAndFetch(
-                    'select recording from medium_recordings where medium=?',
-                    (mediumId,)):
-                self.cm.execute('delete from trackwords where recording=?',
-                    (recordingId[0],))
-            # Then, delete the rows in the recordings table referencing this
-            # medium ID
-            self.cm.execute( 'delete from medium_recordings where medium=?',
-                (mediumId,))
+        media = ('(select id from media where release='
+            '(select key from releases where id=?))')
+        self.cm.execute('delete from discids where medium in '+media,
+            (relId,))
+        # one copy of the words of each recording, as another release with
+        # the recording has a copy of its own
+        self.cm.execute('delete from trackwords where rowid in '
+            '(select min(rowid) from trackwords where recording in '
+            '(select recording from medium_recordings where medium in '+
+            media+') group by trackword, recording)', (relId,))
+        # Then, delete the rows in the recordings table referencing the
+        # media of this release
+        self.cm.execute('delete from medium_recordings where medium in '+
+            media, (relId,))
         # Then, delete the rows in the media table referencing this
         # release ID
-        self.cm.execute('delete from media where release=?', (relId,))
+        self.cm.execute('delete from media where release='
+            '(select key from releases where id=?)', (relId,))
 
     @utils.deprecated
     def mapWordsToRelease(self, words, releaseId):
@@ -736,44 +2247,216 @@ class Catalog(object):
             else:
                 self.wordMap[word] = [releaseId]
 
+    def _indexSearch(self):
+        """
+        Index all of the releases and recordings in the empty full-text
+        search tables. This function does not commit its changes.
+        """
+        self.cm.execute('insert or ignore into release_fts_docs (release) '
+            'select id from releases')
+        self.cm.execute('insert or ignore into recording_fts_docs '
+            '(recording) select id from recordings')
+        self.cm.execute(self.releaseSearchRefresh)
+        self.cm.execute(self.recordingSearchRefresh)
+
+    def _unindexSearch(self, releaseId, keepShared=True):
+        """
+        Remove a release and its recordings from the full-text search tables,
+        like unDigestTrackWords() does for the word tables. The recordings
+        which are on another release as well stay, unless 'keepShared' is
+        False. This function does not commit its changes.
+        """
+        if not self.fullText:
+            return
+        self.cm.execute('delete from release_fts where rowid in '
+            '(select docid from release_fts_docs where release=?)',
+            (releaseId,))
+        media = ('(select id from media where release='
+            '(select key from releases where id=?))')
+        recordings = ('select recordings.id from medium_recordings '
+            'inner join recordings '
+            'on medium_recordings.recording=recordings.key '
+            'where medium in '+media)
+        params = (releaseId,)
+        if keepShared:
+            recordings += (' and not exists (select 1 from medium_recordings '
+                'as m where m.recording=recordings.key '
+                'and m.medium not in '+media+')')
+            params = (releaseId, releaseId)
+        self.cm.execute('delete from recording_fts where rowid in '
+            '(select docid from recording_fts_docs where recording in '
+            '('+recordings+'))', params)
+
+    def _refreshSearch(self, releaseId):
+        """
+        Bring the full-text search rows of a release and its recordings up to
+        date. Call this after digesting the release. This function does not
+        commit its changes.
+        """
+        if not self.fullText:
+            return
+        # the recordings are all indexed again below
+        self._unindexSearch(releaseId, keepShared=False)
+        self.cm.execute('insert or ignore into release_fts_docs (release) '
+            'values (?)', (releaseId,))
+        self.cm.execute(self.releaseSearchRefresh+' where r.id=?',
+            (releaseId,))
+        recordings = ('(select recordings.id from medium_recordings '
+            'inner join recordings '
+            'on medium_recordings.recording=recordings.key '
+            'where medium in (select id from media where release='
+            '(select key from releases where id=?)))')
+        self.cm.execute('insert or ignore into recording_fts_docs '
+            '(recording) select * from '+recordings, (releaseId,))
+        self.cm.execute(self.recordingSearchRefresh+
+            ' where recordings.id in '+recordings, (releaseId,))
+
+    def search(self, query, limit=None):
+        """
+        Search the release titles, artists, labels, catalog numbers and track
+        titles and return the IDs of the matching releases, the best match
+        first. See mbcat.search for the query syntax. Without full-text
+        search, only whole words in the release and artist names match.
+        """
+        if not self.fullText:
+            return list(self._wordSearch(query))
+        expression = search.matchExpression(query)
+        if not expression:
+            return []
+        return self.cm.executeAndChain(
+            'select d.release from release_fts '
+            'inner join release_fts_docs as d on d.docid=release_fts.rowid '
+            'where release_fts match ? '
+            'order by bm25(release_fts, %s)' % ', '.join(
+                str(weight) for weight in self.releaseSearchWeights)+
+            ((' limit %d' % limit) if limit else ''),
+            (expression,))
+
+    def searchTracks(self, query, limit=None):
+        """
+        Search the track titles and return the IDs of the matching
+        recordings, the best match first.
+        """
+        if not self.fullText:
+            return list(self._wordSearch(query, table='trackwords',
+                keycolumn='trackword', outcolumn='recording'))
+        expression = search.matchExpression(query)
+        if not expression:
+            return []
+        return self.cm.executeAndChain(
+            'select d.recording from recording_fts '
+            'inner join recording_fts_docs as d '
+            'on d.docid=recording_fts.rowid '
+            'where recording_fts match ? order by rank'+
+            ((' limit %d' % limit) if limit else ''),
+            (expression,))
+
     # TODO this is used externally, but has an underscore prefix
     def _search(self, query, table='words', keycolumn='word',
             outcolumn='release'):
-        query_words = query.lower().split(' ')
-        matches = set()
-        for word in query_words:
-            # get the record, there should be one or none
-            fetched = self.cm.executeAndChain(
-                    'select %s from %s where %s = ?' % \
-                    (outcolumn, table, keycolumn),
-                    (word,))
-            # if the word is in the table
-            if fetched:
-                # for the first word
-                if word == query_words[0]:
-                    # use the whole set of releases that have this word
-                    matches = set(fetched)
-                else:
-                    # intersect the releases that have this word with the
-                    # current release set
-                    matches = matches & set(fetched)
-            else:
-                # this word is not contained in any releases and therefore
-                # no releases match
-                matches = set()
-                break
+        """Kept for compatibility, use search() or searchTracks()."""
+        if table == 'words':
+            return self.search(query)
+        elif table == 'trackwords':
+            return self.searchTracks(query)
+        return self._wordSearch(query, table, keycolumn, outcolumn)
+
+    def _wordSearch(self, query, table='words', keycolumn='word',
+            outcolumn='release'):
+        """
+        Search the words or trackwords table for the releases or recordings
+        that have all of the words in the query. The search is driven by
+        the rarest word, and the others are looked up for each of its
+        matches, so that common words do not cost more than the rarest one.
+        The keys found are turned into IDs at the end.
+        """
+        words = list(set(text.tokenize(query)))
+        if not words:
+            return set()
+        counts = dict(self.cm.executeAndFetch(
+                'select %s, count(*) from %s where %s in (%s) group by %s' % (
+                keycolumn, table, keycolumn, ','.join('?'*len(words)),
+                keycolumn), words))
+        if len(counts) < len(words):
+            # one of the words is not in any release and so none match
+            return set()
+        words.sort(key=counts.get)
+        return set(self.cm.executeAndChain(
+                'select id from %s where key in ' % self.wordTables[table] +
+                '(select t0.%s from %s as t0 where t0.%s=?' % (
+                outcolumn, table, keycolumn) + ''.join(
+                ' and exists (select 1 from %s where %s=? and %s=t0.%s)' % (
+                table, keycolumn, outcolumn, outcolumn)
+                for word in words[1:]) + ')', words))
+
+    def completeWord(self, prefix, limit=10):
+        """
+        Return the words in the release search index which start with a
+        prefix, those in the most releases first, to complete a search term
+        as it is typed.
+        """
+        words = text.tokenize(prefix)
+        if not words:
+            return []
+        low, high = search.prefixRange(words[-1])
+        return self.cm.executeAndChain(
+            'select word from word_counts where word>=? and word<? '
+            'order by releases desc, word limit ?', (low, high, limit))
 
-        return matches
+    def similarWords(self, word, limit=10):
+        """
+        Return (word, similarity) for the words in the release and track
+        search indexes most similar to a word, the most similar first. The
+        similarity is the share of their trigrams the words have in common,
+        from 0 to 1.
+        """
+        words = text.tokenize(word)
+        grams = list(search.trigrams(words[-1] if words else text.fold(word)))
+        return self.cm.executeAndFetch(
+            'select word, shared*1.0/(?+length(word)+1-shared) as similarity '
+            'from (select word, count(*) as shared from word_trigrams '
+                'where trigram in (%s) group by word) as t '
+            'where exists (select 1 from word_counts where word=t.word) '
+                'or exists (select 1 from trackwords where trackword=t.word) '
+            'order by similarity desc, word limit ?' % \
+                ','.join('?'*len(grams)),
+            [len(grams)] + grams + [limit])
+
+    def correctQuery(self, query, threshold=0.3):
+        """
+        Replace each word of a search query which is not in the search
+        indexes with the most similar word which is, if it is at least
+        'threshold' similar. Use this to try again when a search finds
+        nothing. The query is returned as it is if no word was replaced, so
+        that the search is only tried again when it would be different.
+        """
+        words = []
+        corrected = False
+        for word in query.split():
+            folded = text.tokenize(word)
+            if folded and not ('"' in word or word.endswith('*') or
+                    self.cm.executeAndFetchOne(
+                    'select exists (select 1 from word_counts where word=?) '
+                    'or exists (select 1 from trackwords where trackword=?)',
+                    (folded[-1], folded[-1]))[0]):
+                similar = self.similarWords(folded[-1], limit=1)
+                if similar and similar[0][1] >= threshold:
+                    word = similar[0][0]
+                    corrected = True
+            words.append(word)
+        return ' '.join(words) if corrected else query
 
     def searchTrackWords(self, query):
-        return self._search(query, table='trackwords', keycolumn='trackword')
+        """Kept for compatibility, use searchTracks()."""
+        return self.searchTracks(query)
 
     def recordingGetReleases(self, recordingId):
         return self.cm.executeAndChain(
             'select releases.id from media '
-            'inner join releases on media.release=releases.id '
+            'inner join releases on media.release=releases.key '
             'inner join medium_recordings on medium_recordings.medium=media.id '
-            'where medium_recordings.recording=?',
+            'where medium_recordings.recording='
+            '(select key from recordings where id=?)',
             (recordingId,))
 
     def formatRecordingInfo(self, recordingId):
@@ -828,16 +2511,22 @@ class Catalog(object):
 
         return sortstring
 
-    def getSortedList(self, matchFmt=None):
+    @staticmethod
+    def _sortedListQuery(matchFmt=None):
         if matchFmt is not None:
-            return self.cm.executeAndFetch(
-                    'select id,sortstring from releases '
+            return ('select id,sortstring from releases '
                     'where format=? '
                     'order by sortstring', (matchFmt,))
         else:
-            return self.cm.executeAndFetch(
-                    'select id,sortstring from releases '
-                    'order by sortstring')
+            return ('select id,sortstring from releases '
+                    'order by sortstring',)
+
+    def getSortedList(self, matchFmt=None):
+        return self.cm.executeAndFetch(*self._sortedListQuery(matchFmt))
+
+    def iterSortedList(self, matchFmt=None):
+        """Like getSortedList(), but generate the rows as they are fetched."""
+        return self.cm.iterFetch(*self._sortedListQuery(matchFmt))
 
     def getSortNeighbors(self, releaseId, neighborHood=5, matchFormat=False):
         """
@@ -860,21 +2549,21 @@ class Catalog(object):
 
     def getWordCount(self):
         """Fetch the number of words in the release search word table."""
-        result = self.cm.executeAndFetchOne(
-                'select count(distinct word) from words')[0]
-        if type(result) == sqlite3.OperationalError:
+        try:
+            return self.cm.executeAndFetchOne(
+                    'select count(distinct word) from words')[0]
+        except sqlite3.OperationalError:
             # This can happen if the words table does not exist yet
             return 0
-        return result
 
     def getTrackWordCount(self):
         """Fetch the number of words in the track search word table."""
-        result = self.cm.executeAndFetchOne(
-                'select count(distinct trackword) from trackwords')[0]
-        if type(result) == sqlite3.OperationalError:
+        try:
+            return self.cm.executeAndFetchOne(
+                    'select count(distinct trackword) from trackwords')[0]
+        except sqlite3.OperationalError:
             # This can happen if the trackwords table does not exist yet
             return 0
-        return result
 
     def getComment(self, releaseId):
         """Get the comment for a release (if any)."""
@@ -898,7 +2587,12 @@ class Catalog(object):
         self.cm.commit()
 
     def deleteDigitalPathRoot(self, root_id):
+        # the paths under this root are deleted with it
+        releaseIds = self.cm.executeAndChain(
+            'select distinct release from digital where root=?', (root_id,))
         self.cm.execute('delete from digital_roots where id=?', (root_id,))
+        for releaseId in releaseIds:
+            self._refreshSummary(releaseId)
         self.cm.commit()
 
     def getDigitalPathRoots(self):
@@ -926,6 +2620,7 @@ class Catalog(object):
         self.cm.execute('insert or replace into digital '
                 '(root, path, release, format) values (?,?,?,?)',
                 (root_id, path, releaseId, format))
+        self._refreshSummary(releaseId)
 
     def deleteDigitalPath(self, releaseId, root_id, path):
         """
@@ -934,11 +2629,92 @@ class Catalog(object):
         self.cm.execute('delete from digital where '
                 'release=? and root=? and path=?',
                 (releaseId, root_id, path))
+        self._refreshSummary(releaseId)
+
+    def _refreshSummary(self, releaseId):
+        """
+        Bring the release_summary row of a release up to date. Call this
+        after writing anything it summarizes. This function does not commit
+        its changes.
+        """
+        self.cm.execute(self.summaryRefresh+' where r.id=?', (releaseId,))
+
+    summaryColumns = [
+        'metaTime',
+        'rating',
+        'count',
+        'firstAdded',
+        'lastListened',
+        'borrower',
+        'checkedOut',
+        'trackCount',
+        'length',
+        'digitalFormats',
+        ]
+
+    def getReleaseSummary(self, releaseId):
+        """
+        Return a dictionary with the refresh time, rating, copy count, first
+        added and last listened dates, borrower and checkout date (None unless
+        checked out), track count, total length and digital formats of a
+        release, all from a single lookup.
+        """
+        row = self.cm.executeAndFetchOne(
+            'select r.metatime, r.rating, r.count, r.firstadded, '
+            's.last_listened, s.borrower, s.checked_out, s.track_count, '
+            's.length, s.digital_formats from releases as r '
+            'left join release_summary as s on s.release=r.id '
+            'where r.id=?', (releaseId,))
+        if row is None:
+            raise KeyError('release %s not found' % releaseId)
+        summary = dict(zip(self.summaryColumns, row))
+        summary['digitalFormats'] = summary['digitalFormats'].split(',') \
+            if summary['digitalFormats'] else []
+        return summary
+
+    def getMediaTracks(self, releaseId):
+        """
+        Return the media of a release in order, as (mediumId, position,
+        format, tracks) tuples, where tracks lists the (recordingId, length,
+        position, title) of each track in order. One query fetches it all.
+        """
+        media = []
+        for mediumId, position, format, recId, recLength, recPosition, title \
+                in self.cm.executeAndFetch(
+                'select media.id, media.position, media.format, '
+                'recordings.id, recordings.length, '
+                'medium_recordings.position, recordings.title '
+                'from media '
+                'left join medium_recordings '
+                'on medium_recordings.medium=media.id '
+                'left join recordings '
+                'on medium_recordings.recording=recordings.key '
+                'where media.release=(select key from releases where id=?) '
+                'order by media.position, media.id, '
+                'medium_recordings.position',
+                (releaseId,)):
+            if not media or media[-1][0] != mediumId:
+                media.append((mediumId, position, format, []))
+            if recId is not None:
+                media[-1][3].append((recId, recLength, recPosition, title))
+        return media
+
+    def _refreshFirstAdded(self, releaseId):
+        """
+        Copy the earliest added date of a release into its row. Call this
+        after changing its added_dates. This function does not commit its
+        changes.
+        """
+        self.cm.execute('update releases set firstadded=('
+            'select min(date) from added_dates where release=releases.id) '
+            'where id=?', (releaseId,))
 
     def getFirstAdded(self, releaseId):
-        return self.cm.executeAndFetchOne(
-            'select min(date) from added_dates where release=?',
-            (releaseId,))[0]
+        """Return the earliest added date of a release, as kept in its row
+        by _refreshFirstAdded()."""
+        row = self.cm.executeAndFetchOne(
+            'select firstadded from releases where id=?', (releaseId,))
+        return row[0] if row else None
 
     def getLastListened(self, releaseId):
         return self.cm.executeAndFetchOne(
@@ -961,6 +2737,8 @@ class Catalog(object):
 
         self.cm.execute('insert into added_dates (date, release) '
             'values (?,?)', (date, releaseId))
+        self._refreshFirstAdded(releaseId)
+        self._refreshSummary(releaseId)
         self.cm.commit()
 
     def getCheckOutEvents(self, releaseId):
@@ -1006,11 +2784,13 @@ class Catalog(object):
         self.cm.execute('insert into checkout_events '
             '(borrower, date, release) values (?,?,?)',
             (borrower, date, releaseId))
+        self._refreshSummary(releaseId)
         self.cm.commit()
 
     def addCheckInEvent(self, releaseId, date):
         self.cm.execute('insert into checkin_events (date,release) '
             'values (?,?)', (date, releaseId))
+        self._refreshSummary(releaseId)
         self.cm.commit()
 
     def getRating(self, releaseId):
@@ -1059,6 +2839,7 @@ class Catalog(object):
             raise ValueError ('Wrong type for date argument')
         self.cm.execute('insert into listened_dates (date, release) '
             'values (?,?)', (date,releaseId))
+        self._refreshSummary(releaseId)
         self.cm.commit()
 
     def deleteListenDate(self, releaseId, date):
@@ -1067,6 +2848,7 @@ class Catalog(object):
         self.cm.execute('delete from listened_dates '
                 'where release=? and date=?',
                 (releaseId, date))
+        self._refreshSummary(releaseId)
         self.cm.commit()
 
     @utils.deprecated
@@ -1128,9 +2910,38 @@ class Catalog(object):
         mb.set_parser()
         return xml
 
+    # The columns of the releases table which are derived from the parsed
+    # metadata of a release, see getReleaseColumns()
+    derivedReleaseColumns = ('sortstring', 'artist', 'title', 'date',
+        'country', 'label', 'catno', 'barcode', 'asin', 'format', 'sortformat')
+    derivedColumnsUpdate = ('update releases set ' +
+        ','.join(column+'=?' for column in derivedReleaseColumns) +
+        ' where id=?')
+
+    @classmethod
+    def getReleaseColumns(cls, release):
+        """Return the values of the derivedReleaseColumns of a release, by
+        column."""
+        return {
+            'sortstring': cls.getSortStringFromRelease(release),
+            'artist': getArtistSortPhrase(release),
+            'title': cls.fmtTitle(release),
+            'date': (release['date'] if 'date' in release else ''),
+            'country': (release['country'] \
+                if 'country' in release else ''),
+            'label': cls.fmtLabel(release),
+            'catno': cls.fmtCatNo(release),
+            'barcode': (release['barcode'] \
+                if 'barcode' in release else ''),
+            'asin': (release['asin'] if 'asin' in release else ''),
+            'format': formatReleaseFormat(release),
+            'sortformat': formats.getReleaseFormat(release).name(),
+            }
+
     def digestReleaseXml(self, releaseId, metaXml, rebuild=False):
         """Update the appropriate data structes for a new release."""
         relDict = self.getReleaseDictFromXml(metaXml) # parse the XML
+        self.releaseCache.discard(releaseId)
 
         exists = releaseId in self
         now = time.time()
@@ -1145,6 +2956,7 @@ class Catalog(object):
                             'name already exists!')
                 self.renameRelease(releaseId, relDict['release']['id'])
             releaseId = relDict['release']['id']
+            self.releaseCache.discard(releaseId)
 
         if not exists:
             self.cm.execute('insert into added_dates '
@@ -1153,8 +2965,8 @@ class Catalog(object):
             # Update releases table
             newColumns = [
                 'id',
-                'meta',
                 'metatime',
+                'firstadded',
                 ]
 
             try:
@@ -1165,62 +2977,78 @@ class Catalog(object):
                         ')',
                         (
                         releaseId,
-                        buffer(zlib.compress(metaXml)),
+                        now,
                         now,
                         )
                 )
+                self.cm.execute('insert into release_meta '
+                        '(release, meta, hash) values (?,?,?)',
+                        (releaseId, self.compressMeta(metaXml),
+                        self.metaHash(metaXml)))
             except sqlite3.IntegrityError as e:
                 _log.error('Release already exists in catalog.')
         elif not rebuild:
-            # Remove references to this release from the words, barcodes,
-            # etc. tables so we can add the correct ones later
-            self.unDigestRelease(releaseId, delete=False)
-            self.cm.execute('update releases set meta=?,sortstring=?,'
+            # The derived rows are compared with the new ones below, and the
+            # search index is refreshed if these have changed
+            oldSearchColumns = self.cm.executeAndFetchOne(
+                    'select title, artist, label, catno from releases '
+                    'where id=?', (releaseId,))
+            self.cm.execute('update releases set sortstring=?,'
                     'metatime=? where id=?',
-                    (buffer(zlib.compress(metaXml)),
-                    self.getSortStringFromRelease(relDict['release']),
+                    (self.getSortStringFromRelease(relDict['release']),
                     now,
                     releaseId
                     )
                 )
+            self.cm.execute('update release_meta set meta=?, hash=? '
+                    'where release=?', (self.compressMeta(metaXml),
+                    self.metaHash(metaXml), releaseId))
 
         # Whether the release already existed or not
-        metaColumns = [
-            ('sortstring', self.getSortStringFromRelease(
-                relDict['release'])),
-            ('artist', getArtistSortPhrase(
-                relDict['release'])),
-            ('title', self.fmtTitle(relDict['release'])),
-            ('date', (relDict['release']['date'] \
-                if 'date' in relDict['release'] else '')),
-            ('country', (relDict['release']['country'] \
-                if 'country' in relDict['release'] else '')),
-            ('label', self.fmtLabel(relDict['release'])),
-            ('catno', self.fmtCatNo(relDict['release'])),
-            ('barcode', (relDict['release']['barcode'] \
-                if 'barcode' in relDict['release'] else '')),
-            ('asin', (relDict['release']['asin'] \
-                if 'asin' in relDict['release'] else '')),
-            ('format', formatReleaseFormat(relDict['release'])),
-            ('sortformat', formats.getReleaseFormat(
-                relDict['release']).name()),
-            ]
+        metaColumns = self.getReleaseColumns(relDict['release'])
 
-        self.cm.execute('update releases set '+\
-            ','.join([key+'=?' for key,val in metaColumns])+\
-            ' where id=?',
-            [val for key,val in metaColumns] + [releaseId]
-            )
+        self.cm.execute(self.derivedColumnsUpdate,
+            [metaColumns[column] for column in self.derivedReleaseColumns] +
+            [releaseId])
 
-        # Update words table
-        rel_words = self.getReleaseWords(relDict['release'])
-        for word in rel_words:
-            self.cm.execute('insert into words (word,release) values (?,?)',
-                (word, releaseId))
+        releaseDict = self.packReleaseDict(relDict['release'])
+        if releaseDict is not None:
+            self.cm.execute('insert or replace into release_dicts '
+                    '(release, dict) values (?,?)', (releaseId, releaseDict))
 
-        # Update words -> (word, recordings) and
-        # recordings -> (recording, releases)
-        self.digestTrackWords(relDict['release'])
+        rel_words = self.getReleaseWords(relDict['release'])
+        if exists and not rebuild:
+            # Write only what has changed in the words tables
+            oldWords = set(self.cm.executeAndChain('select word from words '
+                'where release=(select key from releases where id=?)',
+                (releaseId,)))
+            self.cm.executemany('delete from words where word=? '
+                'and release=(select key from releases where id=?)',
+                [(word, releaseId) for word in oldWords - rel_words])
+            self.cm.executemany('insert into words (word,release) '
+                'select ?,key from releases where id=?',
+                [(word, releaseId) for word in rel_words - oldWords])
+            changed = self.reDigestTrackWords(relDict['release'])
+            changed = changed or oldWords != rel_words or \
+                tuple(oldSearchColumns) != tuple(metaColumns[column]
+                    for column in ['title', 'artist', 'label', 'catno'])
+        else:
+            # Update words table
+            self.cm.executemany('insert into words (word,release) '
+                'select ?,key from releases where id=?',
+                [(word, releaseId) for word in rel_words])
+
+            # Update words -> (word, recordings) and
+            # recordings -> (recording, releases)
+            self.digestTrackWords(relDict['release'])
+            changed = True
+
+        if not rebuild and changed:
+            # a rebuild summarizes and indexes all of the releases at the end
+            self._refreshSummary(releaseId)
+            self._refreshSearch(releaseId)
+            self.cm.execute(self.trigramRefresh % self.releaseWords,
+                (releaseId, releaseId))
 
         return releaseId # because it can change due to a merge
 
@@ -1229,17 +3057,16 @@ class Catalog(object):
         Optionally, leave the release in the releases table.
         This function does not commit its changes to the connection.
         See also: digestReleaseXml()"""
-        relDict = self.getRelease(releaseId)
+        self.releaseCache.discard(releaseId)
+        self._unindexSearch(releaseId)
 
         # Update words -> (word, recordings) and
         # recordings -> (recording, releases)
         self.unDigestTrackWords(releaseId)
 
         # Update words table
-        rel_words = self.getReleaseWords(relDict)
-        for word in rel_words:
-            self.cm.execute('delete from words where release=?',
-                (releaseId,))
+        self.cm.execute('delete from words where release='
+            '(select key from releases where id=?)', (releaseId,))
 
         if delete:
             # Update releases table
@@ -1283,6 +3110,8 @@ class Catalog(object):
     def addRelease(self, releaseId, olderThan=0):
         """
         Get metadata XML from MusicBrainz and add to or refresh the catalog.
+        Return whether the release was digested, rather than skipped for
+        being refreshed recently or for having the same metadata as before.
         This function does commit its changes.
         """
 
@@ -1293,15 +3122,26 @@ class Catalog(object):
         if metaTime > (time.time() - olderThan):
             _log.info("Skipping fetch of metadata for %s because it is more "
                     "recent than %d seconds." % (releaseId, olderThan))
-            return 0
+            return False
 
         metaXml = self.fetchReleaseMetaXml(releaseId)
-        releaseId = self.digestReleaseXml(releaseId, metaXml)
+        changed = not self.hasMetaXml(releaseId, metaXml)
+        if changed:
+            releaseId = self.digestReleaseXml(releaseId, metaXml)
+        else:
+            # only note that the metadata is up to date
+            self.cm.execute('update releases set metatime=? where id=?',
+                    (time.time(), releaseId))
         self.cm.commit()
 
-        _log.info("Added '%s'" % self.getReleaseTitle(releaseId))
+        if changed:
+            _log.info("Added '%s'" % self.getReleaseTitle(releaseId))
+        else:
+            _log.info("'%s' has not changed" %
+                    self.getReleaseTitle(releaseId))
 
         self.getCoverArt(releaseId, olderThan)
+        return changed
 
     def deleteRelease(self, releaseId):
         releaseId = utils.getReleaseIdFromInput(releaseId)
@@ -1325,12 +3165,16 @@ class Catalog(object):
                     % self.olderThan
             self.numer = 0
             self.denom = len(self.catalog)
+            changed = 0
             for releaseId in self.catalog.getReleaseIds():
                 _log.info("Refreshing release %s", releaseId)
-                self.catalog.addRelease(releaseId, self.olderThan)
+                if self.catalog.addRelease(releaseId, self.olderThan):
+                    changed += 1
                 self.numer += 1
                 if self.stopthread.isSet():
-                    return
+                    break
+            _log.info('Refreshed %d releases: %d changed, %d skipped' % (
+                    self.numer, changed, self.numer - changed))
             # NOTE Could delay commit in addRelease and commit once here, but
             # fetching from web is slow, so this extra delay might be
             # acceptable. Also, partial refreshes will be committed as they
@@ -1541,25 +3385,14 @@ class Catalog(object):
         """Write ASCII tracklist for releaseId to 'stream'. """
         stream.write('\n')
         _log.info('Printing tracklist for \'%s\'' % releaseId)
-# TODO this should be a function
-        for mediumId,position,format in self.cm.executeAndFetch(
-                'select id,position,format from media '
-                'where release=? order by position',
-                (releaseId,)):
+        for mediumId,position,format,trackData in \
+                self.getMediaTracks(releaseId):
             stream.write('%-60s %6s\n' % (format+' %d'%position,
                     recLengthAsString(
-                        self.getMediumLen(mediumId)
+                        sum(recLength for recId,recLength,recPosition,title
+                            in trackData if recLength)
                     )))
-# TODO this should be a function
-            for recId,recLength,recPosition,title in self.cm.executeAndFetch(
-                    'select recordings.id, recordings.length, '
-                    'medium_recordings.position, recordings.title '
-                    'from recordings '
-                    'inner join medium_recordings on '
-                    'medium_recordings.recording=recordings.id '
-                    'inner join media on medium_recordings.medium=media.id '
-                    'where media.id=? order by medium_recordings.position',
-                    (mediumId,)):
+            for recId,recLength,recPosition,title in trackData:
                 stream.write(
                     '%-60s ' % title +
                     '%6s' % recLengthAsString(recLength)
@@ -1586,7 +3419,7 @@ class Catalog(object):
     def getTrackCount(self, releaseId):
         return self.cm.executeAndFetchOne(
             'select count(medium_recordings.recording) from releases '
-            'inner join media on media.release = releases.id '
+            'inner join media on media.release = releases.key '
             'inner join medium_recordings on '
             'medium_recordings.medium = media.id '
             'where releases.id=?', (releaseId,))[0]
@@ -1611,34 +3444,44 @@ class Catalog(object):
         'sortformat',
         ]
 
+    def _basicTableQuery(self, filt=''):
+        # TODO this does not sanitize the 'filt' argument!
+        return 'select '+','.join(self.basicColumns)+' from releases'+\
+            (((' where '+filt) if filt else '')+\
+            ' order by sortstring')
+
     def getBasicTable(self, filt=''):
         """
         Fetch "basic" information about all the releases and return a list of
         lists. Accepts SQL code for the 'where' clause in the 'filt' argument.
         """
-        # TODO this does not sanitize the 'filt' argument!
-        return self.cm.executeAndFetch(
-            'select '+','.join(self.basicColumns)+' from releases'+\
-            (((' where '+filt) if filt else '')+\
-            ' order by sortstring'))
+        return self.cm.executeAndFetch(self._basicTableQuery(filt))
 
-    def getAdvTable(self, filt=''):
+    def iterBasicTable(self, filt=''):
+        """Like getBasicTable(), but generate the rows as they are fetched."""
+        return self.cm.iterFetch(self._basicTableQuery(filt))
+
+    def _advTableQuery(self, filt=''):
         advColumns = self.basicColumns[:]
-        id_idx = advColumns.index('id')
-        advColumns[id_idx] = 'release'
-        rColumns = self.basicColumns[:]
-        del rColumns[id_idx]
-        advColumns.append('datetime(min_date, \'unixepoch\', \'localtime\')')
+        advColumns.append('datetime(firstadded, \'unixepoch\', \'localtime\')')
         query = \
-            'select '+', '.join(advColumns)+' from ('+\
-            'select d.release, min(d.date) as min_date, '+\
-            ', '.join(['r.'+col for col in rColumns])+' from '+\
-            'added_dates as d inner join releases as r on r.id = d.release '+\
-            'group by release) '+\
-            (('where '+filt+' ') if filt else '')+\
+            'select '+', '.join(advColumns)+' from releases '+\
+            'where firstadded is not null '+\
+            (('and ('+filt+') ') if filt else '')+\
             'order by sortstring'
         _log.debug(query)
-        return self.cm.executeAndFetch(query)
+        return query
+
+    def getAdvTable(self, filt=''):
+        """
+        Fetch the basic information and the first added date of all the
+        releases. Accepts SQL code for the 'where' clause in 'filt'.
+        """
+        return self.cm.executeAndFetch(self._advTableQuery(filt))
+
+    def iterAdvTable(self, filt=''):
+        """Like getAdvTable(), but generate the rows as they are fetched."""
+        return self.cm.iterFetch(self._advTableQuery(filt))
 
     def getReleaseTitle(self, releaseId):
         return self.cm.executeAndFetchOne(
@@ -1681,7 +3524,7 @@ class Catalog(object):
         return self.cm.executeAndFetchOne(
             'select sum(recordings.length) from medium_recordings '
             'inner join recordings '
-            'on medium_recordings.recording=recordings.id '
+            'on medium_recordings.recording=recordings.key '
             'where medium_recordings.medium=?',
             (mediumId,))[0]
 
@@ -1689,14 +3532,49 @@ class Catalog(object):
         return self.cm.executeAndFetchOne(
             'select sum(recordings.length) from releases '
             'inner join media '
-            'on media.release=releases.id '
+            'on media.release=releases.key '
             'inner join medium_recordings '
             'on medium_recordings.medium = media.id '
             'inner join recordings '
-            'on medium_recordings.recording=recordings.id '
+            'on medium_recordings.recording=recordings.key '
             'where releases.id=?',
             (releaseId,))[0]
 
+# The compressors of the meta dictionaries in a worker process of
+# Catalog.rebuildDerivedTables, by dictionary ID
+_workerCompressors = dict()
+
+def _initRebuildWorker(dictionaries):
+    """Start a worker process of Catalog.rebuildDerivedTables with the
+    meta dictionaries of the catalog, by ID."""
+    for dictionaryId, dictionary in dictionaries.items():
+        _workerCompressors[dictionaryId] = \
+                compression.DictionaryCompressor(dictionary)
+
+def _digestReleases(metaRows, getCompressor=None):
+    """
+    Decompress, parse and digest a chunk of (release ID, compressed XML) for
+    Catalog.rebuildDerivedTables. Return (release ID, digest) for each,
+    where digest is the release columns, packed release, words and track
+    rows which digestReleaseXml() writes, or None for a release which has
+    been merged into another.
+    """
+    getCompressor = getCompressor or _workerCompressors.__getitem__
+    digests = []
+    for releaseId, meta in metaRows:
+        release = Catalog.getReleaseDictFromXml(
+                Catalog.unpackMeta(meta, getCompressor))['release']
+        if release['id'] != releaseId:
+            digests.append((releaseId, None))
+            continue
+        releaseDict = Catalog.packReleaseDict(release)
+        digests.append((releaseId, (
+                Catalog.getReleaseColumns(release),
+                bytes(releaseDict) if releaseDict is not None else None,
+                list(Catalog.getReleaseWords(release)),
+                Catalog.getTrackRows(release))))
+    return digests
+
 # TODO move to mbcat/ and change to lengthAsTime
 def recLengthAsString(recLength):
     if not recLength:
@@ -0,0 +1,62 @@
+"""
+zlib compression with a preset dictionary, for the release XML.
+
+The release XML documents are small and alike, so most of what zlib could
+find repeated in one is already in the others: the element names, the
+namespace, common values. Compressing each document after a dictionary of
+such strings lets zlib refer back to them from the start.
+
+zlib in Python 2 takes no preset dictionary, so the same effect is had by
+compressing the dictionary and flushing the stream, and copying that
+compressor for each document. A decompressor fed the compressed dictionary
+is copied in the same way, so only what follows the dictionary is stored.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import re
+import zlib
+from collections import Counter
+
+# The dictionary is as large as the deflate window
+maxDictionarySize = 32*1024
+
+# The pieces of the XML which may be the same between releases: the tags,
+# up to any attribute value, the attribute values and the text between tags
+fragmentPattern = re.compile(br'<[^>"]*(?:"|>)?|[^<"]+')
+
+def makeDictionary(samples, size=maxDictionarySize):
+    """
+    Make a dictionary for compressing documents like those in the list
+    'samples'. The fragments found in more than one sample go at the end of
+    the dictionary, where the references to them cost the least, those
+    saving the most last. The rest is filled with the samples themselves.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(fragmentPattern.findall(sample)))
+    fragments = []
+    total = 0
+    for saving, fragment in sorted(((n*len(fragment), fragment)
+            for fragment, n in counts.items() if n > 1), reverse=True):
+        if total + len(fragment) <= size:
+            fragments.append(fragment)
+            total += len(fragment)
+    filler = b''.join(samples)[-(size - total):] if total < size else b''
+    return filler + b''.join(reversed(fragments))
+
+class DictionaryCompressor(object):
+    """Compress and decompress documents with a preset dictionary."""
+    def __init__(self, dictionary, level=zlib.Z_DEFAULT_COMPRESSION):
+        self.compressor = zlib.compressobj(level)
+        prefix = self.compressor.compress(dictionary) + \
+                self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.decompressor = zlib.decompressobj()
+        self.decompressor.decompress(prefix)
+
+    def compress(self, data):
+        compressor = self.compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        decompressor = self.decompressor.copy()
+        return decompressor.decompress(data) + decompressor.flush()
@@ -161,6 +161,8 @@ class ThreadedCall(threading.Thread):
     This thread class is for inheriting to implement a thread which runs a task
     and does something with the return value.
     """
+    # database commands from this thread wait behind interactive ones
+    background = True
 
     def __init__(self, fun, *args, **kwargs):
         super(ThreadedCall, self).__init__()
@@ -185,6 +187,8 @@ class ThreadedCall(threading.Thread):
 class ThreadedTask(threading.Thread):
     """This does something that takes a while and keeps track of its own
     progress"""
+    # database commands from this thread wait behind interactive ones
+    background = True
 
     def __init__(self, denom):
         super(ThreadedTask, self).__init__()
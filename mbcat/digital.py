@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 from . import catalog
 from . import dialogs
 from . import utils
+from . import text
 import os
 import re
 import collections
@@ -117,9 +118,6 @@ class DigitalPath(list):
                 elem.eval(release) for elem in self
             ])
 
-punctuation = { 0x2018:0x27, 0x2019:0x27, 0x201C:0x22, 0x201D:0x22,
-        0x2010:0x2d }
-
 def getArtistPathVariations(release):
     s = set([
             # the non-sorting-friendly string
@@ -132,7 +130,7 @@ def getArtistPathVariations(release):
             catalog.getArtistSortPhrase(release)
             ])
     for i in list(s):
-        s.add(unicode(i).translate(punctuation).encode('ascii', 'ignore'))
+        s.add(text.asciiFold(i))
     return s
 
 def getTitlePathVariations(release):
@@ -147,7 +145,7 @@ def getTitlePathVariations(release):
             s.add(prefix+release['disambiguation'])
             s.add(prefix+release['title']+' ('+release['disambiguation']+')')
     for i in list(s):
-        s.add(i.translate(punctuation).encode('ascii', 'ignore'))
+        s.add(text.asciiFold(i))
         if i.startswith('.'):
             n = i
             while n.startswith('.'):
@@ -65,7 +65,8 @@ class HtmlWriter(dialogs.ThreadedTask):
                 'includeDetails' : False,
                 }
 
-        outputText = template.render( templateVars )
-        htf.write(outputText)
+        # write the page as it is generated rather than build it all first
+        for outputText in template.generate( templateVars ):
+            htf.write(outputText)
         return
 
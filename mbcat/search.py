@@ -0,0 +1,84 @@
+"""
+Full-text search of the catalog with the SQLite FTS5 extension.
+
+The search tables are derived from the releases and recordings tables; see
+catalog-search-schema.sql. FTS5 is not compiled into every build of SQLite,
+so the catalog falls back to its word tables when it is missing.
+
+A search query is a list of words, each of which must match. A word ending
+with '*' matches any word starting with it, and words in double quotes must
+appear together as a phrase, e.g.
+
+    pink moon
+    "harvest moon" young
+    jack* five
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import re
+import sqlite3
+from . import text
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+_hasFts5 = None
+
+def hasFts5():
+    """Check whether the SQLite library has the FTS5 extension."""
+    global _hasFts5
+    if _hasFts5 is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('create virtual table test using fts5(x)')
+            _hasFts5 = True
+        except sqlite3.OperationalError:
+            _hasFts5 = False
+        finally:
+            conn.close()
+    return _hasFts5
+
+queryTerms = re.compile(r'"([^"]*)"?|(\S+)', re.UNICODE)
+
+def quote(s):
+    return '"' + s.replace('"', '""') + '"'
+
+def matchExpression(query):
+    """
+    Translate a search query into an FTS5 MATCH expression. The terms are
+    tokenized like the indexed text (see mbcat.text.searchText()) and
+    quoted, so that punctuation and words such as 'OR' or 'NOT' are searched
+    for rather than parsed as FTS5 syntax. Returns None if there is nothing
+    to search for.
+    """
+    terms = []
+    for phrase, word in queryTerms.findall(query):
+        words = text.tokenize(phrase or word)
+        if not words:
+            continue
+        if not phrase and word.endswith('*'):
+            # the whole of the last word, without its punctuation
+            terms.append(quote(words[-1]) + '*')
+        else:
+            terms.append(quote(' '.join(words)))
+    return ' '.join(terms) if terms else None
+
+def trigrams(word):
+    """
+    Return the set of the trigrams of a folded word. The word is padded with two
+    spaces in front and one behind, as in PostgreSQL's pg_trgm, so that the
+    start of a word counts for more than its end. This has to agree with
+    Catalog.trigramRefresh.
+    """
+    padded = '  ' + word + ' '
+    return set(padded[i:i+3] for i in range(len(padded)-2))
+
+def prefixRange(prefix):
+    """
+    Return the bounds (low, high) of the strings starting with a non-empty
+    prefix, so that an index on a column can be range scanned for them with
+    'low <= column and column < high'.
+    """
+    return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
@@ -108,7 +108,14 @@ class MBCatCmd(cmd.Cmd):
     def catalog_rebuild(self):
         """Rebuild cache database tables (used for searching)"""
         t = mbcat.dialogs.TextProgress(
-            self.c.rebuildDerivedTables(self.c))
+            self.c.rebuildDerivedTables(self.c, processes=None))
+        t.start()
+        t.join()
+
+    def catalog_compress(self):
+        """Compress the release XML with a dictionary made from it"""
+        t = mbcat.dialogs.TextProgress(
+            self.c.recompressMeta(self.c))
         t.start()
         t.join()
 
@@ -117,6 +124,26 @@ class MBCatCmd(cmd.Cmd):
         print("Running checks...\n")
         self.printReleaseList(self.c.checkReleases())
 
+    def catalog_slow(self):
+        """Summarize the slowest database queries"""
+        summary = self.c.slowQueries()
+        if summary is None:
+            self.c.enableSlowQueryLog()
+            print('Logging queries slower than %g s. Run some commands and '
+                'try again.' % self.c.slowQueryThreshold)
+            return
+        if not summary:
+            print('No queries slower than %g s so far.' %
+                self.c.slowQueryThreshold)
+            return
+        for entry in summary[:10]:
+            print('%d run(s), %.3f s total, %.3f s max: %s' % (
+                entry['count'], entry['total'], entry['max'],
+                entry['statement']))
+            print('    parameters: %s' % entry['params'])
+            for detail in entry['plan']:
+                print('    ' + detail)
+
     def formatReleaseInfo(self, releaseId):
         return ' '.join([
                 releaseId, ':', \
@@ -128,20 +155,41 @@ class MBCatCmd(cmd.Cmd):
                 '['+str(self.c.getReleaseFormat(releaseId))+']', \
             ])
 
+    def _complete_word(self, text, state):
+        """A readline completer for the words in the release search index"""
+        if state == 0:
+            self.wordCompletions = self.c.completeWord(text,
+                    limit=self.searchResultsLimit) if text else []
+        if state < len(self.wordCompletions):
+            return self.wordCompletions[state]
+
+    def _input_search_terms(self, prompt):
+        """Read search terms, completing words with the tab key"""
+        completer = readline.get_completer()
+        readline.set_completer(self._complete_word)
+        try:
+            return raw_input(prompt)
+        finally:
+            readline.set_completer(completer)
+
     def _search_release(self, prompt="Enter search terms (or release ID): "):
         """Search for a release and return release ID."""
-        # TODO could use readline.get_completer() and
-        # readline.set_completer(fun) here in order to temporarily substitute a
-        # custom completer for releases
         while(True):
-            input = raw_input(prompt)
+            input = self._input_search_terms(prompt)
             if input:
                 if len(mbcat.utils.getReleaseIdFromInput(input)) == 36:
                     releaseId = mbcat.utils.getReleaseIdFromInput(input)
                     print("Release %s selected.\n" % \
                             self.formatReleaseInfo(releaseId))
                     return releaseId
-                matches = list(self.c._search(input))
+                matches = self.c.search(input)
+                if not matches:
+                    corrected = self.c.correctQuery(input)
+                    if corrected != input:
+                        matches = self.c.search(corrected)
+                        if matches:
+                            print('No matches for "%s", showing matches for '
+                                '"%s".\n' % (input, corrected))
                 if len(matches) > 1:
                     print("%d matches found:\n" % len(matches))
                     for i, match in enumerate(matches):
@@ -793,7 +841,9 @@ class MBCatCmd(cmd.Cmd):
             'catalog': {
                 'report': catalog_report,
                 'rebuild': catalog_rebuild,
+                'compress': catalog_compress,
                 'check': catalog_check,
+                'slow': catalog_slow,
                 },
             'search': {
                 'release': search_release,
@@ -0,0 +1,172 @@
+"""
+Timing statistics for the commands run by a ConnectionManager.
+
+Each command is timed from when it is queued, to when the manager thread
+starts it, to when it finishes. The time spent waiting in the queue and the
+time spent executing are aggregated per SQL statement, so that a slow query
+can be told apart from a fast one which was stuck behind a long write.
+
+The slow-query log keeps the statements that ran for longer than a threshold,
+along with their parameters and query plans.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import threading
+import time
+import json
+from collections import deque
+
+try:
+    stringTypes = basestring
+except NameError:
+    stringTypes = str
+
+class Timing(object):
+    """Count, total and maximum of a series of durations in seconds."""
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def asDict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            }
+
+class ConnectionStats(object):
+    """
+    Statistics for one ConnectionManager. enqueued() is called from the
+    thread that queues a command, finished() from the manager thread.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.since = time.time()
+            self.wait = Timing()
+            self.run = Timing()
+            # queue depth seen by each new command
+            self.depth = Timing()
+            self.statements = dict()
+
+    def enqueued(self, depth):
+        with self.lock:
+            self.depth.add(depth)
+
+    def finished(self, statement, queued, started, done):
+        with self.lock:
+            self.wait.add(started - queued)
+            self.run.add(done - started)
+            if statement not in self.statements:
+                self.statements[statement] = (Timing(), Timing())
+            wait, run = self.statements[statement]
+            wait.add(started - queued)
+            run.add(done - started)
+
+    def asDict(self):
+        with self.lock:
+            elapsed = time.time() - self.since
+            return {
+                'name': self.name,
+                'elapsed': elapsed,
+                'commands': self.run.count,
+                'throughput': self.run.count / elapsed if elapsed else 0.0,
+                'wait': self.wait.asDict(),
+                'run': self.run.asDict(),
+                'depth': self.depth.asDict(),
+                'statements': dict(
+                    (statement, {'wait': wait.asDict(), 'run': run.asDict()})
+                    for statement, (wait, run) in self.statements.items()),
+                }
+
+def splitStatement(args):
+    """
+    Find the SQL statement in the arguments of a queued command and return it
+    with its parameters, or (None, None) if the command has no SQL.
+    """
+    for i, arg in enumerate(args[:2]):
+        if isinstance(arg, stringTypes):
+            return arg, args[i+1] if len(args) > i+1 else ()
+    return None, None
+
+def normalize(statement):
+    # collapse whitespace so that multi-line statements aggregate
+    return ' '.join(statement.split())
+
+def statementOf(fun, args):
+    """
+    Return a label for a queued command: the SQL it executes if there is any,
+    otherwise the name of the function.
+    """
+    statement, params = splitStatement(args)
+    if statement is not None:
+        return normalize(statement)
+    return getattr(fun, '__name__', repr(fun))
+
+class SlowQueryLog(object):
+    """
+    The most recent statements that took longer than 'threshold' seconds to
+    execute. Each entry is a dictionary with the statement, its parameters,
+    the time it took, when it ran, and the plan from EXPLAIN QUERY PLAN.
+    """
+    def __init__(self, threshold, size=500):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=size)
+
+    def add(self, statement, params, seconds, plan):
+        with self.lock:
+            self.entries.append({
+                'statement': normalize(statement),
+                'params': repr(params),
+                'seconds': seconds,
+                'time': time.time(),
+                'plan': plan,
+                })
+
+    def summary(self):
+        """
+        Group the entries by statement and return a list of dictionaries with
+        the count, total and maximum time, the parameters of the slowest run
+        and the latest plan of each, the worst offenders first.
+        """
+        statements = dict()
+        with self.lock:
+            entries = list(self.entries)
+        for entry in entries:
+            statement = entry['statement']
+            if statement not in statements:
+                statements[statement] = {
+                    'statement': statement,
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    }
+            summary = statements[statement]
+            summary['count'] += 1
+            summary['total'] += entry['seconds']
+            summary['plan'] = entry['plan']
+            if entry['seconds'] >= summary['max']:
+                summary['max'] = entry['seconds']
+                summary['params'] = entry['params']
+        return sorted(statements.values(),
+                key=lambda summary: summary['total'], reverse=True)
+
+def dump(stats, path):
+    """Write statistics, as returned by Catalog.stats(), to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
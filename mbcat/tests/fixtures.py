@@ -0,0 +1,89 @@
+"""Releases and catalogs shared by the mbcat unit tests"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import mbcat.catalog
+
+import tempfile
+import shutil
+import os
+
+def recordingId(releaseId, n):
+    """The ID of the recording of track 'n' of a release made by
+    makeReleaseXml()."""
+    return '%08d-1111-4000-8000-%s' % (n, releaseId[-12:])
+
+def makeReleaseXml(releaseId, title='Test Release', artist='Tester',
+        label=None, catno=None, date=None, country=None, barcode=None,
+        media=[[]], discs={}):
+    """
+    Make the MusicBrainz XML of a release. 'media' is a list of the track
+    lists of its media, and a track is a title, a (title, length) pair or a
+    (title, length, recording ID) triple. The tracks are numbered across the
+    media, and a recording ID which is not given follows from the number,
+    see recordingId(). 'discs' maps the position of a medium to the (disc
+    ID, sectors) of its discs.
+    """
+    n = 0
+    mediumXml = []
+    for position, tracks in enumerate(media, 1):
+        trackXml = []
+        for number, track in enumerate(tracks, 1):
+            n += 1
+            if not isinstance(track, tuple):
+                track = (track, 1000)
+            if len(track) == 2:
+                track += (recordingId(releaseId, n),)
+            trackTitle, length, trackRecordingId = track
+            trackXml.append('<track id="%08d-0000-4000-8000-%s">'
+                '<position>%d</position><number>%d</number>'
+                '<recording id="%s"><title>%s</title>'
+                '<length>%d</length></recording></track>' % (
+                    n, releaseId[-12:], number, number,
+                    trackRecordingId, trackTitle, length))
+        discXml = ['<disc id="%s"><sectors>%d</sectors></disc>' % disc
+                for disc in discs.get(position, [])]
+        mediumXml.append('<medium><position>%d</position><format>CD</format>'
+            '<disc-list count="%d">%s</disc-list>'
+            '<track-list count="%d" offset="0">%s</track-list></medium>' % (
+                position, len(discXml), ''.join(discXml),
+                len(trackXml), ''.join(trackXml)))
+    labelXml = ('<label-info-list count="1"><label-info>'
+        '<catalog-number>%s</catalog-number>'
+        '<label id="%s"><name>%s</name></label>'
+        '</label-info></label-info-list>' % (catno, releaseId, label)) \
+            if label else ''
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#">'
+        '<release id="%s"><title>%s</title><status>Official</status>'
+        '%s%s%s'
+        '<artist-credit><name-credit><artist id="%s"><name>%s</name>'
+        '<sort-name>%s</sort-name></artist></name-credit></artist-credit>'
+        '%s<medium-list count="%d">%s</medium-list></release></metadata>' % (
+            releaseId, title,
+            '<date>%s</date>' % date if date else '',
+            '<country>%s</country>' % country if country else '',
+            '<barcode>%s</barcode>' % barcode if barcode else '',
+            releaseId, artist, artist, labelXml,
+            len(mediumXml), ''.join(mediumXml))).encode('utf-8')
+
+class CatalogTestCase(unittest.TestCase):
+    """Start each test with an empty catalog in a temporary directory."""
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpDir, 'catalog.sqlite3')
+        self.cachePath = os.path.join(self.tmpDir, 'cache')
+        self.catalog = mbcat.catalog.Catalog(self.dbfile, self.cachePath)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.tmpDir)
+
+    def digestReleases(self, *releases):
+        """Digest the (release ID, XML) pairs into the catalog."""
+        for releaseId, releaseXml in releases:
+            self.catalog.digestReleaseXml(releaseId, releaseXml)
+        self.catalog.cm.commit()
@@ -0,0 +1,98 @@
+"""Unit test for the mbcat release cache"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import mbcat.cache
+
+import sqlite3
+import zlib
+
+import fixtures
+from fixtures import makeReleaseXml
+
+releaseId = '11111111-1111-4111-8111-111111111111'
+
+class LRUCacheTest(unittest.TestCase):
+    def test_lru(self):
+        c = mbcat.cache.LRUCache(3)
+        for key in 'abc':
+            c.put(key, key.upper())
+        self.assertEqual(c.get('a'), 'A')
+        # 'b' is the least recently used now
+        c.put('d', 'D')
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual([c.get(key) for key in 'acd'], ['A', 'C', 'D'])
+        self.assertEqual(c.asDict()['hits'], 4)
+        self.assertEqual(c.asDict()['misses'], 1)
+
+    def test_sizes(self):
+        c = mbcat.cache.LRUCache(10)
+        c.put('a', 'A', size=6)
+        c.put('b', 'B', size=6)
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.size, 6)
+        c.put('c', 'C', size=11)
+        self.assertEqual(c.get('c'), None)
+        c.put('b', 'B', size=2)
+        self.assertEqual(c.size, 2)
+        c.resize(1)
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.size, 0)
+
+    def test_versions(self):
+        c = mbcat.cache.LRUCache(10)
+        c.put('a', 'A', version=1)
+        self.assertEqual(c.get('a', 1), 'A')
+        self.assertEqual(c.get('a', 2), None)
+        # the stale value is gone
+        self.assertEqual(c.get('a', 1), None)
+        self.assertEqual(c.size, 0)
+
+class ReleaseCacheTest(fixtures.CatalogTestCase):
+    def setUp(self):
+        fixtures.CatalogTestCase.setUp(self)
+        self.digestReleases((releaseId, makeReleaseXml(releaseId, 'Old Title')))
+
+    def test_hits(self):
+        c = self.catalog
+        release = c.getRelease(releaseId)
+        self.assertTrue(c.getRelease(releaseId) is release)
+        stats = c.releaseCacheStats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                (1, 1, 1))
+        self.assertTrue(0 < stats['size'] <= stats['maxSize'])
+
+        c.setReleaseCacheSize(0)
+        c.getRelease(releaseId)
+        self.assertEqual(c.releaseCacheStats()['entries'], 0)
+
+    def test_invalidation(self):
+        c = self.catalog
+        self.assertEqual(c.getRelease(releaseId)['title'], 'Old Title')
+        c.digestReleaseXml(releaseId, makeReleaseXml(releaseId, 'New Title'))
+        c.cm.commit()
+        self.assertEqual(c.getRelease(releaseId)['title'], 'New Title')
+
+        # a change to the metatime makes the cached release stale
+        c.cm.execute('update release_dicts set dict=null')
+        c.cm.execute('update release_meta set meta=?',
+                (sqlite3.Binary(zlib.compress(
+                    makeReleaseXml(releaseId, 'Newer Title'))),))
+        c.cm.execute('update releases set metatime=metatime+1')
+        c.cm.commit()
+        self.assertEqual(c.getRelease(releaseId)['title'], 'Newer Title')
+
+        c.getRelease(releaseId)
+        c.unDigestRelease(releaseId)
+        c.cm.commit()
+        self.assertEqual(c.releaseCacheStats()['entries'], 0)
+        self.assertRaises(KeyError, c.getRelease, releaseId)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LRUCacheTest))
+    suite.addTest(unittest.makeSuite(ReleaseCacheTest))
+    return suite
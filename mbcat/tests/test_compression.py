@@ -0,0 +1,73 @@
+"""Unit test for the compression of the release XML"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import mbcat.compression
+
+import zlib
+
+import fixtures
+
+def makeRelease(n):
+    releaseId = '%08d-1111-4111-8111-111111111111' % n
+    return releaseId, fixtures.makeReleaseXml(releaseId, 'Release %d' % n,
+            'Artist %d' % n, country='US')
+
+class CompressionTest(unittest.TestCase):
+    def test_dictionary(self):
+        samples = [makeRelease(n)[1] for n in range(20)]
+        dictionary = mbcat.compression.makeDictionary(samples, size=1000)
+        self.assertEqual(len(dictionary), 1000)
+        # the common fragments are at the end
+        self.assertTrue(b'<sort-name>' in dictionary[-500:])
+        compressor = mbcat.compression.DictionaryCompressor(dictionary)
+        releaseXml = makeRelease(100)[1]
+        compressed = compressor.compress(releaseXml)
+        self.assertTrue(len(compressed) < len(zlib.compress(releaseXml)))
+        self.assertEqual(compressor.decompress(compressed), releaseXml)
+        self.assertEqual(compressor.decompress(compressed), releaseXml)
+
+class CatalogCompressionTest(fixtures.CatalogTestCase):
+    def setUp(self):
+        fixtures.CatalogTestCase.setUp(self)
+        self.releases = dict(makeRelease(n) for n in range(10))
+        self.digestReleases(*self.releases.items())
+
+    def getMeta(self):
+        return dict(self.catalog.cm.executeAndFetch(
+                'select release, meta from release_meta'))
+
+    def test_recompress(self):
+        c = self.catalog
+        self.assertEqual(c.metaDictionary, None)
+        before = self.getMeta()
+        c.recompressMeta(c).run()
+        self.assertEqual(c.metaDictionary, 1)
+        after = self.getMeta()
+        for releaseId, releaseXml in self.releases.items():
+            self.assertEqual(bytes(after[releaseId][:1]), b'\0')
+            self.assertTrue(len(after[releaseId]) < len(before[releaseId]))
+            self.assertEqual(c.getReleaseXml(releaseId), releaseXml)
+
+        # new releases are compressed with the dictionary too
+        releaseId, releaseXml = makeRelease(10)
+        c.digestReleaseXml(releaseId, releaseXml)
+        c.cm.commit()
+        self.assertEqual(c.getReleaseXml(releaseId), releaseXml)
+
+        # again, and only the new dictionary is kept
+        c.recompressMeta(c).run()
+        self.assertEqual(c.cm.executeAndChain(
+                'select id from meta_dictionaries'), [2])
+        c.open(self.dbfile, self.cachePath)
+        self.assertEqual(c.metaDictionary, 2)
+        self.assertEqual(dict(c.iterReleaseXml())[releaseId], releaseXml)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CompressionTest))
+    suite.addTest(unittest.makeSuite(CatalogCompressionTest))
+    return suite
@@ -0,0 +1,315 @@
+"""Unit test for the mbcat connection manager"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+import threading
+
+import mbcat.catalog
+
+import tempfile
+import sqlite3
+import time
+import os
+
+class ConnectionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = tempfile.mktemp()
+        self.cm = mbcat.catalog.ConnectionManager(self.dbfile)
+        self.cm.execute('create table numbers (n INTEGER, square INTEGER)')
+        for n in range(100):
+            self.cm.execute('insert into numbers values (?,?)', (n, n*n))
+        self.cm.commit()
+
+    def tearDown(self):
+        self.cm.stop()
+        for manager in [self.cm] + self.cm.readers:
+            manager.join()
+        os.unlink(self.dbfile)
+
+    def test_concurrent_fetches(self):
+        errors = []
+        def worker(n):
+            for i in range(50):
+                row = self.cm.executeAndFetchOne(
+                    'select square from numbers where n=?', (n,))
+                if row != (n*n,):
+                    errors.append((n, row))
+        threads = [threading.Thread(target=worker, args=(n,))
+                for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test_queued_fetches(self):
+        events = [self.cm.queueFetch(self.cm.fetchChain,
+                'select square from numbers where n<?', (n,))
+                for n in range(10)]
+        for n, event in enumerate(events):
+            event.wait()
+            self.assertEqual(self.cm.getResult(event),
+                    [i*i for i in range(n)])
+
+    def test_executemany(self):
+        self.cm.executemany('insert into numbers values (?,?)',
+                [(n, n*n) for n in range(100, 200)])
+        self.cm.commit()
+        self.assertEqual(self.cm.executeAndFetchOne(
+                'select count(*), sum(square) from numbers'),
+                (200, sum(n*n for n in range(200))))
+
+    def test_query_errors(self):
+        future = self.cm.queueFetch(self.cm.fetchAll, 'select * from nothing')
+        self.assertTrue(isinstance(future.exception(), sqlite3.OperationalError))
+        self.assertRaises(sqlite3.OperationalError, future.result)
+        self.assertRaises(sqlite3.OperationalError,
+                self.cm.executeAndFetch, 'select * from nothing')
+        # the manager keeps going after an error
+        self.assertEqual(self.cm.executeAndFetchOne(
+                'select count(*) from numbers'), (100,))
+
+    def test_query_timeout(self):
+        release = threading.Event()
+        future = self.cm.queueQuery(release.wait)
+        self.assertRaises(mbcat.catalog.QueryTimeout, future.result, 0.05)
+        self.assertFalse(future.done())
+        release.set()
+        self.assertTrue(future.result(5))
+
+    def test_done_callback(self):
+        done = []
+        future = self.cm.queueFetch(self.cm.fetchOne,
+                'select square from numbers where n=?', (7,))
+        called = threading.Event()
+        future.add_done_callback(lambda f: (done.append(f.result()),
+                called.set()))
+        called.wait()
+        # called right away once the future is done
+        future.add_done_callback(lambda f: done.append(f.result()))
+        self.assertEqual(done, [(49,), (49,)])
+
+    def test_priority_lanes(self):
+        order = []
+        started = threading.Event()
+        release = threading.Event()
+        def block():
+            started.set()
+            release.wait()
+
+        class BackgroundThread(threading.Thread):
+            background = True
+        def queueBackground():
+            self.cm.queueCmd(block)
+            started.wait()
+            for n in range(10):
+                self.cm.queueCmd(order.append, ('background', n))
+        t = BackgroundThread(target=queueBackground)
+        t.start()
+        t.join()
+        futures = [self.cm.queueQuery(order.append, ('interactive', n))
+                for n in range(10)]
+        release.set()
+        for future in futures:
+            future.result()
+
+        # interactive commands go first, but background ones get a turn
+        share = self.cm.backgroundShare
+        self.assertEqual(order[:share+1],
+                [('interactive', n) for n in range(share)] +
+                [('background', 0)])
+        self.cm.queueAndGet(lambda: None)
+        # each lane stays in order
+        self.assertEqual([n for lane, n in order if lane == 'background'],
+                list(range(10)))
+        self.assertEqual([n for lane, n in order if lane == 'interactive'],
+                list(range(10)))
+
+    def test_slow_query_log(self):
+        self.assertEqual(self.cm.getSlowQueries(), None)
+        self.cm.enableSlowQueryLog(0)
+        for n in range(3):
+            self.cm.executeAndFetchOne(
+                    'select square from numbers where n=?', (n,))
+        self.cm.execute('create index numbers_n on numbers(n)')
+        self.cm.executeAndFetchOne(
+                'select square from numbers where n=?', (50,))
+
+        summary = self.cm.getSlowQueries()
+        select = [entry for entry in summary if entry['statement'] ==
+                'select square from numbers where n=?'][0]
+        self.assertEqual(select['count'], 4)
+        self.assertTrue(select['total'] >= select['max'])
+        # the latest plan uses the new index
+        self.assertTrue(any('numbers_n' in detail
+                for detail in select['plan']), select['plan'])
+
+        self.cm.enableSlowQueryLog(None)
+        self.assertEqual(self.cm.getSlowQueries(), None)
+
+    def test_slow_query_log_rollback(self):
+        self.cm.enableSlowQueryLog(0)
+        self.cm.deferCommits()
+        self.cm.execute('insert into numbers values (?,?)', (100, 10000))
+        self.cm.executeAndFetchOne('select count(*) from numbers')
+        self.cm.resumeCommits(rollback=True)
+        # explaining the statements did not commit the insert
+        self.assertEqual(self.committedCount(), 100)
+        self.assertEqual(self.cm.executeAndFetchOne(
+                'select count(*) from numbers'), (100,))
+        self.assertEqual(len(self.cm.getSlowQueries()), 2)
+
+    def test_iter_fetch(self):
+        for chunkSize in [7, 10, 1000]:
+            self.assertEqual(list(self.cm.iterChain(
+                    'select square from numbers order by n',
+                    chunkSize=chunkSize)),
+                    [n*n for n in range(100)])
+        # stop early
+        rows = self.cm.iterFetch('select n from numbers where n>?', (49,),
+                chunkSize=10)
+        self.assertEqual(next(rows), (50,))
+        rows.close()
+        self.assertRaises(sqlite3.OperationalError, list,
+                self.cm.iterFetch('select * from nothing'))
+
+    def committedCount(self):
+        """Count the rows another connection can see."""
+        conn = sqlite3.connect(self.dbfile)
+        try:
+            return conn.execute('select count(*) from numbers').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_deferred_commits(self):
+        self.cm.deferCommits()
+        self.cm.deferCommits()
+        for n in range(100, 110):
+            self.cm.execute('insert into numbers values (?,?)', (n, n*n))
+            self.cm.commit()
+        self.cm.resumeCommits()
+        self.assertEqual(self.committedCount(), 100)
+        self.cm.resumeCommits()
+        self.assertEqual(self.committedCount(), 110)
+        self.assertFalse(self.cm.deferringThreads)
+
+    def test_rollback(self):
+        self.cm.deferCommits()
+        self.cm.execute('delete from numbers')
+        self.cm.commit()
+        self.cm.resumeCommits(rollback=True)
+        self.assertEqual(self.cm.executeAndFetchOne(
+                'select count(*) from numbers'), (100,))
+        self.assertFalse(self.cm.dirtyThreads)
+
+    def test_group_commit(self):
+        self.cm.groupCommitDelay = 0.2
+        for n in range(100, 110):
+            self.cm.execute('insert into numbers values (?,?)', (n, n*n))
+            self.cm.commit()
+        self.assertEqual(self.committedCount(), 100)
+        time.sleep(0.5)
+        self.assertEqual(self.committedCount(), 110)
+
+        # close() flushes a pending commit
+        self.cm.execute('insert into numbers values (?,?)', (110, 110*110))
+        self.cm.commit()
+        self.cm.close()
+        self.assertEqual(self.committedCount(), 111)
+
+    def test_group_commit_rollback(self):
+        self.cm.groupCommitDelay = 0.2
+        # another thread's write, acknowledged but not committed yet
+        t = threading.Thread(target=lambda: (self.cm.execute(
+                'insert into numbers values (?,?)', (100, 10000)),
+                self.cm.commit()))
+        t.start()
+        t.join()
+        self.cm.deferCommits()
+        self.cm.execute('insert into numbers values (?,?)', (101, 10201))
+        self.cm.resumeCommits(rollback=True)
+        time.sleep(0.5)
+        self.assertEqual(self.committedCount(), 101)
+        self.assertEqual(self.cm.executeAndChain(
+                'select n from numbers where n>=100'), [100])
+
+    def test_stats(self):
+        self.assertEqual(self.cm.getStats(), None)
+        self.cm.enableStats()
+        for n in range(10):
+            self.cm.executeAndFetchOne(
+                    'select square from numbers where n=?', (n,))
+        self.cm.execute('insert into numbers values (?,?)', (100, 10000))
+        self.cm.commit()
+
+        stats = self.cm.getStats()
+        self.assertEqual(len(stats['readers']), len(self.cm.readers))
+        statements = dict(stats['writer']['statements'])
+        for reader in stats['readers']:
+            statements.update(reader['statements'])
+        select = statements['select square from numbers where n=?']
+        self.assertEqual(select['run']['count'], 10)
+        self.assertTrue(select['run']['max'] >= select['run']['mean'] >= 0)
+        self.assertEqual(statements['_commit']['run']['count'], 1)
+
+        self.cm.enableStats(False)
+        self.assertEqual(self.cm.getStats(), None)
+
+class ReaderPoolTest(ConnectionManagerTest):
+    def setUp(self):
+        self.dbfile = tempfile.mktemp()
+        self.cm = mbcat.catalog.ConnectionManager(self.dbfile, readers=2)
+        self.cm.execute('create table numbers (n INTEGER, square INTEGER)')
+        for n in range(100):
+            self.cm.execute('insert into numbers values (?,?)', (n, n*n))
+        self.cm.commit()
+
+    def test_read_own_writes(self):
+        self.assertEqual(len(self.cm.readers), 2)
+        self.cm.execute('insert into numbers values (?,?)', (100, 10000))
+        # this thread reads through the writer until it commits
+        self.assertEqual(self.cm.executeAndFetchOne(
+                'select count(*) from numbers'), (101,))
+
+        # other threads read the last committed state
+        counts = []
+        t = threading.Thread(target=lambda: counts.append(
+                self.cm.executeAndFetchOne('select count(*) from numbers')))
+        t.start()
+        t.join()
+        self.assertEqual(counts, [(100,)])
+
+        self.cm.commit()
+        self.assertFalse(self.cm.dirtyThreads)
+        self.assertEqual(self.cm.executeAndFetchOne(
+                'select count(*) from numbers'), (101,))
+
+    def test_commit_during_iter_fetch(self):
+        # each stream holds a reader at the state it started from
+        streams = [self.cm.iterFetch('select n from numbers', chunkSize=10)
+                for reader in self.cm.readers]
+        for stream in streams:
+            self.assertEqual(next(stream), (0,))
+        for n in [100, 101]:
+            self.cm.execute('insert into numbers values (?,?)', (n, n*n))
+            self.cm.commit()
+            self.assertEqual(self.cm.executeAndFetchOne(
+                    'select count(*) from numbers'), (n+1,))
+            # and from another thread
+            counts = []
+            t = threading.Thread(target=lambda: counts.append(
+                    self.cm.executeAndFetchOne('select count(*) from numbers')))
+            t.start()
+            t.join()
+            self.assertEqual(counts, [(n+1,)])
+            # the streams go on from where they were
+            self.assertEqual(len(list(streams.pop())), 99)
+        self.assertFalse(any(reader.streams for reader in self.cm.readers))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ConnectionManagerTest))
+    suite.addTest(unittest.makeSuite(ReaderPoolTest))
+    return suite
@@ -0,0 +1,180 @@
+"""Unit test for the mbcat catalog schema migrations"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import os
+import sqlite3
+import zlib
+
+import fixtures
+
+releaseId = '11111111-1111-4111-8111-111111111111'
+recordingId = fixtures.recordingId(releaseId, 1)
+
+releaseXml = fixtures.makeReleaseXml(releaseId, media=[['Test Song']])
+
+class SchemaTest(fixtures.CatalogTestCase):
+    def getIndexes(self):
+        return set(self.catalog.cm.executeAndChain(
+                'select name from sqlite_master where type="index"'))
+
+    def test_new_catalog(self):
+        self.assertEqual(self.catalog.getSchemaVersion(),
+                len(self.catalog.migrations))
+
+    def makeOldCatalog(self):
+        """Replace the catalog with one from before schema versioning."""
+        self.catalog.close()
+        os.remove(self.dbfile)
+        conn = sqlite3.connect(self.dbfile)
+        with open(os.path.join(os.path.dirname(__file__),
+                'schema-v0.sql')) as f:
+            conn.executescript(f.read())
+        conn.execute('insert into releases (id, meta, sortstring) '
+                'values (?,?,?)', (releaseId,
+                sqlite3.Binary(zlib.compress(releaseXml)),
+                'Tester - Test Release'))
+        conn.executemany('insert into added_dates (date, release) '
+                'values (?,?)', [(200.0, releaseId), (100.0, releaseId)])
+        conn.execute('insert into listened_dates (date, release) '
+                'values (?,?)', (300.0, releaseId))
+        conn.execute('insert into recordings (id, title, rating) '
+                'values (?,?,?)', (recordingId, 'Test Song', 5))
+        conn.commit()
+        conn.close()
+
+    def test_upgrade(self):
+        latestIndexes = self.getIndexes()
+        self.makeOldCatalog()
+
+        self.catalog.open(self.dbfile, self.cachePath)
+        self.assertEqual(self.catalog.getSchemaVersion(),
+                len(self.catalog.migrations))
+        self.assertTrue(latestIndexes.issubset(self.getIndexes()))
+        self.assertEqual(self.catalog.cm.executeAndFetchOne(
+                'select firstadded from releases where id=?', (releaseId,))[0],
+                100.0)
+        self.assertEqual(self.catalog.getFirstAdded(releaseId), 100.0)
+        self.assertEqual(self.catalog.getReleaseSummary(releaseId)[
+                'firstAdded'], 100.0)
+        self.assertFalse('first_added' in [row[1] for row in
+                self.catalog.cm.executeAndFetch(
+                    'pragma table_info(release_summary)')])
+        self.assertEqual([row[0] for row in self.catalog.getAdvTable()],
+                [releaseId])
+        # the derived tables have been rebuilt
+        self.assertEqual(self.catalog.search('tester'), [releaseId])
+        self.assertEqual(self.catalog.getReleaseXml(releaseId), releaseXml)
+        self.assertFalse('meta' in [row[1] for row in
+                self.catalog.cm.executeAndFetch('pragma table_info(releases)')])
+        self.assertEqual(self.catalog.cm.executeAndFetch(
+                'pragma foreign_key_check'), [])
+        # rebuilding the releases table did not cascade
+        self.assertEqual(self.catalog.getListenDates(releaseId), [300.0])
+        self.assertEqual(self.catalog.cm.executeAndFetchOne(
+                'pragma foreign_keys')[0], 1)
+        self.assertEqual(self.catalog.getRelease(releaseId)['title'],
+                'Test Release')
+        self.assertEqual(self.catalog.cm.executeAndFetchOne(
+                'select count(*) from release_dicts'), (1,))
+        # the recordings were numbered without losing their ratings
+        self.assertEqual(self.catalog.getRecordingRating(recordingId), 5)
+        self.assertEqual(self.catalog.searchTracks('test song'),
+                [recordingId])
+        self.assertEqual(self.catalog.getTrackCount(releaseId), 1)
+        self.assertEqual(self.catalog.recordingGetReleases(recordingId),
+                [releaseId])
+        self.assertTrue(self.catalog.hasMetaXml(releaseId, releaseXml))
+
+        # nothing to do the second time around
+        upgradedIndexes = self.getIndexes()
+        self.catalog.open(self.dbfile, self.cachePath)
+        self.assertEqual(self.getIndexes(), upgradedIndexes)
+
+    def test_release_dicts(self):
+        self.catalog.digestReleaseXml(releaseId, releaseXml)
+        self.catalog.cm.commit()
+        release = self.catalog.getRelease(releaseId)
+        self.assertEqual(release['title'], 'Test Release')
+        self.assertEqual(release, self.catalog.getReleaseDictFromXml(
+                releaseXml)['release'])
+        # the XML is parsed when there is no usable parsed release
+        self.catalog.cm.execute('update release_dicts set dict=?',
+                (sqlite3.Binary(b'garbage'),))
+        self.catalog.releaseCache.clear()
+        self.assertEqual(self.catalog.getRelease(releaseId), release)
+        self.catalog.cm.execute('delete from release_dicts')
+        self.catalog.releaseCache.clear()
+        self.assertEqual(self.catalog.getRelease(releaseId), release)
+        self.assertRaises(KeyError, self.catalog.getRelease,
+                '22222222-2222-4222-8222-222222222222')
+        # deleting the release deletes its parsed release
+        self.catalog.digestReleaseXml(releaseId, releaseXml)
+        self.catalog.deleteRelease(releaseId)
+        self.assertEqual(self.catalog.cm.executeAndFetchOne(
+                'select count(*) from release_dicts')[0], 0)
+
+    def test_unchanged_refresh(self):
+        c = self.catalog
+        c.digestReleaseXml(releaseId, releaseXml)
+        c.cm.commit()
+        self.assertTrue(c.hasMetaXml(releaseId, releaseXml))
+        # the whitespace between the elements is not metadata
+        self.assertTrue(c.hasMetaXml(releaseId,
+                releaseXml.replace(b'><', b'>\n  <')))
+        otherXml = releaseXml.replace(b'Test Song', b'Other Song')
+        self.assertFalse(c.hasMetaXml(releaseId, otherXml))
+
+        c.getCoverArt = lambda releaseId, maxage: None
+        c.fetchReleaseMetaXml = lambda releaseId: releaseXml
+        c.cm.execute('update releases set metatime=0')
+        self.assertFalse(c.addRelease(releaseId))
+        self.assertTrue(c.getMetaTime(releaseId) > 0)
+        c.fetchReleaseMetaXml = lambda releaseId: otherXml
+        self.assertTrue(c.addRelease(releaseId))
+        self.assertEqual(c.searchTracks('other song'), [recordingId])
+        self.assertTrue(c.hasMetaXml(releaseId, otherXml))
+
+    def test_failed_migration(self):
+        self.makeOldCatalog()
+        self.catalog.migrations = self.catalog.migrations + \
+                ['create table bad (x); select * from nothing;']
+        self.assertRaises(Exception,
+                self.catalog.open, self.dbfile, self.cachePath)
+        # the good migrations stay, the failed one is rolled back
+        self.assertEqual(self.catalog.getSchemaVersion(),
+                len(self.catalog.migrations)-1)
+        self.assertFalse('bad' in self.catalog.cm.executeAndChain(
+                'select name from sqlite_master where type="table"'))
+
+    def test_failed_callable_migration(self):
+        def addColumn(catalog):
+            catalog.cm.execute('alter table releases add column extra INT')
+            catalog.cm.execute('update releases set extra=1')
+        def failAfterAddColumn(catalog):
+            addColumn(catalog)
+            raise ValueError('corrupt release')
+        self.makeOldCatalog()
+        migrations = self.catalog.migrations
+        self.catalog.migrations = migrations + [failAfterAddColumn]
+        self.assertRaises(ValueError,
+                self.catalog.open, self.dbfile, self.cachePath)
+        self.assertEqual(self.catalog.getSchemaVersion(), len(migrations))
+        self.assertFalse('extra' in [row[1] for row in
+                self.catalog.cm.executeAndFetch('pragma table_info(releases)')])
+
+        # so it can be run again
+        self.catalog.close()
+        self.catalog.migrations = migrations + [addColumn]
+        self.catalog.open(self.dbfile, self.cachePath)
+        self.assertEqual(self.catalog.getSchemaVersion(), len(migrations)+1)
+        self.assertEqual(self.catalog.cm.executeAndFetchOne(
+                'select extra from releases'), (1,))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SchemaTest))
+    return suite
@@ -0,0 +1,261 @@
+"""Unit test for the mbcat catalog search"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import mbcat.search
+import mbcat.text
+
+import fixtures
+from fixtures import makeReleaseXml
+
+pinkMoon = '11111111-1111-4111-8111-111111111111'
+harvest = '22222222-2222-4222-8222-222222222222'
+homogenic = '33333333-3333-4333-8333-333333333333'
+
+class SearchTest(fixtures.CatalogTestCase):
+    def setUp(self):
+        fixtures.CatalogTestCase.setUp(self)
+        self.digestReleases(
+            (pinkMoon, makeReleaseXml(pinkMoon, 'Pink Moon', 'Nick Drake',
+                'Island', 'ILPS 9184',
+                media=[['Pink Moon', 'Place to Be', 'Road']])),
+            (harvest, makeReleaseXml(harvest, 'Harvest Moon', 'Neil Young',
+                'Reprise', '9362-45057-2',
+                media=[['Unknown Legend', 'From Hank to Hendrix',
+                    'Harvest Moon']])))
+
+    def test_tokenize(self):
+        self.assertEqual(mbcat.text.tokenize('Bj\u00f6rk'), ['bjork'])
+        self.assertEqual(mbcat.text.tokenize('AC/DC'), ['ac', 'dc', 'acdc'])
+        self.assertEqual(mbcat.text.tokenize('Don\u2019t Stop'),
+                ['don', 'dont', 'stop'])
+        self.assertEqual(mbcat.text.tokenize('R.E.M.'), ['rem'])
+        self.assertEqual(mbcat.text.asciiFold(
+                'Sigur R\u00f3s \u2013 \u00c1g\u00e6tis byrjun'),
+                'Sigur Ros - Agaetis byrjun')
+
+    def test_folding(self):
+        c = self.catalog
+        c.digestReleaseXml(homogenic, makeReleaseXml(homogenic,
+                'Homogenic', 'Bj\u00f6rk', 'One Little Indian', 'TPLP71CD',
+                media=[['J\u00f3ga', 'All Is Full of Love']]))
+        c.cm.commit()
+        for fullText in [c.fullText, False]:
+            c.fullText = fullText
+            self.assertEqual(c.search('bjork'), [homogenic])
+            self.assertEqual(c.search('BJ\u00d6RK homogenic'), [homogenic])
+            self.assertEqual(len(c.searchTracks('joga')), 1)
+        self.assertEqual(c.completeWord('Bj\u00f6'), ['bjork'])
+
+    def test_match_expression(self):
+        self.assertEqual(mbcat.search.matchExpression('pink moon'),
+                '"pink" "moon"')
+        self.assertEqual(mbcat.search.matchExpression('"harvest moon" yo*'),
+                '"harvest moon" "yo"*')
+        self.assertEqual(mbcat.search.matchExpression('a"b OR'),
+                '"a b" "or"')
+        self.assertEqual(mbcat.search.matchExpression('AC/DC ac/d*'),
+                '"ac dc acdc" "acd"*')
+        self.assertEqual(mbcat.search.matchExpression(' * '), None)
+
+    def test_search(self):
+        c = self.catalog
+        self.assertEqual(c.search('pink moon'), [pinkMoon])
+        self.assertEqual(sorted(c.search('moon')), sorted([pinkMoon, harvest]))
+        self.assertEqual(c.search('nonexistent'), [])
+        # compatibility wrapper
+        self.assertEqual(list(c._search('drake')), [pinkMoon])
+
+    def test_fields(self):
+        if not self.catalog.fullText:
+            self.skipTest('SQLite has no FTS5 extension')
+        c = self.catalog
+        self.assertEqual(c.search('reprise'), [harvest])
+        self.assertEqual(c.search('ILPS'), [pinkMoon])
+        self.assertEqual(c.search('hendrix'), [harvest])
+        self.assertEqual(c.search('dra*'), [pinkMoon])
+        self.assertEqual(c.search('"moon harvest"'), [])
+        self.assertEqual(c.search('"harvest moon"'), [harvest])
+        # a match in the title ranks above a match in the tracks only
+        self.assertEqual(c.search('road'), [pinkMoon])
+        self.assertEqual(c.search('harvest'), [harvest])
+
+    def test_tracks(self):
+        c = self.catalog
+        self.assertEqual(len(c.searchTracks('harvest moon')), 1)
+        self.assertEqual(len(c.searchTrackWords('moon')), 2)
+        self.assertEqual(c.recordingGetReleases(c.searchTracks('legend')[0]),
+                [harvest])
+
+    def test_redigest_and_delete(self):
+        c = self.catalog
+        c.digestReleaseXml(pinkMoon, makeReleaseXml(pinkMoon,
+                'Pink Moon (remaster)', 'Nick Drake', 'Island', 'ILPS 9184',
+                media=[['Pink Moon', 'Place to Be', 'Road']]))
+        c.cm.commit()
+        self.assertEqual(c.search('remaster'), [pinkMoon])
+        self.assertEqual(c.search('pink'), [pinkMoon])
+        self.assertEqual(len(c.searchTracks('road')), 1)
+
+        c.deleteRelease(pinkMoon)
+        self.assertEqual(c.search('pink'), [])
+        self.assertEqual(c.searchTracks('road'), [])
+        self.assertEqual(c.search('moon'), [harvest])
+
+    def getDerivedRows(self):
+        return [sorted(self.catalog.cm.executeAndFetch(query)) for query in [
+            'select word, releases.id from words '
+                'inner join releases on words.release=releases.key',
+            'select trackword, recordings.id from trackwords '
+                'inner join recordings on trackwords.recording=recordings.key',
+            'select releases.id, media.position, media.format, '
+                'medium_recordings.position, recordings.id, recordings.title '
+                'from medium_recordings '
+                'inner join media on medium_recordings.medium=media.id '
+                'inner join releases on media.release=releases.key '
+                'inner join recordings '
+                'on medium_recordings.recording=recordings.key']]
+
+    def test_incremental_redigest(self):
+        c = self.catalog
+        mediumIds = [medium[0] for medium in c.getMediaTracks(pinkMoon)]
+        rows = self.getDerivedRows()
+        c.digestReleaseXml(pinkMoon, makeReleaseXml(pinkMoon,
+                'Pink Moon', 'Nick Drake', 'Island', 'ILPS 9184',
+                media=[['Pink Moon', 'Place to Be', 'Road']]))
+        c.cm.commit()
+        self.assertEqual(self.getDerivedRows(), rows)
+        self.assertEqual([medium[0] for medium in c.getMediaTracks(pinkMoon)],
+                mediumIds)
+
+        c.digestReleaseXml(pinkMoon, makeReleaseXml(pinkMoon,
+                'Pink Moon', 'Nick Drake', 'Island', 'ILPS 9184',
+                media=[['Pink Moon', 'Parasite']]))
+        c.cm.commit()
+        self.assertEqual([medium[0] for medium in c.getMediaTracks(pinkMoon)],
+                mediumIds)
+        self.assertEqual(len(c.searchTracks('parasite')), 1)
+        self.assertEqual(c.searchTracks('road'), [])
+        self.assertEqual(c.getTrackCount(pinkMoon), 2)
+        # the same rows as digesting the release from scratch
+        rows = self.getDerivedRows()
+        c.rebuildDerivedTables(c).run()
+        self.assertEqual(self.getDerivedRows(), rows)
+
+    def test_shared_recording(self):
+        c = self.catalog
+        road = fixtures.recordingId(pinkMoon, 3)
+        compilation = '44444444-4444-4444-8444-444444444444'
+        pinkMoonTracks = ['Pink Moon', 'Place to Be', 'Road']
+        self.digestReleases((compilation, makeReleaseXml(compilation,
+                'Way to Blue', 'Nick Drake', 'Island', 'ILPS 9826',
+                media=[['Cello Song', ('Road', 1000, road)]])))
+
+        fullText = c.fullText
+        def assertFound(found):
+            for searchFullText in [fullText, False]:
+                c.fullText = searchFullText
+                self.assertEqual(set(c.searchTracks('road')),
+                        set([road] if found else []))
+            c.fullText = fullText
+
+        # a release no longer has the recording, another still does
+        self.digestReleases((pinkMoon, makeReleaseXml(pinkMoon,
+                'Pink Moon', 'Nick Drake', 'Island', 'ILPS 9184',
+                media=[pinkMoonTracks[:2]])))
+        assertFound(True)
+        self.digestReleases((pinkMoon, makeReleaseXml(pinkMoon,
+                'Pink Moon', 'Nick Drake', 'Island', 'ILPS 9184',
+                media=[pinkMoonTracks])))
+        c.deleteRelease(compilation)
+        assertFound(True)
+        rows = self.getDerivedRows()
+        c.rebuildDerivedTables(c).run()
+        self.assertEqual(self.getDerivedRows(), rows)
+
+        c.deleteRelease(pinkMoon)
+        assertFound(False)
+
+    def test_rebuild(self):
+        c = self.catalog
+        c.rebuildDerivedTables(c).run()
+        self.assertEqual(c.search('pink moon'), [pinkMoon])
+        self.assertEqual(len(c.searchTracks('moon')), 2)
+
+    def test_parallel_rebuild(self):
+        c = self.catalog
+        # the workers decompress the XML with the catalog's dictionary
+        c.recompressMeta(c).run()
+        c.rebuildDerivedTables(c).run()
+        rows = self.getDerivedRows()
+        c.rebuildDerivedTables(c, processes=2).run()
+        self.assertEqual(self.getDerivedRows(), rows)
+        self.assertEqual(c.search('pink moon'), [pinkMoon])
+        self.assertEqual(c.getTrackCount(harvest), 3)
+
+    def test_rebuild_merged(self):
+        c = self.catalog
+        # a release whose XML now has the ID it was merged into, last in
+        # the chunk
+        merged = 'ffffffff-ffff-4fff-8fff-ffffffffffff'
+        c.cm.execute('update releases set id=? where id=?', (merged, harvest))
+        c.cm.commit()
+        # renaming the release fetches it again
+        harvestXml = c.getReleaseXml(merged)
+        c.fetchReleaseMetaXml = lambda releaseId: harvestXml
+        c.getCoverArt = lambda releaseId, maxage: None
+        c.rebuildDerivedTables(c).run()
+        self.assertFalse(merged in c)
+        self.assertEqual(c.search('reprise'), [harvest])
+        self.assertEqual(c.getRelease(harvest)['title'], 'Harvest Moon')
+        self.assertEqual(c.cm.executeAndFetch('select title, label '
+                'from releases order by title'),
+                [('Harvest Moon', 'Reprise'), ('Pink Moon', 'Island')])
+
+    def test_complete_word(self):
+        c = self.catalog
+        self.assertEqual(c.completeWord('Mo'), ['moon'])
+        self.assertEqual(c.completeWord('n'), ['neil', 'nick'])
+        self.assertEqual(c.completeWord('n', limit=1), ['neil'])
+        self.assertEqual(c.completeWord(''), [])
+        self.assertEqual(c.cm.executeAndFetchOne(
+                'select releases from word_counts where word="moon"')[0], 2)
+        c.deleteRelease(pinkMoon)
+        self.assertEqual(c.completeWord('pi'), [])
+        self.assertEqual(c.cm.executeAndFetchOne(
+                'select releases from word_counts where word="moon"')[0], 1)
+
+    def test_similar_words(self):
+        c = self.catalog
+        self.assertEqual(c.similarWords('hendirx', limit=1)[0][0], 'hendrix')
+        self.assertEqual(c.similarWords('moon', limit=1), [('moon', 1.0)])
+        self.assertEqual(set(c.cm.executeAndChain(
+                'select trigram from word_trigrams where word="moon"')),
+                mbcat.search.trigrams('moon'))
+        self.assertEqual(c.correctQuery('Pinc moom'), 'pink moon')
+        self.assertEqual(c.correctQuery('pink xyzzy'), 'pink xyzzy')
+        # nothing to correct, so the query is the same to retry with
+        self.assertEqual(c.correctQuery('Pink  Moon'), 'Pink  Moon')
+        self.assertEqual(c.search(c.correctQuery('drak')), [pinkMoon])
+
+        c.rebuildDerivedTables(c).run()
+        self.assertEqual(c.similarWords('legnd', limit=1)[0][0], 'legend')
+
+    def test_words_fallback(self):
+        self.catalog.fullText = False
+        self.assertEqual(self.catalog.search('pink moon'), [pinkMoon])
+        self.assertEqual(self.catalog.search('Moon  pink moon'), [pinkMoon])
+        self.assertEqual(sorted(self.catalog.search('moon')),
+                sorted([pinkMoon, harvest]))
+        self.assertEqual(self.catalog.search('pink nonexistent'), [])
+        self.assertEqual(self.catalog.search(' '), [])
+        self.assertEqual(len(self.catalog.searchTracks('legend')), 1)
+        self.assertEqual(len(self.catalog.searchTracks('harvest moon')), 1)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SearchTest))
+    return suite
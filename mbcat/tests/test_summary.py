@@ -0,0 +1,87 @@
+"""Unit test for the mbcat release summary table"""
+# Python 2/3 compatibility
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import fixtures
+
+releaseId = '11111111-1111-4111-8111-111111111111'
+
+releaseXml = fixtures.makeReleaseXml(releaseId, date='2001', country='US',
+        barcode='123456789012',
+        media=[[('Song 1', 1000), ('Song 2', 2000)], [('Song 3', 4000)]],
+        discs={1: [('abcdefghijklmnopqrstuvwxyz1-', 100000)]})
+
+class SummaryTest(fixtures.CatalogTestCase):
+    def setUp(self):
+        fixtures.CatalogTestCase.setUp(self)
+        self.digestReleases((releaseId, releaseXml))
+
+    def assertSummaryMatches(self):
+        """Check the summary against the getters which compute it."""
+        c = self.catalog
+        summary = c.getReleaseSummary(releaseId)
+        checkedOut = c.getCheckOutStatus(releaseId)
+        self.assertEqual(summary['firstAdded'], c.getFirstAdded(releaseId))
+        self.assertEqual(summary['lastListened'],
+                c.getLastListened(releaseId))
+        self.assertEqual(summary['borrower'],
+                checkedOut[0] if checkedOut else None)
+        self.assertEqual(summary['trackCount'], c.getTrackCount(releaseId))
+        self.assertEqual(summary['length'], c.getReleaseLen(releaseId))
+        self.assertEqual(sorted(summary['digitalFormats']),
+                sorted(c.getDigitalFormats(releaseId)))
+        self.assertEqual(summary['rating'], c.getRating(releaseId))
+        return summary
+
+    def test_new_release(self):
+        summary = self.assertSummaryMatches()
+        self.assertEqual(summary['trackCount'], 3)
+        self.assertEqual(summary['length'], 7000)
+
+    def test_events(self):
+        c = self.catalog
+        c.addListenDate(releaseId, 100.0)
+        c.addAddedDate(releaseId, 50.0)
+        self.assertEqual(self.assertSummaryMatches()['firstAdded'], 50.0)
+        self.assertEqual(c.cm.executeAndFetchOne('select firstadded '
+                'from releases where id=?', (releaseId,))[0], 50.0)
+        # as scripts/get-old-added-dates.py changes it
+        c.cm.execute('update releases set firstadded=25.0')
+        c.cm.commit()
+        self.assertEqual(self.assertSummaryMatches()['firstAdded'], 25.0)
+
+        c.addCheckOutEvent(releaseId, 'Friend', 200.0)
+        self.assertEqual(self.assertSummaryMatches()['borrower'], 'Friend')
+        c.addCheckInEvent(releaseId, 300.0)
+        self.assertEqual(self.assertSummaryMatches()['borrower'], None)
+
+        c.addDigitalPathRoot('root', self.tmpDir)
+        c.addDigitalPath(releaseId, 'flac', 'root', 'a')
+        c.addDigitalPath(releaseId, 'mp3', 'root', 'b')
+        self.assertSummaryMatches()
+        c.deleteDigitalPath(releaseId, 'root', 'b')
+        self.assertEqual(self.assertSummaryMatches()['digitalFormats'],
+                ['flac'])
+        c.deleteDigitalPathRoot('root')
+        self.assertEqual(self.assertSummaryMatches()['digitalFormats'], [])
+
+    def test_rebuild(self):
+        self.catalog.cm.execute('delete from release_summary')
+        self.catalog.rebuildDerivedTables(self.catalog).run()
+        self.assertEqual(self.assertSummaryMatches()['trackCount'], 3)
+
+    def test_media_tracks(self):
+        media = self.catalog.getMediaTracks(releaseId)
+        self.assertEqual([(position, len(tracks))
+                for mediumId, position, format, tracks in media],
+                [(1, 2), (2, 1)])
+        self.assertEqual([title for recId, length, position, title
+                in media[0][3]], ['Song 1', 'Song 2'])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SummaryTest))
+    return suite
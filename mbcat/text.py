@@ -0,0 +1,75 @@
+"""
+Normalization and tokenization of text, shared by the search indexes and
+the search for digital copies.
+
+Text is folded by decomposing it (Unicode NFKD), dropping the accents and
+mapping typographic punctuation and a few letters which do not decompose to
+ASCII, so that a letter with or without an accent, or a curly and a
+straight apostrophe, are the same. Folding a string is cached, as the same
+artist and label names come up over and over.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import re
+import unicodedata
+
+foldTable = {
+    # quotes and apostrophes
+    0x2018: "'", 0x2019: "'", 0x201A: "'", 0x201B: "'", 0x2032: "'",
+    0x00B4: "'", 0x201C: '"', 0x201D: '"', 0x201E: '"', 0x2033: '"',
+    # hyphens and dashes
+    0x2010: '-', 0x2011: '-', 0x2012: '-', 0x2013: '-', 0x2014: '-',
+    0x2015: '-', 0x2212: '-',
+    # letters which have no decomposition
+    0x00C6: 'AE', 0x00E6: 'ae', 0x0152: 'OE', 0x0153: 'oe',
+    0x00D8: 'O', 0x00F8: 'o', 0x0110: 'D', 0x0111: 'd', 0x00D0: 'D',
+    0x00F0: 'd', 0x0141: 'L', 0x0142: 'l', 0x00DE: 'Th', 0x00FE: 'th',
+    0x00DF: 'ss',
+    }
+
+# Words, including those joined by punctuation like "AC/DC" and "don't"
+wordPattern = re.compile(r"\w+(?:['./-]\w+)*", re.UNICODE)
+partPattern = re.compile(r'\w+', re.UNICODE)
+
+cacheSize = 10000
+_folded = dict()
+
+def _fold(s):
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
+    folded = _folded.get(s)
+    if folded is None:
+        folded = ''.join(c for c in unicodedata.normalize('NFKD', s)
+                if not unicodedata.combining(c)).translate(foldTable)
+        if len(_folded) >= cacheSize:
+            _folded.clear()
+        _folded[s] = folded
+    return folded
+
+def fold(s):
+    """Fold a string for the search indexes, in lower case."""
+    return _fold(s).lower()
+
+def asciiFold(s):
+    """Fold a string, keeping its case, and drop anything not ASCII."""
+    return _fold(s).encode('ascii', 'ignore').decode('ascii')
+
+def tokenize(s):
+    """
+    Return the list of the words in a string for the search indexes. The
+    punctuation inside a word is dropped, so "AC/DC" is "acdc", and its parts
+    longer than a letter come first: "ac", "dc", "acdc".
+    """
+    words = []
+    for word in wordPattern.findall(fold(s)):
+        parts = partPattern.findall(word)
+        if len(parts) > 1:
+            words.extend(part for part in parts if len(part) > 1)
+        words.append(''.join(parts))
+    return words
+
+def searchText(s):
+    """The words of a string as text for the full-text search tables."""
+    if s is None:
+        return None
+    return ' '.join(tokenize(s))
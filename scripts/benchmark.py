@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the catalog database layer. Each benchmark builds a synthetic
+catalog of randomly generated releases in a temporary directory, so no network
+access is needed.
+
+Examples:
+    python scripts/benchmark.py reads --releases 5000
+    python scripts/benchmark.py rebuild --releases 5000
+    python scripts/benchmark.py stream --releases 5000
+    python scripts/benchmark.py getters --releases 5000
+    python scripts/benchmark.py detail --releases 5000
+    python scripts/benchmark.py refresh --releases 50000
+    python scripts/benchmark.py search --releases 5000
+    python scripts/benchmark.py complete --releases 100000
+    python scripts/benchmark.py fuzzy --releases 20000
+    python scripts/benchmark.py release --releases 5000
+    python scripts/benchmark.py compress --releases 5000
+    python scripts/benchmark.py scan --releases 50000
+    python scripts/benchmark.py size --releases 20000
+    python scripts/benchmark.py redigest --releases 5000
+    python scripts/benchmark.py unchanged --releases 5000
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+logging.basicConfig(level=logging.WARNING)
+
+import mbcat.catalog
+
+words = ('the love night blue moon song day heart time world dream fire '
+    'rain road light dark gold sky sea star river city girl boy home '
+    'black white red summer winter stone young wild lost sweet').split()
+
+def randomPhrase(rng, n, vocabulary=words):
+    return ' '.join(rng.choice(vocabulary) for i in range(n)).title()
+
+def randomId(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def randomWords(rng, n):
+    """Make up a vocabulary of n words."""
+    return [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+            for i in range(rng.randint(3, 9))) for j in range(n)]
+
+def makeReleaseXml(rng, releaseId, numMedia=1, numTracks=10,
+        vocabulary=words):
+    """Return MusicBrainz web service XML for a made-up release."""
+    media = []
+    for m in range(numMedia):
+        tracks = ''.join(
+            '<track id="%s"><position>%d</position><number>%d</number>'
+            '<recording id="%s"><title>%s</title><length>%d</length>'
+            '</recording></track>' % (
+                randomId(rng), t+1, t+1, randomId(rng),
+                randomPhrase(rng, rng.randint(1, 4), vocabulary),
+                rng.randint(60000, 400000))
+            for t in range(numTracks))
+        media.append(
+            '<medium><position>%d</position><format>CD</format>'
+            '<disc-list count="1"><disc id="%s"><sectors>%d</sectors></disc>'
+            '</disc-list><track-list count="%d" offset="0">%s</track-list>'
+            '</medium>' % (
+                m+1,
+                ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789')
+                    for i in range(27))+'-',
+                rng.randint(1000, 300000), numTracks, tracks))
+    artist = randomPhrase(rng, rng.randint(1, 3), vocabulary)
+    xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#">'
+        '<release id="%s"><title>%s</title><status>Official</status>'
+        '<date>%d</date><country>US</country><barcode>%d</barcode>'
+        '<asin>B00%07d</asin>'
+        '<artist-credit><name-credit><artist id="%s"><name>%s</name>'
+        '<sort-name>%s</sort-name></artist></name-credit></artist-credit>'
+        '<label-info-list count="1"><label-info>'
+        '<catalog-number>CAT %d</catalog-number>'
+        '<label id="%s"><name>%s Records</name></label>'
+        '</label-info></label-info-list>'
+        '<medium-list count="%d">%s</medium-list>'
+        '</release></metadata>') % (
+            releaseId, randomPhrase(rng, rng.randint(1, 5), vocabulary),
+            rng.randint(1950, 2015), rng.randint(10**11, 10**12-1),
+            rng.randint(0, 10**7-1), randomId(rng), artist, artist,
+            rng.randint(1, 99999), randomId(rng),
+            randomPhrase(rng, 1, vocabulary),
+            numMedia, ''.join(media))
+    return xml.encode('utf-8')
+
+def makeCatalog(dirPath, numReleases, seed=0, commitEvery=500,
+        vocabulary=words):
+    """Create a catalog in dirPath and fill it with synthetic releases."""
+    rng = random.Random(seed)
+    c = mbcat.catalog.Catalog(os.path.join(dirPath, 'bench.sqlite3'),
+            os.path.join(dirPath, 'cache'))
+    print('Building synthetic catalog of %d releases...' % numReleases)
+    for i in range(numReleases):
+        releaseId = randomId(rng)
+        c.digestReleaseXml(releaseId, makeReleaseXml(rng, releaseId,
+                numMedia=rng.choice([1, 1, 1, 2]),
+                numTracks=rng.randint(4, 16), vocabulary=vocabulary))
+        if i % commitEvery == commitEvery-1:
+            c.cm.commit()
+    c.cm.commit()
+    return c
+
+def timeCalls(fun, args=(), repeat=100):
+    """Call fun(*args) repeatedly and return the latency of each call."""
+    latencies = []
+    for i in range(repeat):
+        start = time.time()
+        fun(*args)
+        latencies.append(time.time() - start)
+    return latencies
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    print('%-36s n=%-5d min %8.2f  median %8.2f  p95 %8.2f  max %8.2f ms' % (
+        name, n,
+        latencies[0]*1000,
+        latencies[n//2]*1000,
+        latencies[min(n-1, int(n*0.95))]*1000,
+        latencies[-1]*1000))
+
+def benchReads(args):
+    """Read latency while rebuildDerivedTables() holds the writer busy."""
+    for readers in [0, mbcat.catalog.Catalog.readerCount or 2]:
+        mbcat.catalog.Catalog.readerCount = readers
+        tmpDir = tempfile.mkdtemp()
+        try:
+            c = makeCatalog(tmpDir, args.releases)
+            releaseIds = c.getReleaseIds()
+            rng = random.Random(1)
+
+            print('\n%d reader connection(s)' % readers)
+            report('getRating (idle)', timeCalls(
+                lambda: c.getRating(rng.choice(releaseIds))))
+
+            task = c.rebuildDerivedTables(c)
+            task.start()
+            # let the rebuild get going
+            time.sleep(0.5)
+            report('getRating (during rebuild)', timeCalls(
+                lambda: c.getRating(rng.choice(releaseIds))))
+            report('getAdvTable (during rebuild)', timeCalls(
+                c.getAdvTable, repeat=5))
+            task.stop()
+            task.join()
+            c.cm.stop()
+        finally:
+            shutil.rmtree(tmpDir)
+
+def benchRebuild(args):
+    """Throughput of importing releases and of rebuildDerivedTables()."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        c = makeCatalog(tmpDir, args.releases)
+        elapsed = time.time() - start
+        print('Imported %d releases in %.2f s (%.0f releases/s)' % (
+            args.releases, elapsed, args.releases/elapsed))
+
+        for processes in ([args.processes] if args.processes else
+                sorted(set([1, multiprocessing.cpu_count()]))):
+            task = c.rebuildDerivedTables(c, processes=processes)
+            start = time.time()
+            task.run()
+            elapsed = time.time() - start
+            print('Rebuilt derived tables for %d releases in %.2f s '
+                '(%.0f releases/s) with %d process(es)' % (args.releases,
+                    elapsed, args.releases/elapsed, processes))
+        c.cm.stop()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchStream(args):
+    """Time to the first row and to the last row of the release table,
+    fetched all at once and streamed."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        with c.transaction():
+            for releaseId in c.getReleaseIds():
+                c.addAddedDate(releaseId, time.time())
+
+        for name, fetch in [
+                ('getAdvTable', c.getAdvTable),
+                ('iterAdvTable', c.iterAdvTable)]:
+            first = []
+            total = []
+            for i in range(5):
+                start = time.time()
+                rows = iter(fetch())
+                next(rows)
+                first.append(time.time() - start)
+                for row in rows:
+                    pass
+                total.append(time.time() - start)
+            report(name+' (first row)', first)
+            report(name+' (all rows)', total)
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchGetters(args):
+    """Latency of the per-release getters with the indexes of the first
+    schema migration, and without them as in an old catalog."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        rng = random.Random(2)
+        releaseIds = c.getReleaseIds()
+        with c.transaction():
+            for releaseId in releaseIds:
+                c.addAddedDate(releaseId, time.time())
+                c.addListenDate(releaseId, time.time())
+                c.addPurchase(releaseId, time.time(), 9.99, 'Shop')
+                if rng.random() < 0.1:
+                    c.addCheckOutEvent(releaseId, 'Friend', time.time())
+
+        getters = ['getFirstAdded', 'getLastListened', 'getAddedDates',
+            'getPurchases', 'getCheckOutStatus', 'getTrackCount',
+            'getReleaseLen']
+        oldIndexes = [name for name in c.cm.executeAndChain(
+                'select name from sqlite_master where type="index"')
+                if name in c.migrations[0]]
+
+        for label in ['with indexes', 'without indexes']:
+            if label == 'without indexes':
+                for name in oldIndexes:
+                    c.cm.execute('drop index %s' % name)
+                c.cm.commit()
+            print('\n%s' % label)
+            for getter in getters:
+                fun = getattr(c, getter)
+                report(getter, timeCalls(
+                    lambda: fun(rng.choice(releaseIds)), repeat=200))
+            report('getReleaseIdsByFormat', timeCalls(
+                c.getReleaseIdsByFormat, ('CD',), repeat=20))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchDetail(args):
+    """Time to gather what the GTK detail pane shows for a release, one
+    getter at a time and from the release summary."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        rng = random.Random(3)
+        releaseIds = c.getReleaseIds()
+
+        def getters(releaseId):
+            c.getMetaTime(releaseId)
+            c.getFirstAdded(releaseId)
+            c.getLastListened(releaseId)
+            c.getDigitalFormats(releaseId)
+            c.getRating(releaseId)
+            c.getCopyCount(releaseId)
+            c.getCheckOutStatus(releaseId)
+            for mediumId, position, format in c.cm.executeAndFetch(
+                    'select id,position,format from media '
+                    'where release=(select key from releases where id=?) '
+                    'order by position', (releaseId,)):
+                c.cm.executeAndFetch(
+                    'select recordings.id, recordings.length, '
+                    'medium_recordings.position, recordings.title '
+                    'from recordings '
+                    'inner join medium_recordings on '
+                    'medium_recordings.recording=recordings.key '
+                    'where medium_recordings.medium=? '
+                    'order by medium_recordings.position', (mediumId,))
+                c.getMediumLen(mediumId)
+
+        def summary(releaseId):
+            c.getReleaseSummary(releaseId)
+            c.getMediaTracks(releaseId)
+
+        for name, fun in [('getters', getters), ('summary', summary)]:
+            report('detail pane (%s)' % name, timeCalls(
+                lambda: fun(rng.choice(releaseIds)), repeat=500))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchRefresh(args):
+    """Time to refresh the GTK release list, grouping the added dates on
+    every refresh as before and reading the first added date stored with
+    each release."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        with c.transaction():
+            for releaseId in c.getReleaseIds():
+                c.addAddedDate(releaseId, time.time())
+                c.addAddedDate(releaseId, time.time())
+
+        columns = c.basicColumns[:]
+        idIndex = columns.index('id')
+        columns[idIndex] = 'release'
+        releaseColumns = c.basicColumns[:]
+        del releaseColumns[idIndex]
+        groupByQuery = 'select '+', '.join(columns + [
+            'datetime(min_date, \'unixepoch\', \'localtime\')'])+\
+            ' from (select d.release, min(d.date) as min_date, '+\
+            ', '.join(['r.'+col for col in releaseColumns])+\
+            ' from added_dates as d inner join releases as r '+\
+            'on r.id = d.release group by release) order by sortstring'
+
+        report('getAdvTable (group by)', timeCalls(
+            c.cm.executeAndFetch, (groupByQuery,), repeat=10))
+        report('getAdvTable (firstadded)', timeCalls(
+            c.getAdvTable, repeat=10))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchSearch(args):
+    """Latency of release and track searches with the full-text index and
+    with the word tables."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        rng = random.Random(4)
+        queries = [randomPhrase(rng, rng.randint(1, 3)) for i in range(50)]
+        fullText = c.fullText
+        for label, c.fullText in [('full-text', fullText),
+                ('words', False)]:
+            if label == 'full-text' and not fullText:
+                print('SQLite has no FTS5 extension')
+                continue
+            print('\n%s' % label)
+            report('search', timeCalls(
+                lambda: c.search(rng.choice(queries)), repeat=200))
+            report('searchTracks', timeCalls(
+                lambda: c.searchTracks(rng.choice(queries)), repeat=200))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchComplete(args):
+    """Latency of completing search terms from prefixes of one to three
+    letters, in a catalog with a vocabulary of a word per release."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        rng = random.Random(5)
+        c = makeCatalog(tmpDir, args.releases,
+                vocabulary=randomWords(rng, args.releases))
+        print('%d words' % c.cm.executeAndFetchOne(
+                'select count(*) from word_counts')[0])
+        vocabulary = c.cm.executeAndChain('select word from word_counts')
+        for length in [1, 2, 3]:
+            report('completeWord (%d letters)' % length, timeCalls(
+                lambda: c.completeWord(rng.choice(vocabulary)[:length]),
+                repeat=500))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def misspell(rng, word):
+    """Drop, double or replace one letter of a word."""
+    i = rng.randrange(len(word))
+    return rng.choice([
+        word[:i] + word[i+1:],
+        word[:i] + word[i] + word[i:],
+        word[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + word[i+1:]])
+
+def benchFuzzy(args):
+    """Latency and accuracy of finding the indexed words most similar to a
+    misspelled word, in a catalog with a vocabulary of a word per release."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        rng = random.Random(6)
+        c = makeCatalog(tmpDir, args.releases,
+                vocabulary=randomWords(rng, args.releases))
+        vocabulary = c.cm.executeAndChain('select word from word_counts')
+        print('%d words, %d trigrams' % (len(vocabulary),
+                c.cm.executeAndFetchOne(
+                'select count(*) from word_trigrams')[0]))
+        found = []
+        def similarWords():
+            word = rng.choice(vocabulary)
+            found.append(word in [similar for similar, similarity in
+                    c.similarWords(misspell(rng, word), limit=5)])
+        report('similarWords', timeCalls(similarWords, repeat=500))
+        print('The word was among the 5 most similar %.0f%% of the time' % (
+                100.0*sum(found)/len(found)))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchRelease(args):
+    """Throughput of getRelease() loading the stored parsed releases and
+    parsing the XML, as it did before, each without the release cache, and
+    of loading each release twice, as the search for digital copies does,
+    with and without the cache."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        rng = random.Random(7)
+        releaseIds = c.getReleaseIds()
+
+        def twice():
+            releaseId = rng.choice(releaseIds)
+            c.getRelease(releaseId)
+            c.getRelease(releaseId)
+
+        cacheSize = c.releaseCacheSize
+        for label, size, fun in [
+                ('twice, cached', cacheSize, twice),
+                ('twice', 0, twice),
+                ('parsed', 0, lambda: c.getRelease(rng.choice(releaseIds))),
+                ('XML', 0, lambda: c.getRelease(rng.choice(releaseIds)))]:
+            if label == 'XML':
+                c.cm.execute('delete from release_dicts')
+                c.cm.commit()
+            c.setReleaseCacheSize(size)
+            latencies = timeCalls(fun, repeat=2000)
+            report('getRelease (%s)' % label, latencies)
+            print('%.0f calls/s' % (len(latencies)/sum(latencies)))
+        print('cache: %(hits)d hits, %(misses)d misses' %
+                c.releaseCacheStats())
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchCompress(args):
+    """Size of the release XML and speed of compressing and decompressing
+    it with zlib alone and with a dictionary made from a sample."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        docs = [metaXml for releaseId, metaXml in c.iterReleaseXml()]
+        rawSize = sum(len(doc) for doc in docs)
+        print('%d releases, %d bytes of XML' % (len(docs), rawSize))
+
+        start = time.time()
+        c.trainMetaDictionary()
+        print('Made a dictionary in %.2f s' % (time.time() - start))
+        dictionaryId = c.metaDictionary
+        for label, metaDictionary in [
+                ('zlib', None), ('dictionary', dictionaryId)]:
+            c.metaDictionary = metaDictionary
+            start = time.time()
+            compressed = [c.compressMeta(doc) for doc in docs]
+            compressTime = time.time() - start
+            start = time.time()
+            for meta in compressed:
+                c.decompressMeta(meta)
+            decompressTime = time.time() - start
+            size = sum(len(meta) for meta in compressed)
+            print('%-10s %9d bytes (%4.1f%%)  compress %6.1f MB/s  '
+                'decompress %6.1f MB/s' % (label, size, 100.0*size/rawSize,
+                rawSize/compressTime/1e6, rawSize/decompressTime/1e6))
+
+        task = c.recompressMeta(c, train=False)
+        start = time.time()
+        task.run()
+        print('Recompressed %d releases in %.2f s' % (
+            len(docs), time.time() - start))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchScan(args):
+    """Time of the queries which scan the whole releases table."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        for name, fun in [
+                ('getBasicTable', c.getBasicTable),
+                ('getSortedList', c.getSortedList),
+                ('checkReleases', c.checkReleases),
+                ('getAdvTable', c.getAdvTable)]:
+            report(name, timeCalls(fun, repeat=10))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchSize(args):
+    """Size of the database and of the derived tables and their indexes,
+    and the latency of the searches and joins through them."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        c.cm.execute('vacuum')
+        print('database %.1f MB' % (
+            os.path.getsize(c.dbPath)/float(2**20)))
+        for table in ['words', 'trackwords', 'media', 'medium_recordings',
+                'discids']:
+            print('%-20s %8.1f MB with indexes' % (table,
+                c.cm.executeAndFetchOne('select sum(pgsize) from dbstat '
+                'where name=? or name in (select name from sqlite_master '
+                'where type="index" and tbl_name=?)',
+                (table, table))[0]/float(2**20)))
+
+        rng = random.Random(8)
+        releaseIds = c.getReleaseIds()
+        recordingIds = c.cm.executeAndChain('select id from recordings')
+        queries = [randomPhrase(rng, rng.randint(1, 3)) for i in range(50)]
+        c.fullText = False
+        for name, fun in [
+                ('search (words)', lambda: c.search(rng.choice(queries))),
+                ('searchTracks (words)',
+                    lambda: c.searchTracks(rng.choice(queries))),
+                ('getMediaTracks',
+                    lambda: c.getMediaTracks(rng.choice(releaseIds))),
+                ('getReleaseLen',
+                    lambda: c.getReleaseLen(rng.choice(releaseIds))),
+                ('recordingGetReleases',
+                    lambda: c.recordingGetReleases(rng.choice(recordingIds)))]:
+            report(name, timeCalls(fun, repeat=500))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchRedigest(args):
+    """Time and rows written to re-digest every release with the metadata
+    it already has, as refreshing an unchanged catalog does."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        metaXml = [(releaseId, c.getReleaseXml(releaseId))
+            for releaseId in c.getReleaseIds()]
+        changes = lambda: c.cm.queueAndGet(lambda: c.cm.conn.total_changes)
+        before = changes()
+        start = time.time()
+        with c.transaction():
+            for releaseId, xml in metaXml:
+                c.digestReleaseXml(releaseId, xml)
+        elapsed = time.time() - start
+        print('Re-digested %d releases in %.2f s (%.0f releases/s), '
+            '%d rows written' % (len(metaXml), elapsed,
+                len(metaXml)/elapsed, changes() - before))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+def benchUnchanged(args):
+    """Time and rows written to refresh every release through addRelease()
+    when MusicBrainz returns the same metadata as before. The fetch is
+    replaced by a lookup of the stored XML."""
+    tmpDir = tempfile.mkdtemp()
+    try:
+        c = makeCatalog(tmpDir, args.releases)
+        metaXml = dict((releaseId, c.getReleaseXml(releaseId))
+            for releaseId in c.getReleaseIds())
+        c.fetchReleaseMetaXml = metaXml.get
+        c.getCoverArt = lambda releaseId, maxage: None
+        changes = lambda: c.cm.queueAndGet(lambda: c.cm.conn.total_changes)
+        before = changes()
+        start = time.time()
+        with c.transaction():
+            for releaseId in metaXml:
+                c.addRelease(releaseId)
+        elapsed = time.time() - start
+        print('Refreshed %d releases in %.2f s (%.0f releases/s), '
+            '%d rows written' % (len(metaXml), elapsed,
+                len(metaXml)/elapsed, changes() - before))
+        c.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+benchmarks = {
+    'reads': benchReads,
+    'rebuild': benchRebuild,
+    'stream': benchStream,
+    'getters': benchGetters,
+    'detail': benchDetail,
+    'refresh': benchRefresh,
+    'search': benchSearch,
+    'complete': benchComplete,
+    'fuzzy': benchFuzzy,
+    'release': benchRelease,
+    'compress': benchCompress,
+    'scan': benchScan,
+    'size': benchSize,
+    'redigest': benchRedigest,
+    'unchanged': benchUnchanged,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Benchmark the catalog database layer')
+    parser.add_argument('benchmark', choices=sorted(benchmarks.keys()),
+            help='Which benchmark to run')
+    parser.add_argument('--releases', type=int, default=2000,
+            help='Number of releases in the synthetic catalog')
+    parser.add_argument('--processes', type=int, default=None,
+            help='Worker processes for the rebuild benchmark (default: '
+            'compare 1 with one for each core)')
+    args = parser.parse_args()
+
+    benchmarks[args.benchmark](args)
@@ -77,6 +77,13 @@ def import_added_dates(master_conn, master_c, db_file):
                 #print ("Exists", releaseId, added_date)
                 existing += 1
 
+    try:
+        # keep the first added date stored with each release up to date
+        master_c.execute('update releases set firstadded=(select min(date) '
+            'from added_dates where release=releases.id)')
+    except sqlite3.OperationalError as e:
+        # an older catalog, the schema upgrade will fill this in
+        print (e)
     master_conn.commit()
     print ("Added", added, "Existing", existing)
 